@@ -13,6 +13,7 @@ from fastcs_eiger import __version__
 from fastcs_eiger.controllers.eiger_controller import EigerController
 from fastcs_eiger.controllers.odin.eiger_odin_controller import EigerOdinController
 from fastcs_eiger.eiger_parameter import EigerAPIVersion
+from fastcs_eiger.http_connection import ConnectionPoolSettings
 
 __all__ = ["main"]
 
@@ -52,6 +53,24 @@ def ioc(
     api_version: EigerAPIVersion = typer.Option("1.8.0", help="Version of Eiger API"),  # noqa: B008
     odin_ip: str | None = typer.Option(None, help="IP address of odin control server"),
     odin_port: int = typer.Option(8888, help="Port of odin control server"),
+    max_connections: int = typer.Option(
+        8, help="Maximum simultaneous HTTP connections to Eiger detector"
+    ),
+    keepalive_timeout: float = typer.Option(
+        30, help="Time in seconds to keep idle HTTP connections open"
+    ),
+    prewarm_connections: int = typer.Option(
+        0, help="Number of HTTP connections to open on startup"
+    ),
+    request_window: int = typer.Option(
+        8, help="Maximum HTTP requests in flight at once for bulk reads"
+    ),
+    request_timeout: float = typer.Option(
+        3, help="Timeout in seconds for HTTP GET requests"
+    ),
+    schema_cache_dir: Path | None = typer.Option(  # noqa: B008
+        None, help="Directory to cache detector parameters in for faster startup"
+    ),
     log_level: LogLevel = LogLevel.TRACE,
 ):
     ui_path = OPI_PATH if OPI_PATH.is_dir() else Path.cwd() / "opi"
@@ -59,16 +78,28 @@ def ioc(
     configure_logging(log_level)
     intercept_std_logger("root")
 
+    pool_settings = ConnectionPoolSettings(
+        limit=max_connections,
+        keepalive_timeout=keepalive_timeout,
+        prewarm=prewarm_connections,
+        bulk_window=request_window,
+        request_timeout=request_timeout,
+    )
+
     if odin_ip is None:
         controller = EigerController(
             connection_settings=IPConnectionSettings(ip=ip, port=port),
             api_version=api_version,
+            pool_settings=pool_settings,
+            schema_cache_dir=schema_cache_dir,
         )
     else:
         controller = EigerOdinController(
             detector_connection_settings=IPConnectionSettings(ip=ip, port=port),
             odin_connection_settings=IPConnectionSettings(ip=odin_ip, port=odin_port),
             api_version=api_version,
+            pool_settings=pool_settings,
+            schema_cache_dir=schema_cache_dir,
         )
 
     transports = [
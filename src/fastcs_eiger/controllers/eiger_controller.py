@@ -1,103 +1,413 @@
 import asyncio
-from collections.abc import Coroutine
+import enum
+import time
+from collections import defaultdict
+from collections.abc import Iterable
+from pathlib import Path
 
 from fastcs.attributes import AttrR, AttrRW
 from fastcs.connections import IPConnectionSettings
 from fastcs.controllers import Controller
-from fastcs.datatypes import Bool, Int
+from fastcs.datatypes import Bool, Enum, Float, Int, String
 from fastcs.logging import logger
 from fastcs.methods import command, scan
 
 from fastcs_eiger.controllers.eiger_detector_controller import EigerDetectorController
+from fastcs_eiger.controllers.eiger_filewriter_controller import (
+    EigerFilewriterController,
+)
 from fastcs_eiger.controllers.eiger_monitor_controller import EigerMonitorController
 from fastcs_eiger.controllers.eiger_stream_controller import EigerStreamController
-from fastcs_eiger.controllers.eiger_subsystem_controller import EigerSubsystemController
+from fastcs_eiger.controllers.eiger_subsystem_controller import (
+    POLLING_GROUP,
+    EigerSubsystemController,
+)
+from fastcs_eiger.dependency_graph import DependencyCache
 from fastcs_eiger.eiger_parameter import EIGER_PARAMETER_SUBSYSTEMS, EigerAPIVersion
-from fastcs_eiger.http_connection import HTTPConnection, HTTPRequestError
+from fastcs_eiger.http_connection import (
+    ConnectionPoolSettings,
+    HTTPConnection,
+    HTTPRequestError,
+)
+from fastcs_eiger.polling import PollThrottle
+from fastcs_eiger.schema_cache import (
+    Schema,
+    SchemaCache,
+    schema_diff,
+    serialise_parameters,
+)
 
 COMMAND_GROUP = "Command"
 
+ACQUIRING_STATES = {"ready", "acquire"}
+"""Detector states in which the detector is armed or acquiring"""
+
+
+class AcquisitionPolling(enum.Enum):
+    """Polling policy while the detector is armed or acquiring"""
+
+    FULL = "full"
+    """Poll as normal"""
+    REDUCED = "reduced"
+    """Poll parameters that are not kept at most once per acquisition poll period"""
+    SUSPENDED = "suspended"
+    """Only poll parameters that are kept"""
+
 
 class EigerController(Controller):
     """Root controller for Eiger detectors
 
     Args:
-        ip: IP address of Eiger detector
-        port: Port of Eiger detector
+        connection_settings: IP address and port of Eiger detector
+        api_version: Version of the Eiger API
+        pool_settings: Settings for the pool of HTTP connections to the detector
+        schema_cache_dir: Directory to cache introspected parameters in, to create
+            attributes from on the next startup, along with the parameters learned to
+            change when each parameter is put
     """
 
     detector: EigerDetectorController
 
     # Internal Attributes
     stale_parameters = AttrR(Bool())
+    introspection_duration = AttrR(
+        Float(units="s", prec=3),
+        description="Time taken to introspect the detector on startup",
+    )
+    bulk_request_throughput = AttrR(
+        Float(units="Hz", prec=1),
+        description="Mean requests completed per second by bulk reads",
+        group=POLLING_GROUP,
+    )
+    bulk_request_latency = AttrR(
+        Float(units="s", prec=4),
+        description="Mean latency of requests made by bulk reads",
+        group=POLLING_GROUP,
+    )
+    bulk_request_max_latency = AttrR(
+        Float(units="s", prec=4),
+        description="Longest latency of any request made by bulk reads",
+        group=POLLING_GROUP,
+    )
+    schema_drift = AttrR(
+        String(),
+        description="Parameters that differ between the detector and the schema cache",
+    )
+    update_debounce = AttrRW(
+        Float(units="s", min=0),
+        initial_value=0.0,
+        description="Time to wait for more parameters to be queued before updating",
+        group=COMMAND_GROUP,
+    )
+    write_through = AttrRW(
+        Bool(),
+        initial_value=True,
+        description="Update parameters that the detector takes exactly as put from "
+        "the value put, and read them back without marking parameters stale",
+        group=COMMAND_GROUP,
+    )
+    prefetch = AttrRW(
+        Bool(),
+        initial_value=True,
+        description="Fetch parameters changed by a put as soon as it returns, slowest "
+        "first, rather than when the update queue gets to them",
+        group=COMMAND_GROUP,
+    )
+    write_through_mismatches = AttrR(
+        Int(),
+        description="Parameters read back with a different value than was put",
+        group=COMMAND_GROUP,
+    )
     arm_timeout = AttrRW(
         Int(min=1),
         initial_value=3,
         description="Timeout for arm command",
         group=COMMAND_GROUP,
     )
+    acquisition_polling = AttrRW(
+        Enum(AcquisitionPolling),
+        initial_value=AcquisitionPolling.REDUCED,
+        description="Polling policy while the detector is armed or acquiring",
+        group=POLLING_GROUP,
+    )
+    acquisition_poll_period = AttrRW(
+        Float(units="s", min=0),
+        initial_value=5.0,
+        description="Minimum period between polls with reduced acquisition polling",
+        group=POLLING_GROUP,
+    )
+    acquisition_poll_keys = AttrRW(
+        String(),
+        initial_value="state,error",
+        description="Comma separated keys to keep polling during acquisitions",
+        group=POLLING_GROUP,
+    )
+    polling_throttled = AttrR(
+        Bool(),
+        description="Whether polling is restricted because the detector is acquiring",
+        group=POLLING_GROUP,
+    )
+    saved_requests = AttrR(
+        Int(),
+        description="Number of requests skipped while polling was restricted",
+        group=POLLING_GROUP,
+    )
 
     def __init__(
-        self, connection_settings: IPConnectionSettings, api_version: EigerAPIVersion
+        self,
+        connection_settings: IPConnectionSettings,
+        api_version: EigerAPIVersion,
+        pool_settings: ConnectionPoolSettings | None = None,
+        schema_cache_dir: Path | None = None,
     ) -> None:
         super().__init__()
         self.connection_settings = connection_settings
+        self._schema_cache_dir = schema_cache_dir
+        self._schema_cache: SchemaCache | None = None
+        self._dependency_cache: DependencyCache | None = None
+        self._cached_schema: Schema | None = None
+        self._schema_check_task: asyncio.Task | None = None
 
-        self.connection = HTTPConnection(connection_settings)
-        self._parameter_update_lock = asyncio.Lock()
-        self.queue = asyncio.Queue()
+        self.connection = HTTPConnection(connection_settings, pool_settings)
+        # Ordered set of (subsystem, key) of parameters waiting to be updated
+        self._pending_updates: dict[tuple[str, str], None] = {}
+        # Ordered set of (subsystem, key) of parameters waiting to be read back
+        self._pending_verifications: dict[tuple[str, str], None] = {}
+        self._updates_queued = asyncio.Event()
+        self._update_task: asyncio.Task | None = None
         self._api_version: EigerAPIVersion = api_version
+        self.write_through.add_on_update_callback(self._update_write_through)
+        self.prefetch.add_on_update_callback(self._update_prefetch)
+
+    def _create_subsystem_controller(self, subsystem: str) -> EigerSubsystemController:
+        match subsystem:
+            case "detector":
+                controller_cls = EigerDetectorController
+            case "monitor":
+                controller_cls = EigerMonitorController
+            case "stream":
+                controller_cls = EigerStreamController
+            case "filewriter":
+                controller_cls = EigerFilewriterController
+            case _:
+                raise NotImplementedError(
+                    f"No subcontroller implemented for subsystem {subsystem}"
+                )
+
+        controller = controller_cls(
+            self.connection,
+            self.queue_subsystem_update,
+            self._api_version,
+            self.queue_subsystem_verification,
+        )
+        controller.write_through = self.write_through.get()
+        controller.prefetch = self.prefetch.get()
+        return controller
 
     async def initialise(self) -> None:
         """Create attributes by introspecting detector.
 
-        The detector will be initialized if it is not already.
+        The detector will be initialized if it is not already. The subsystems are then
+        introspected concurrently.
 
         """
+        start = time.monotonic()
         self.connection.open()
 
         try:
-            for subsystem in EIGER_PARAMETER_SUBSYSTEMS:
-                match subsystem:
-                    case "detector":
-                        controller = EigerDetectorController(
-                            self.connection,
-                            self.queue_subsystem_update,
-                            self._api_version,
-                        )
-                        # detector subsystem initialises first
-                        # Check current state of detector_state to see
-                        # if initializing is required.
-                        state_val = await self.connection.get(
-                            f"detector/api/{self._api_version}/status/state"
-                        )
-                        if state_val["value"] == "na":
-                            print("Initializing Detector")
-                            # send initialize command to detector
-                            await controller.initialize()
-                    case "monitor":
-                        controller = EigerMonitorController(
-                            self.connection,
-                            self.queue_subsystem_update,
-                            self._api_version,
-                        )
-                    case "stream":
-                        controller = EigerStreamController(
-                            self.connection,
-                            self.queue_subsystem_update,
-                            self._api_version,
+            await self.connection.prewarm("detector/api/version/")
+
+            controllers = [
+                self._create_subsystem_controller(subsystem)
+                for subsystem in EIGER_PARAMETER_SUBSYSTEMS
+            ]
+            for subsystem, controller in zip(
+                EIGER_PARAMETER_SUBSYSTEMS, controllers, strict=True
+            ):
+                self.add_sub_controller(subsystem, controller)
+
+            # Check current state of detector_state to see if initializing is
+            # required before introspecting any subsystem
+            state_val = await self.connection.get(
+                f"detector/api/{self._api_version}/status/state"
+            )
+            if state_val["value"] == "na":
+                print("Initializing Detector")
+                # send initialize command to detector
+                await self.detector.initialize()
+
+            self._cached_schema = await self._load_schema_cache()
+            if self._cached_schema is not None:
+                logger.info("Creating attributes from schema cache")
+                await asyncio.gather(
+                    *[
+                        controller.initialise(
+                            controller.parameters_from_schema(
+                                self._cached_schema[subsystem]
+                            )
                         )
-                    case _:
-                        raise NotImplementedError(
-                            f"No subcontroller implemented for subsystem {subsystem}"
+                        for subsystem, controller in zip(
+                            EIGER_PARAMETER_SUBSYSTEMS, controllers, strict=True
                         )
-                self.add_sub_controller(subsystem, controller)
-                await controller.initialise()
+                    ]
+                )
+            else:
+                await asyncio.gather(
+                    *[controller.initialise() for controller in controllers]
+                )
+                if self._schema_cache is not None:
+                    self._schema_cache.save(self._schema())
 
         except HTTPRequestError:
             print("\nAn HTTP request failed while introspecting detector:\n")
             raise
 
+        await self.introspection_duration.update(time.monotonic() - start)
+        logger.info("Introspected detector", duration=self.introspection_duration.get())
+
+        match self.detector.attributes.get("state"):
+            case AttrR() as state:
+                state.add_on_update_callback(
+                    self._update_acquisition_polling, always=True
+                )
+
+        match (
+            self.detector.attributes.get("countrate_correction_count_cutoff"),
+            self.sub_controllers.get("monitor"),
+        ):
+            case AttrR() as count_cutoff, EigerMonitorController() as monitor:
+                count_cutoff.add_on_update_callback(monitor.update_count_cutoff)
+
+    async def _load_schema_cache(self) -> Schema | None:
+        if self._schema_cache_dir is None:
+            return None
+
+        software_version = await self.connection.get(
+            f"detector/api/{self._api_version}/config/software_version"
+        )
+        self._schema_cache = SchemaCache(
+            self._schema_cache_dir,
+            f"{self.connection_settings.ip}:{self.connection_settings.port}",
+            self._api_version,
+            str(software_version["value"]),
+        )
+        self._dependency_cache = DependencyCache(
+            self._schema_cache.path.with_name(
+                f"{self._schema_cache.path.stem}_dependencies.json"
+            )
+        )
+        for subsystem, graph in self._dependency_cache.load().items():
+            match self.sub_controllers.get(subsystem):
+                case EigerSubsystemController() as controller:
+                    controller.dependency_graph = graph
+
+        schema = self._schema_cache.load()
+        if schema is None or schema.keys() != set(EIGER_PARAMETER_SUBSYSTEMS):
+            return None
+
+        return schema
+
+    def _schema(self) -> Schema:
+        return {
+            subsystem: serialise_parameters(controller.parameters)
+            for subsystem, controller in self.sub_controllers.items()
+            if isinstance(controller, EigerSubsystemController)
+        }
+
+    async def _check_schema_cache(self):
+        """Compare the cached schema with the detector and report any drift.
+
+        The cache is updated so that the next startup uses the current schema, but the
+        attributes created from the cache are not changed until then.
+
+        """
+        assert self._schema_cache is not None and self._cached_schema is not None
+
+        controllers = {
+            subsystem: controller
+            for subsystem, controller in self.sub_controllers.items()
+            if isinstance(controller, EigerSubsystemController)
+        }
+        try:
+            parameters = await asyncio.gather(
+                *[controller.introspect() for controller in controllers.values()]
+            )
+        except Exception:
+            logger.exception("Failed to check schema cache against detector")
+            return
+
+        schema = {
+            subsystem: serialise_parameters(subsystem_parameters)
+            for subsystem, subsystem_parameters in zip(
+                controllers, parameters, strict=True
+            )
+        }
+        if drift := schema_diff(self._cached_schema, schema):
+            logger.warning(
+                "Detector API differs from schema cache - restart to update attributes",
+                parameters=drift,
+            )
+            self._schema_cache.save(schema)
+
+        await self.schema_drift.update(", ".join(drift))
+
+    def _acquisition_poll_throttle(self, state: str) -> PollThrottle | None:
+        if state not in ACQUIRING_STATES:
+            return None
+
+        match self.acquisition_polling.get():
+            case AcquisitionPolling.FULL:
+                return None
+            case AcquisitionPolling.REDUCED:
+                period = self.acquisition_poll_period.get()
+            case AcquisitionPolling.SUSPENDED:
+                period = None
+
+        keys = {key.strip() for key in self.acquisition_poll_keys.get().split(",")}
+        # Always keep polling state, so that the throttle is removed when it changes
+        return PollThrottle(period, frozenset(keys | {"state"}))
+
+    async def _update_acquisition_polling(self, state: str):
+        """Restrict polling of subsystems while the detector is acquiring."""
+        throttle = self._acquisition_poll_throttle(state)
+        for controller in self.get_subsystem_controllers():
+            controller.throttle_polling(throttle)
+
+        await self.polling_throttled.update(throttle is not None)
+        await self.saved_requests.update(
+            sum(
+                controller.saved_requests
+                for controller in self.get_subsystem_controllers()
+            )
+        )
+
+    async def _update_write_through(self, write_through: bool):
+        for controller in self.get_subsystem_controllers():
+            controller.write_through = write_through
+
+    async def _update_prefetch(self, prefetch: bool):
+        for controller in self.get_subsystem_controllers():
+            controller.prefetch = prefetch
+
+    def _save_dependencies(self, changed_only: bool = True):
+        """Save the dependency graphs of the subsystems, to use from the next startup.
+
+        Args:
+            changed_only: Only save if dependencies have been learned since the last
+                save, rather than just latencies
+
+        """
+        if self._dependency_cache is None:
+            return
+
+        graphs = {
+            name: controller.dependency_graph
+            for name, controller in self.sub_controllers.items()
+            if isinstance(controller, EigerSubsystemController)
+        }
+        if not changed_only or any(graph.changed for graph in graphs.values()):
+            self._dependency_cache.save(graphs)
+
     def get_subsystem_controllers(self) -> list["EigerSubsystemController"]:
         return [
             controller
@@ -105,29 +415,147 @@ class EigerController(Controller):
             if isinstance(controller, EigerSubsystemController)
         ]
 
-    @scan(0.1)
+    async def connect(self) -> None:
+        await super().connect()
+        self._update_task = asyncio.create_task(self._process_updates())
+        if self._cached_schema is not None:
+            self._schema_check_task = asyncio.create_task(self._check_schema_cache())
+
+    async def disconnect(self) -> None:
+        for task in (self._update_task, self._schema_check_task):
+            if task is not None:
+                task.cancel()
+        self._update_task = self._schema_check_task = None
+        self._save_dependencies(changed_only=False)
+
+        match self.sub_controllers.get("stream"):
+            case EigerStreamController() as stream:
+                await stream.stop_consumer()
+
+        match self.sub_controllers.get("monitor"):
+            case EigerMonitorController() as monitor:
+                monitor.close_frame_ring()
+
+        match self.sub_controllers.get("filewriter"):
+            case EigerFilewriterController() as filewriter:
+                await filewriter.abort_download()
+
+        await super().disconnect()
+
+    async def _process_updates(self):
+        """Update queued parameters as soon as they are queued."""
+        while True:
+            await self._updates_queued.wait()
+            if debounce := self.update_debounce.get():
+                # Wait for more parameters to update in the same batch
+                await asyncio.sleep(debounce)
+
+            try:
+                await self.update()
+            except Exception:
+                logger.exception("Failed to update queued parameters")
+
+    @scan(1)
+    async def update_request_stats(self):
+        """Publish statistics of bulk reads, to tune the request window."""
+        stats = self.connection.bulk_stats
+        await asyncio.gather(
+            self.bulk_request_throughput.update(stats.throughput),
+            self.bulk_request_latency.update(stats.mean_latency),
+            self.bulk_request_max_latency.update(stats.max_latency),
+        )
+
     async def update(self):
-        """Periodically check for parameters that need updating from the detector."""
-        if self.queue.empty():
-            return
+        """Update parameters that have been queued since the last update.
+
+        Parameters queued for verification are only read back once there are no
+        other parameters to update.
+
+        """
+        self._updates_queued.clear()
+        if self._pending_updates:
+            await self._update_pending()
+        elif self._pending_verifications:
+            await self._verify_pending()
+
+        if self._pending_verifications:
+            # Come back for these after any updates queued in the meantime
+            self._updates_queued.set()
 
-        coros: list[Coroutine] = []
-        async with self._parameter_update_lock:
-            while not self.queue.empty():
-                coros.append(await self.queue.get())
+    @staticmethod
+    def _take_pending(pending: dict[tuple[str, str], None]) -> dict[str, list[str]]:
+        """Take pending parameters by subsystem, so any queued from here on are kept
+        for later."""
+        parameters: dict[str, list[str]] = defaultdict(list)
+        for subsystem, key in pending:
+            parameters[subsystem].append(key)
+        pending.clear()
+        return parameters
 
-        await asyncio.gather(*coros)
+    async def _update_pending(self):
+        parameters = self._take_pending(self._pending_updates)
+        await asyncio.gather(
+            *[
+                controller.update_parameters(parameters[name])
+                for name, controller in self.sub_controllers.items()
+                if isinstance(controller, EigerSubsystemController)
+                and name in parameters
+            ]
+        )
 
-        if self.queue.empty():
+        if not self._pending_updates:
             logger.info("All parameters updated")
-            await self.stale_parameters.update(not self.queue.empty())
+            await self.stale_parameters.update(False)
 
-    async def queue_subsystem_update(self, coros: list[Coroutine]):
-        if coros:
+        self._save_dependencies()
+
+    async def _verify_pending(self):
+        parameters = self._take_pending(self._pending_verifications)
+        mismatched = await asyncio.gather(
+            *[
+                controller.verify_parameters(parameters[name])
+                for name, controller in self.sub_controllers.items()
+                if isinstance(controller, EigerSubsystemController)
+                and name in parameters
+            ]
+        )
+        if count := sum(len(keys) for keys in mismatched):
+            await self.write_through_mismatches.update(
+                self.write_through_mismatches.get() + count
+            )
+
+    async def queue_subsystem_update(self, subsystem: str, parameters: Iterable[str]):
+        """Add parameters of a subsystem to the set of parameters to update.
+
+        Parameters that are already waiting to be updated are not added again.
+
+        Args:
+            subsystem: Subsystem the parameters belong to
+            parameters: Keys of parameters to be updated
+
+        """
+        if parameters:
             await self.stale_parameters.update(True)
-            async with self._parameter_update_lock:
-                for coro in coros:
-                    await self.queue.put(coro)
+            for key in parameters:
+                self._pending_updates[(subsystem, key)] = None
+            self._updates_queued.set()
+
+    async def queue_subsystem_verification(
+        self, subsystem: str, parameters: Iterable[str]
+    ):
+        """Add parameters of a subsystem to the set of parameters to read back.
+
+        Unlike ``queue_subsystem_update``, this does not mark parameters as stale, as
+        the parameters already have the values put to them.
+
+        Args:
+            subsystem: Subsystem the parameters belong to
+            parameters: Keys of parameters to be read back
+
+        """
+        for key in parameters:
+            self._pending_verifications[(subsystem, key)] = None
+        self._updates_queued.set()
 
     @command(group=COMMAND_GROUP)
     async def arm_when_ready(self):
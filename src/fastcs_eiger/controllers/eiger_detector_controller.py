@@ -1,11 +1,25 @@
+import asyncio
+import time
+from collections.abc import Callable, Coroutine, Iterable
 from typing import Any
 
+import numpy as np
 from fastcs.attributes import AttrR, AttrRW
-from fastcs.datatypes import Float
+from fastcs.datatypes import Float, Int, Waveform
 from fastcs.methods import command
 
 from fastcs_eiger.controllers.eiger_subsystem_controller import EigerSubsystemController
-from fastcs_eiger.eiger_parameter import EigerAPIVersion
+from fastcs_eiger.eiger_parameter import (
+    EigerAPIVersion,
+    EigerParameterRef,
+    key_to_attribute_name,
+)
+from fastcs_eiger.http_connection import HTTPConnection
+from fastcs_eiger.pixel_mask import MASKED, merge_pixel_mask
+
+PIXEL_MASK_GROUP = "PixelMask"
+MAX_MASK_PIXEL_CHANGES = 1 << 16
+"""Maximum number of pixels to mask or unmask with each ``apply_pixel_mask_changes``"""
 
 
 def command_uri(api_version: EigerAPIVersion, key: str) -> str:
@@ -27,34 +41,169 @@ class EigerDetectorController(EigerSubsystemController):
     compression: AttrRW[str]
     trigger_mode: AttrR[str]
 
+    mask_pixels_to_add = AttrRW(
+        Waveform(np.int32, shape=(MAX_MASK_PIXEL_CHANGES,)),
+        initial_value=np.zeros(0, dtype=np.int32),
+        description="Flat indices of pixels to mask with apply_pixel_mask_changes",
+        group=PIXEL_MASK_GROUP,
+    )
+    mask_pixels_to_remove = AttrRW(
+        Waveform(np.int32, shape=(MAX_MASK_PIXEL_CHANGES,)),
+        initial_value=np.zeros(0, dtype=np.int32),
+        description="Flat indices of pixels to unmask with apply_pixel_mask_changes",
+        group=PIXEL_MASK_GROUP,
+    )
+    mask_update_duration = AttrR(
+        Float(units="s", prec=3),
+        description="Time taken by the last update of the pixel mask, including "
+        "reading it if needed and putting it",
+        group=PIXEL_MASK_GROUP,
+    )
+    mask_pixels_changed = AttrR(
+        Int(),
+        description="Pixels changed by the last update of the pixel mask",
+        group=PIXEL_MASK_GROUP,
+    )
+    mask_puts = AttrR(
+        Int(),
+        description="Updates of the pixel mask put to the detector",
+        group=PIXEL_MASK_GROUP,
+    )
+    mask_puts_skipped = AttrR(
+        Int(),
+        description="Updates of the pixel mask not put as no pixels changed",
+        group=PIXEL_MASK_GROUP,
+    )
+
+    def __init__(
+        self,
+        connection: HTTPConnection,
+        queue_subsystem_update: Callable[[str, Iterable[str]], Coroutine],
+        api_version: EigerAPIVersion,
+        queue_subsystem_verification: Callable[[str, Iterable[str]], Coroutine]
+        | None = None,
+    ):
+        super().__init__(
+            connection,
+            queue_subsystem_update,
+            api_version,
+            queue_subsystem_verification,
+        )
+        self._mask_lock = asyncio.Lock()
+
+    async def _put_command(self, key: str, value=None):
+        await self.connection.put(command_uri(self._api_version, key), value)
+        # Commands change the detector state, so check status at the fastest rate
+        self._poller.reset()
+
+    @command(group="DetectorConfig")
+    async def read_arrays(self):
+        """Read the array parameters, e.g. ``pixel_mask``, that may have changed.
+
+        Array parameters are large, so they are only read on demand rather than
+        polled or read whenever the detector reports they have changed.
+
+        """
+        await self.read_array_parameters()
+
+    @command(group=PIXEL_MASK_GROUP)
+    async def apply_pixel_mask_changes(self):
+        """Mask ``mask_pixels_to_add`` and unmask ``mask_pixels_to_remove``.
+
+        The pixel lists are cleared once the mask is updated, so the next changes
+        start from empty lists.
+
+        """
+        await self.update_pixel_mask(
+            self.mask_pixels_to_add.get(), self.mask_pixels_to_remove.get()
+        )
+        await asyncio.gather(
+            self.mask_pixels_to_add.update(np.zeros(0, dtype=np.int32)),
+            self.mask_pixels_to_remove.update(np.zeros(0, dtype=np.int32)),
+        )
+
+    async def update_pixel_mask(
+        self,
+        add: Iterable[int] | np.ndarray = (),
+        remove: Iterable[int] | np.ndarray = (),
+        key: str = "pixel_mask",
+        flags: int = MASKED,
+    ) -> int:
+        """Mask and unmask pixels, putting the pixel mask only if it changes.
+
+        The changes are merged into the cached copy of the mask, which is only read
+        from the detector if it may have changed since it was last read or put.
+
+        Args:
+            add: Flat indices of pixels to mask
+            remove: Flat indices of pixels to unmask
+            key: Key of the pixel mask, e.g. ``threshold/1/pixel_mask``
+            flags: Bits of the mask to set or clear
+
+        Returns: Number of pixels changed
+
+        Raises:
+            ValueError: If the detector does not have the pixel mask
+
+        """
+        attribute = self.attributes.get(key_to_attribute_name(key))
+        if not (
+            isinstance(attribute, AttrRW)
+            and attribute.has_io_ref()
+            and isinstance(attribute.io_ref, EigerParameterRef)
+            and attribute.io_ref.is_array
+        ):
+            raise ValueError(f"Detector does not have pixel mask {key}")
+
+        async with self._mask_lock:
+            start = time.monotonic()
+            if self._io.array_stale(attribute):
+                await attribute.update(await self._io.fetch(attribute))
+
+            merged = await asyncio.to_thread(
+                merge_pixel_mask, attribute.get(), add, remove, flags
+            )
+            if merged is None:
+                changed = 0
+                await self.mask_puts_skipped.update(self.mask_puts_skipped.get() + 1)
+            else:
+                mask, changed = merged
+                await self._io.send(attribute, mask)
+                await self.mask_puts.update(self.mask_puts.get() + 1)
+
+            await asyncio.gather(
+                self.mask_update_duration.update(time.monotonic() - start),
+                self.mask_pixels_changed.update(changed),
+            )
+
+        return changed
+
     @detector_command
     async def initialize(self):
-        await self.connection.put(command_uri(self._api_version, key="initialize"))
+        await self._put_command("initialize")
 
     @detector_command
     async def arm(self):
-        await self.connection.put(command_uri(self._api_version, key="arm"))
+        await self._put_command("arm")
 
     @detector_command
     async def trigger(self):
         match self.trigger_mode.get(), self.trigger_exposure.get():
             case ("inte", exposure) if exposure > 0.0:
-                await self.connection.put(
-                    command_uri(self._api_version, key="trigger"), exposure
-                )
+                await self._put_command("trigger", exposure)
             case ("ints" | "inte", _):
-                await self.connection.put(command_uri(self._api_version, key="trigger"))
+                await self._put_command("trigger")
             case _:
                 raise RuntimeError("Can only do soft trigger in 'ints' or 'inte' mode")
 
     @detector_command
     async def disarm(self):
-        await self.connection.put(command_uri(self._api_version, key="disarm"))
+        await self._put_command("disarm")
 
     @detector_command
     async def abort(self):
-        await self.connection.put(command_uri(self._api_version, key="abort"))
+        await self._put_command("abort")
 
     @detector_command
     async def cancel(self):
-        await self.connection.put(command_uri(self._api_version, key="cancel"))
+        await self._put_command("cancel")
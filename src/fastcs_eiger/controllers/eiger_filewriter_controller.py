@@ -0,0 +1,124 @@
+import asyncio
+from pathlib import Path
+
+from fastcs.attributes import AttrR, AttrRW
+from fastcs.datatypes import Bool, Float, Int, String
+from fastcs.logging import logger
+from fastcs.methods import command, scan
+
+from fastcs_eiger.controllers.eiger_subsystem_controller import EigerSubsystemController
+from fastcs_eiger.download import DownloadProgress, download_files
+
+DOWNLOAD_GROUP = "Download"
+
+
+class EigerFilewriterController(EigerSubsystemController):
+    _subsystem = "filewriter"
+
+    _download_task: asyncio.Task | None = None
+    _progress: DownloadProgress | None = None
+
+    download_directory = AttrRW(
+        String(),
+        description="Directory to download files from the filewriter to",
+        group=DOWNLOAD_GROUP,
+    )
+    download_concurrency = AttrRW(
+        Int(min=1),
+        initial_value=4,
+        description="Maximum number of files to download at once",
+        group=DOWNLOAD_GROUP,
+    )
+    downloading = AttrR(
+        Bool(), description="Whether files are being downloaded", group=DOWNLOAD_GROUP
+    )
+    files_to_download = AttrR(
+        Int(), description="Files in the current download", group=DOWNLOAD_GROUP
+    )
+    files_downloaded = AttrR(
+        Int(),
+        description="Files downloaded completely in the current download",
+        group=DOWNLOAD_GROUP,
+    )
+    megabytes_downloaded = AttrR(
+        Float(units="MB", prec=1),
+        description="Data written to disk in the current download",
+        group=DOWNLOAD_GROUP,
+    )
+    download_progress = AttrR(
+        Float(units="%", prec=1),
+        description="Progress of the current download",
+        group=DOWNLOAD_GROUP,
+    )
+    download_throughput = AttrR(
+        Float(units="MB/s", prec=2),
+        description="Mean rate of the current download",
+        group=DOWNLOAD_GROUP,
+    )
+
+    async def _list_files(self) -> list[str]:
+        """Get the names of the files held by the filewriter."""
+        response = await self.connection.get(
+            f"filewriter/api/{self._api_version}/files"
+        )
+        match response:
+            case list():
+                return [str(filename) for filename in response]
+            case _:
+                return []
+
+    @command(group=DOWNLOAD_GROUP)
+    async def download(self):
+        """Download all files held by the filewriter to ``download_directory``.
+
+        The download runs in the background, so its progress can be monitored.
+
+        """
+        if self._download_task is not None and not self._download_task.done():
+            raise RuntimeError("Files are already being downloaded")
+
+        directory = Path(self.download_directory.get())
+        if not directory.is_dir():
+            raise ValueError(f"Download directory {directory} does not exist")
+
+        filenames = await self._list_files()
+        self._progress = DownloadProgress(files=len(filenames))
+        self._download_task = asyncio.create_task(
+            download_files(
+                self.connection,
+                filenames,
+                directory,
+                self.download_concurrency.get(),
+                self._progress,
+            )
+        )
+        self._download_task.add_done_callback(self._download_done)
+        await self.update_download_progress()
+
+    def _download_done(self, task: asyncio.Task):
+        if not task.cancelled() and (exception := task.exception()) is not None:
+            logger.error("Failed to download files", exception=repr(exception))
+
+    @command(group=DOWNLOAD_GROUP)
+    async def abort_download(self):
+        """Stop downloading files. Files already downloaded are kept."""
+        if self._download_task is not None:
+            self._download_task.cancel()
+            await asyncio.gather(self._download_task, return_exceptions=True)
+            self._download_task = None
+
+    @scan(1)
+    async def update_download_progress(self):
+        """Publish the progress of the current download."""
+        if self._progress is None:
+            return
+
+        progress = self._progress
+        await asyncio.gather(
+            self.downloading.update(progress.end is None),
+            self.files_to_download.update(progress.files),
+            self.files_downloaded.update(progress.files_downloaded),
+            self.megabytes_downloaded.update(progress.bytes_downloaded / 1e6),
+            self.download_progress.update(100 * progress.fraction),
+            self.download_throughput.update(progress.throughput / 1e6),
+        )
@@ -1,25 +1,328 @@
-from io import BytesIO
+import asyncio
+import time
 
 import numpy as np
+from fastcs.attributes import AttrR, AttrRW
+from fastcs.datatypes import Bool, Enum, Float, Int, String, Waveform
+from fastcs.logging import logger
 from fastcs.methods import scan
-from PIL import Image
 
 from fastcs_eiger.controllers.eiger_subsystem_controller import EigerSubsystemController
+from fastcs_eiger.eiger_parameter import EigerParameterRef
+from fastcs_eiger.frame_ring import FrameRingWriter, frame_ring_name
+from fastcs_eiger.image import (
+    BinningMode,
+    ImageStatistics,
+    ImageWaveform,
+    Roi,
+    bin_image,
+    decode_tiff,
+    image_statistics,
+    parse_rois,
+)
+
+FRAME_RING_GROUP = "FrameRing"
+IMAGE_GROUP = "Image"
+PREVIEW_GROUP = "Preview"
+STATISTICS_GROUP = "Statistics"
+MAX_ROIS = 8
+"""Maximum number of regions of interest to sum monitor images over"""
+MONITOR_SCAN_PERIOD = 0.1
+"""Period in seconds to check if a monitor image is due, i.e. the maximum frame rate"""
 
 
 class EigerMonitorController(EigerSubsystemController):
     _subsystem = "monitor"
 
-    @scan(1)
+    _last_image_time = float("-inf")
+    _last_full_image_time = float("-inf")
+    _saved_image_requests = 0
+    _images_fetched = 0
+    _frame_ring: FrameRingWriter | None = None
+    _count_cutoff: int | None = None
+
+    frame_rate = AttrRW(
+        Float(units="Hz", min=0),
+        initial_value=1.0,
+        description="Rate to fetch monitor images at to update the preview and "
+        "statistics, or 0 to stop fetching images",
+        group=IMAGE_GROUP,
+    )
+    full_image_rate = AttrRW(
+        Float(units="Hz", min=0),
+        initial_value=0.2,
+        description="Maximum rate to update the full resolution image at",
+        group=IMAGE_GROUP,
+    )
+    image_width = AttrR(
+        Int(), description="Width of the monitor image", group=IMAGE_GROUP
+    )
+    image_height = AttrR(
+        Int(), description="Height of the monitor image", group=IMAGE_GROUP
+    )
+
+    image: AttrR[np.ndarray] | None = None
+
+    preview_binning = AttrRW(
+        Int(min=2),
+        initial_value=4,
+        description="Number of pixels along each side of a block of the preview",
+        group=PREVIEW_GROUP,
+    )
+    preview_mode = AttrRW(
+        Enum(BinningMode),
+        description="Whether to sum the pixels of each block or take the maximum",
+        group=PREVIEW_GROUP,
+    )
+    preview_width = AttrR(
+        Int(),
+        description="Width of the preview, which changes with the binning",
+        group=PREVIEW_GROUP,
+    )
+    preview_height = AttrR(
+        Int(),
+        description="Height of the preview, which changes with the binning",
+        group=PREVIEW_GROUP,
+    )
+    preview: AttrR[np.ndarray] | None = None
+
+    total_counts = AttrR(
+        Float(prec=0),
+        description="Sum of unmasked pixels of the monitor image",
+        group=STATISTICS_GROUP,
+    )
+    max_count = AttrR(
+        Float(prec=0),
+        description="Maximum unmasked pixel of the monitor image",
+        group=STATISTICS_GROUP,
+    )
+    mean_count = AttrR(
+        Float(prec=3),
+        description="Mean of unmasked pixels of the monitor image",
+        group=STATISTICS_GROUP,
+    )
+    saturated_pixels = AttrR(
+        Int(),
+        description="Pixels at or above the count cutoff in the monitor image",
+        group=STATISTICS_GROUP,
+    )
+    masked_pixels = AttrR(
+        Int(),
+        description="Masked pixels in the monitor image",
+        group=STATISTICS_GROUP,
+    )
+    centroid_x = AttrR(
+        Float(units="px", prec=2),
+        description="Intensity weighted mean column of the monitor image",
+        group=STATISTICS_GROUP,
+    )
+    centroid_y = AttrR(
+        Float(units="px", prec=2),
+        description="Intensity weighted mean row of the monitor image",
+        group=STATISTICS_GROUP,
+    )
+    rois = AttrRW(
+        String(),
+        description="Semicolon separated regions of interest as x,y,width,height",
+        group=STATISTICS_GROUP,
+    )
+    roi_sums = AttrR(
+        Waveform(np.float64, shape=(MAX_ROIS,)),
+        description="Sum of unmasked pixels in each region of interest",
+        group=STATISTICS_GROUP,
+    )
+
+    frame_ring = AttrRW(
+        Bool(),
+        description="Write monitor images to a ring buffer in shared memory, for other "
+        "processes on this host to read",
+        group=FRAME_RING_GROUP,
+    )
+    frame_ring_name = AttrRW(
+        String(),
+        description="Name of the shared memory of the frame ring, by default "
+        "fastcs_eiger_<detector host>_monitor",
+        group=FRAME_RING_GROUP,
+    )
+
+    async def initialise(self, parameters: list[EigerParameterRef] | None = None):
+        await super().initialise(parameters)
+        await self._create_image_attribute()
+        if not self.frame_ring_name.get():
+            await self.frame_ring_name.update(
+                frame_ring_name(self.connection.ip, self._subsystem)
+            )
+
+        self.frame_ring.add_on_update_callback(self._update_frame_ring)
+        self.frame_ring_name.add_on_update_callback(self._update_frame_ring)
+
+    async def _create_image_attribute(self):
+        """Create the image ``Attribute`` with the dimensions of the detector."""
+        responses = await self.connection.get_many(
+            [
+                f"detector/api/{self._api_version}/config/{key}"
+                for key in ("x_pixels_in_detector", "y_pixels_in_detector")
+            ]
+        )
+        width, height = (response["value"] for response in responses)
+        if not (isinstance(width, int) and isinstance(height, int)):
+            logger.warning(
+                "Failed to get detector dimensions, monitor images will not be shown",
+                width=width,
+                height=height,
+            )
+            return
+
+        # Flattened, as the CA transport only supports 1-D waveforms. Clients
+        # reshape it with image_width and image_height.
+        self.image = AttrR(
+            ImageWaveform(np.uint32, shape=(height * width,)),
+            description="Latest monitor image, flattened row by row",
+            group=IMAGE_GROUP,
+        )
+        # The preview is largest at the minimum binning factor
+        self.preview = AttrR(
+            ImageWaveform(np.uint32, shape=((height // 2) * (width // 2),)),
+            description="Binned monitor image, flattened row by row",
+            group=PREVIEW_GROUP,
+        )
+        await asyncio.gather(
+            self.image_width.update(width), self.image_height.update(height)
+        )
+
+    @property
+    def saved_requests(self) -> int:
+        return super().saved_requests + self._saved_image_requests
+
+    def _images_throttled(self) -> bool:
+        """Check if monitor images should be skipped because polling is throttled.
+
+        Monitor images are not needed during an acquisition, so are throttled
+        unless explicitly kept.
+
+        """
+        throttle = self._poller.throttle
+        if throttle is None or "images" in throttle.keep:
+            return False
+        elif throttle.period is None:
+            return True
+
+        return time.monotonic() < self._last_image_time + throttle.period
+
+    def _image_due(self) -> bool:
+        frame_rate = self.frame_rate.get()
+        return frame_rate > 0 and (
+            time.monotonic() >= self._last_image_time + 1 / frame_rate
+        )
+
+    def _full_image_due(self) -> bool:
+        full_image_rate = self.full_image_rate.get()
+        return full_image_rate > 0 and (
+            self._last_image_time >= self._last_full_image_time + 1 / full_image_rate
+        )
+
+    @scan(MONITOR_SCAN_PERIOD)
     async def handle_monitor(self):
-        """Poll monitor images to display."""
+        """Fetch the next monitor image, at most at ``frame_rate``.
+
+        The preview and statistics are updated with every image, but the full
+        resolution image is only updated at ``full_image_rate``.
+
+        """
+        if self.image is None or not self._image_due():
+            return
+        elif self._images_throttled():
+            self._saved_image_requests += 1
+            return
+
+        self._last_image_time = time.monotonic()
         response, image_bytes = await self.connection.get_bytes(
             f"monitor/api/{self._api_version}/images/next"
         )
         if response.status != 200:
             return
-        else:
-            image = Image.open(BytesIO(image_bytes))
 
-            # TODO: Populate waveform PV to display as image, once supported in PVI
-            print(np.array(image))
+        image = await asyncio.to_thread(decode_tiff, image_bytes)
+        self._images_fetched += 1
+        if self._full_image_due():
+            self._last_full_image_time = self._last_image_time
+            await self.image.update(image.reshape(-1))
+
+        await self._update_preview(image)
+
+        try:
+            rois = parse_rois(self.rois.get())[:MAX_ROIS]
+        except ValueError:
+            logger.warning("Ignoring invalid regions of interest", rois=self.rois.get())
+            rois = []
+
+        statistics = await asyncio.to_thread(
+            self._process_image, image, self._images_fetched, rois
+        )
+        await self._update_statistics(statistics)
+
+    def _process_image(
+        self, image: np.ndarray, frame_number: int, rois: list[Roi]
+    ) -> ImageStatistics:
+        # Run in a worker thread, so the frame ring copy does not block the loop
+        statistics = image_statistics(image, self._count_cutoff, rois)
+        if self._frame_ring is not None:
+            # Monitor images are not part of a series
+            self._frame_ring.write(
+                image,
+                frame_number,
+                series_id=0,
+                total_counts=statistics.total,
+                max_count=statistics.max,
+            )
+
+        return statistics
+
+    async def update_count_cutoff(self, count_cutoff: int | None):
+        """Set the pixel value at which monitor image pixels count as saturated.
+
+        This is the detector ``countrate_correction_count_cutoff`` config parameter,
+        which is kept up to date by the detector controller, so it is not read with
+        every image.
+
+        """
+        self._count_cutoff = count_cutoff
+
+    async def _update_preview(self, image: np.ndarray):
+        if self.preview is None:
+            return
+
+        preview = await asyncio.to_thread(
+            bin_image, image, self.preview_binning.get(), self.preview_mode.get()
+        )
+        preview_height, preview_width = preview.shape
+        await asyncio.gather(
+            self.preview.update(preview.reshape(-1)),
+            self.preview_width.update(preview_width),
+            self.preview_height.update(preview_height),
+        )
+
+    async def _update_statistics(self, statistics: ImageStatistics):
+        await asyncio.gather(
+            self.total_counts.update(statistics.total),
+            self.max_count.update(statistics.max),
+            self.mean_count.update(statistics.mean),
+            self.saturated_pixels.update(statistics.saturated),
+            self.masked_pixels.update(statistics.masked),
+            self.centroid_x.update(statistics.centroid_x),
+            self.centroid_y.update(statistics.centroid_y),
+            self.roi_sums.update(np.array(statistics.roi_sums, dtype=np.float64)),
+        )
+
+    async def _update_frame_ring(self, _value: bool | str):
+        self.close_frame_ring()
+        self._frame_ring = (
+            FrameRingWriter(self.frame_ring_name.get())
+            if self.frame_ring.get()
+            else None
+        )
+
+    def close_frame_ring(self):
+        """Remove the frame ring until the next image is written to it."""
+        if self._frame_ring is not None:
+            self._frame_ring.close()
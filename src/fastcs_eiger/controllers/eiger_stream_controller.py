@@ -1,5 +1,361 @@
+import asyncio
+import os
+from collections.abc import Callable, Coroutine, Iterable
+from pathlib import Path
+
+import numpy as np
+from fastcs.attributes import AttrR, AttrRW
+from fastcs.datatypes import Bool, Float, Int, String
+from fastcs.logging import logger
+from fastcs.methods import scan
+
 from fastcs_eiger.controllers.eiger_subsystem_controller import EigerSubsystemController
+from fastcs_eiger.eiger_parameter import EigerAPIVersion, EigerParameterRef
+from fastcs_eiger.frame_ring import FrameRingWriter, frame_ring_name
+from fastcs_eiger.hdf5_writer import Hdf5StreamWriter
+from fastcs_eiger.http_connection import HTTPConnection
+from fastcs_eiger.stream import (
+    STREAM_PORTS,
+    DecodedImage,
+    StreamConsumer,
+    StreamFormat,
+    StreamReceiver,
+)
+from fastcs_eiger.stream_worker import StreamWorker
+
+CONSUMER_GROUP = "Consumer"
+DECODER_GROUP = "Decoder"
+FRAME_RING_GROUP = "FrameRing"
+WRITER_GROUP = "Writer"
 
 
 class EigerStreamController(EigerSubsystemController):
     _subsystem = "stream"
+
+    _consumer_task: asyncio.Task | None = None
+    _consumer_stopped: asyncio.Task | None = None
+    _frame_ring: FrameRingWriter | None = None
+    _writer: Hdf5StreamWriter | None = None
+    _writer_task: asyncio.Task | None = None
+
+    consume = AttrRW(
+        Bool(),
+        description="Receive frames from the stream to monitor its rates. Frames "
+        "received here are not received by any other consumer of the stream.",
+        group=CONSUMER_GROUP,
+    )
+    worker_process = AttrRW(
+        Bool(),
+        description="Receive and decode frames in a separate process, to keep the "
+        "work off the IOC. Applied when consume is enabled.",
+        group=CONSUMER_GROUP,
+    )
+    stream_endpoint = AttrRW(
+        String(),
+        description="ZeroMQ endpoint to receive frames from, or empty to use the "
+        "detector address and the port for the stream format",
+        group=CONSUMER_GROUP,
+    )
+    frames_per_second = AttrR(
+        Float(units="Hz", prec=1),
+        description="Rate of frames received from the stream",
+        group=CONSUMER_GROUP,
+    )
+    megabytes_per_second = AttrR(
+        Float(units="MB/s", prec=2),
+        description="Rate of data received from the stream",
+        group=CONSUMER_GROUP,
+    )
+    frames_received = AttrR(
+        Int(), description="Frames received from the stream", group=CONSUMER_GROUP
+    )
+    missing_frames = AttrR(
+        Int(),
+        description="Frames missing from the series received from the stream",
+        group=CONSUMER_GROUP,
+    )
+    series_id = AttrR(
+        Int(),
+        description="Id of the series received from the stream",
+        group=CONSUMER_GROUP,
+    )
+    series_ended = AttrR(
+        Bool(),
+        description="Whether the end of the series has been received",
+        group=CONSUMER_GROUP,
+    )
+    decimation = AttrRW(
+        Int(min=1),
+        initial_value=1,
+        description="Decode every nth image received from a stream in cbor format",
+        group=DECODER_GROUP,
+    )
+    decoded_frames = AttrR(
+        Int(), description="Images decoded from the stream", group=DECODER_GROUP
+    )
+    skipped_decodes = AttrR(
+        Int(),
+        description="Images not decoded because all decoders were busy",
+        group=DECODER_GROUP,
+    )
+    decode_duration = AttrR(
+        Float(units="s", prec=4),
+        description="Time taken to decode the last image",
+        group=DECODER_GROUP,
+    )
+    total_counts = AttrR(
+        Float(prec=0),
+        description="Sum of unmasked pixels of the last decoded image",
+        group=DECODER_GROUP,
+    )
+    max_count = AttrR(
+        Float(prec=0),
+        description="Maximum unmasked pixel of the last decoded image",
+        group=DECODER_GROUP,
+    )
+
+    frame_ring = AttrRW(
+        Bool(),
+        description="Write the first channel of each decoded image to a ring buffer "
+        "in shared memory, for other processes on this host to read. Applied to the "
+        "worker process when consume is enabled.",
+        group=FRAME_RING_GROUP,
+    )
+    frame_ring_name = AttrRW(
+        String(),
+        description="Name of the shared memory of the frame ring, by default "
+        "fastcs_eiger_<detector host>_stream",
+        group=FRAME_RING_GROUP,
+    )
+
+    write_files = AttrRW(
+        Bool(),
+        description="Write images received from a stream in cbor format to HDF5 "
+        "files. Applied when consume is enabled without worker_process.",
+        group=WRITER_GROUP,
+    )
+    file_directory = AttrRW(
+        String(), description="Directory to write HDF5 files to", group=WRITER_GROUP
+    )
+    file_name_pattern = AttrRW(
+        String(),
+        initial_value="series_$id",
+        description="Name of the files of each series, where $id is the series id",
+        group=WRITER_GROUP,
+    )
+    frames_per_file = AttrRW(
+        Int(min=1),
+        initial_value=1000,
+        description="Maximum number of images in each data file",
+        group=WRITER_GROUP,
+    )
+    chunk_frames = AttrRW(
+        Int(min=1),
+        initial_value=1,
+        description="Number of images in each chunk of uncompressed images. "
+        "Compressed images are written as received, one image per chunk.",
+        group=WRITER_GROUP,
+    )
+    frames_written = AttrR(
+        Int(), description="Images written to HDF5 files", group=WRITER_GROUP
+    )
+    files_written = AttrR(
+        Int(), description="HDF5 data files created", group=WRITER_GROUP
+    )
+    write_queue = AttrR(
+        Int(), description="Messages waiting to be written", group=WRITER_GROUP
+    )
+
+    def __init__(
+        self,
+        connection: HTTPConnection,
+        queue_subsystem_update: Callable[[str, Iterable[str]], Coroutine],
+        api_version: EigerAPIVersion,
+        queue_subsystem_verification: Callable[[str, Iterable[str]], Coroutine]
+        | None = None,
+    ):
+        super().__init__(
+            connection,
+            queue_subsystem_update,
+            api_version,
+            queue_subsystem_verification,
+        )
+        self._consumer: StreamConsumer | StreamWorker | None = None
+
+    async def initialise(self, parameters: list[EigerParameterRef] | None = None):
+        await super().initialise(parameters)
+        self.consume.add_on_update_callback(self._update_consumer)
+        self.decimation.add_on_update_callback(self._update_decimation)
+        if not self.frame_ring_name.get():
+            await self.frame_ring_name.update(
+                frame_ring_name(self.connection.ip, self._subsystem)
+            )
+
+        self.frame_ring.add_on_update_callback(self._update_frame_ring)
+        self.frame_ring_name.add_on_update_callback(self._update_frame_ring)
+
+    async def _stream_format(self) -> StreamFormat:
+        """Get the format of the stream, falling back to legacy if it has none."""
+        response = await self.connection.get(
+            f"stream/api/{self._api_version}/config/format"
+        )
+        match response.get("value"):
+            case "cbor":
+                return "cbor"
+            case _:
+                return "legacy"
+
+    @property
+    def latest_images(self) -> dict[str, np.ndarray]:
+        """Images of each channel of the last image decoded in this process."""
+        match self._consumer:
+            case StreamConsumer(latest=latest) if latest is not None:
+                return latest.images
+            case _:
+                return {}
+
+    async def _update_consumer(self, consume: bool):
+        if consume and (self._consumer_task is None or self._consumer_task.done()):
+            stream_format = await self._stream_format()
+            endpoint = (
+                self.stream_endpoint.get()
+                or f"tcp://{self.connection.ip}:{STREAM_PORTS[stream_format]}"
+            )
+            self._writer = None
+            if self.worker_process.get():
+                # The worker writes to the frame ring itself
+                self._close_frame_ring()
+                ring_name = (
+                    self.frame_ring_name.get()
+                    if self.frame_ring.get()
+                    else f"fastcs_eiger_{os.getpid()}_stream"
+                )
+                self._consumer = StreamWorker(endpoint, stream_format, ring_name)
+                self._consumer.decimation = self.decimation.get()
+                if self.write_files.get():
+                    logger.warning("Files are not written with worker_process")
+            else:
+                try:
+                    receiver = StreamReceiver(endpoint, stream_format)
+                except ImportError:
+                    logger.exception(
+                        "Stream consumer requires the fastcs-eiger[stream] extra"
+                    )
+                    return
+
+                if self.write_files.get():
+                    self._start_writer()
+
+                self._consumer = StreamConsumer(
+                    receiver,
+                    self.decimation.get,
+                    on_decoded=self._write_frame_ring,
+                    on_message=None if self._writer is None else self._writer.put,
+                )
+
+            self._consumer_task = asyncio.create_task(self._consumer.run())
+            self._consumer_task.add_done_callback(self._consumer_done)
+        elif not consume:
+            await self.stop_consumer()
+
+    def _consumer_done(self, task: asyncio.Task):
+        if not task.cancelled() and (exception := task.exception()) is not None:
+            logger.error("Stream consumer failed", exception=repr(exception))
+            # Disable consume, which also stops the writer and closes the frame ring
+            self._consumer_stopped = asyncio.create_task(self.consume.update(False))
+
+    async def _update_decimation(self, decimation: int):
+        if isinstance(self._consumer, StreamWorker):
+            self._consumer.decimation = decimation
+
+    def _start_writer(self):
+        self._writer = Hdf5StreamWriter(
+            Path(self.file_directory.get()),
+            name_pattern=self.file_name_pattern.get(),
+            frames_per_file=self.frames_per_file.get(),
+            chunk_frames=self.chunk_frames.get(),
+        )
+        self._writer_task = asyncio.create_task(self._writer.run())
+
+    async def stop_consumer(self):
+        """Stop receiving frames from the stream and writing them to files.
+
+        Messages already received, e.g. the end of the series, are written before
+        the files are closed.
+
+        """
+        if self._consumer_task is not None:
+            self._consumer_task.cancel()
+            await asyncio.gather(self._consumer_task, return_exceptions=True)
+
+        if self._writer is not None and self._writer_task is not None:
+            await self._writer.stop()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+
+        self._consumer_task = self._writer_task = None
+
+        self._close_frame_ring()
+
+    async def _update_frame_ring(self, _value: bool | str):
+        self._close_frame_ring()
+        self._frame_ring = (
+            FrameRingWriter(self.frame_ring_name.get())
+            if self.frame_ring.get()
+            else None
+        )
+
+    def _write_frame_ring(self, decoded: DecodedImage):
+        image = next(iter(decoded.images.values()), None)
+        if self._frame_ring is None or image is None:
+            return
+
+        result = decoded.result
+        self._frame_ring.write(
+            image,
+            decoded.image_id,
+            decoded.series_id,
+            total_counts=result.total_counts,
+            max_count=result.max_count,
+            duration=result.duration,
+        )
+
+    def _close_frame_ring(self):
+        """Remove the frame ring until the next image is written to it."""
+        if self._frame_ring is not None:
+            self._frame_ring.close()
+
+    @scan(1)
+    async def update_stream_statistics(self):
+        """Publish the rates and counters of the stream consumer."""
+        if self._consumer is None:
+            return
+
+        if isinstance(self._consumer, StreamWorker):
+            self._consumer.refresh()
+
+        statistics = self._consumer.statistics
+        frames_per_second, megabytes_per_second = statistics.sample_rates()
+        await asyncio.gather(
+            self.frames_per_second.update(frames_per_second),
+            self.megabytes_per_second.update(megabytes_per_second),
+            self.frames_received.update(statistics.frames_received),
+            self.missing_frames.update(statistics.missing_frames),
+            self.series_id.update(statistics.series_id),
+            self.series_ended.update(statistics.series_ended),
+            self.decoded_frames.update(self._consumer.decoded_frames),
+            self.skipped_decodes.update(self._consumer.skipped_decodes),
+        )
+
+        if self._writer is not None:
+            await asyncio.gather(
+                self.frames_written.update(self._writer.frames_written),
+                self.files_written.update(self._writer.files_written),
+                self.write_queue.update(self._writer.queued),
+            )
+
+        if (result := self._consumer.last_result) is not None:
+            await asyncio.gather(
+                self.decode_duration.update(result.duration),
+                self.total_counts.update(result.total_counts),
+                self.max_count.update(result.max_count),
+            )
@@ -1,41 +1,39 @@
 import asyncio
 from collections.abc import Callable, Coroutine, Iterable
-from typing import Literal
+from http import HTTPStatus
+from typing import Any, Literal
 
 from fastcs.attributes import Attribute, AttrR, AttrRW
 from fastcs.controllers import Controller
+from fastcs.datatypes import Bool, Float, Int
 from fastcs.logging import logger
+from fastcs.methods import scan
 from fastcs.util import ONCE
 
+from fastcs_eiger.dependency_graph import DependencyGraph
 from fastcs_eiger.eiger_parameter import (
+    ARRAY_PARAMETERS,
     EIGER_PARAMETER_MODES,
+    SPLIT_PARAMETERS,
     EigerAPIVersion,
     EigerParameterRef,
     EigerParameterResponse,
+    array_shape,
+    is_array_key,
     key_to_attribute_name,
+    list_shape,
 )
-from fastcs_eiger.http_connection import HTTPConnection
+from fastcs_eiger.http_connection import HTTPConnection, HTTPRequestError
 from fastcs_eiger.io import EigerAttributeIO
+from fastcs_eiger.polling import STATUS_POLL_PERIOD, PollThrottle, StatusPoller
+
+POLLING_GROUP = "Polling"
 
 # Keys to be ignored when introspecting the detector to create parameters
 IGNORED_KEYS = [
-    # Big arrays
-    "countrate_correction_table",
-    "pixel_mask",
-    "threshold/1/pixel_mask",
-    "threshold/2/pixel_mask",
-    "flatfield",
-    "threshold/1/flatfield",
-    "threshold/2/flatfield",
     # Deprecated
     "board_000/th0_humidity",
     "board_000/th0_temp",
-    # TODO: Value is [value, max], rather than using max metadata
-    "buffer_fill_level",
-    # TODO: Handle array values
-    "detector_orientation",
-    "detector_orientation_axis",
-    "detector_translation",
     # TODO: Is it a bad idea to include these?
     "test_image_mode",
     "test_image_value",
@@ -46,64 +44,293 @@ MISSING_KEYS: dict[str, dict[str, list[str]]] = {
     "detector": {"status": ["error"], "config": ["wavelength"]},
     "monitor": {"status": [], "config": []},
     "stream": {"status": ["error"], "config": []},
+    "filewriter": {"status": ["error"], "config": []},
 }
 
 
 class EigerSubsystemController(Controller):
-    _subsystem: Literal["detector", "stream", "monitor"]
+    _subsystem: Literal["detector", "stream", "monitor", "filewriter"]
+
+    poll_concurrency = AttrRW(
+        Int(min=1),
+        initial_value=8,
+        description="Maximum concurrent requests when polling status parameters",
+        group=POLLING_GROUP,
+    )
+    adaptive_polling = AttrRW(
+        Bool(),
+        initial_value=True,
+        description="Poll status parameters less often while their values are steady",
+        group=POLLING_GROUP,
+    )
+    max_poll_period = AttrRW(
+        Float(units="s", min=STATUS_POLL_PERIOD),
+        initial_value=5.0,
+        description="Longest period to poll status parameters at with adaptive polling",
+        group=POLLING_GROUP,
+    )
+    poll_duration = AttrR(
+        Float(units="s", prec=3),
+        description="Duration of the last poll of status parameters",
+        group=POLLING_GROUP,
+    )
+    poll_max_duration = AttrR(
+        Float(units="s", prec=3),
+        description="Longest duration of any poll of status parameters",
+        group=POLLING_GROUP,
+    )
+    polled_parameters = AttrR(
+        Int(),
+        description="Number of status parameters updated by the last poll",
+        group=POLLING_GROUP,
+    )
 
     def __init__(
         self,
         connection: HTTPConnection,
-        queue_subsystem_update: Callable[[list[Coroutine]], Coroutine],
+        queue_subsystem_update: Callable[[str, Iterable[str]], Coroutine],
         api_version: EigerAPIVersion,
+        queue_subsystem_verification: Callable[[str, Iterable[str]], Coroutine]
+        | None = None,
     ):
         self.connection = connection
         self._queue_subsystem_update = queue_subsystem_update
-        self._io = EigerAttributeIO(connection, self.update_now, self.queue_update)
+        self._queue_subsystem_verification = queue_subsystem_verification
+        self._io = EigerAttributeIO(
+            connection,
+            self.update_now,
+            self.queue_update,
+            self._on_put,
+            self.queue_verification,
+            self.prefetch_parameters,
+        )
         super().__init__(ios=[self._io])
         self._api_version: EigerAPIVersion = api_version
+        self._poller = StatusPoller(self._io)
+        self.parameters: list[EigerParameterRef] = []
+        # Fetches of parameters started as soon as a put returned, by attribute name
+        self._prefetches: dict[str, asyncio.Task] = {}
+        self.prefetch = True
+        """Fetch parameters changed by a put as soon as it returns"""
+
+    def _on_put(self, parameters: Iterable[str]):
+        """Poll all status parameters at the fastest rate after a parameter is put.
+
+        A change to any parameter of the subsystem may change its status, so status
+        parameters should not be left at a backed off poll period.
+
+        """
+        self._poller.reset()
+
+    async def introspect(self) -> list[EigerParameterRef]:
+        """Introspect the parameters of the subsystem from the detector."""
+        return await self._introspect_detector_subsystem()
 
     async def _introspect_detector_subsystem(self) -> list[EigerParameterRef]:
-        parameters = []
-        for mode in EIGER_PARAMETER_MODES:
-            subsystem_keys = [
-                parameter
-                for parameter in await self.connection.get(
-                    f"{self._subsystem}/api/{self._api_version}/{mode}/keys"
-                )
-                if parameter not in IGNORED_KEYS
-            ] + MISSING_KEYS[self._subsystem][mode]
-            requests = [
-                self.connection.get(
-                    f"{self._subsystem}/api/{self._api_version}/{mode}/{key}"
-                )
+        mode_parameters = await asyncio.gather(
+            *[self._introspect_mode(mode) for mode in EIGER_PARAMETER_MODES]
+        )
+        return [parameter for parameters in mode_parameters for parameter in parameters]
+
+    async def _introspect_mode(
+        self, mode: Literal["status", "config"]
+    ) -> list[EigerParameterRef]:
+        try:
+            keys = await self.connection.get(
+                f"{self._subsystem}/api/{self._api_version}/{mode}/keys"
+            )
+        except HTTPRequestError as e:
+            if e.status != HTTPStatus.NOT_FOUND:
+                raise
+
+            # Not all subsystems list their keys, e.g. the filewriter of the simulator
+            logger.warning(
+                "Subsystem does not list its keys, only known keys will be added",
+                subsystem=self._subsystem,
+                mode=mode,
+            )
+            keys = []
+
+        subsystem_keys = [
+            parameter
+            for parameter in keys
+            if parameter not in IGNORED_KEYS and not is_array_key(parameter)
+        ] + MISSING_KEYS[self._subsystem][mode]
+        responses = await self.connection.get_many(
+            [
+                f"{self._subsystem}/api/{self._api_version}/{mode}/{key}"
                 for key in subsystem_keys
             ]
-            responses = await asyncio.gather(*requests)
-
-            parameters.extend(
-                [
-                    EigerParameterRef(
-                        key=key,
-                        subsystem=self._subsystem,
-                        api_version=self._api_version,
-                        mode=mode,
-                        response=EigerParameterResponse.model_validate(response),
-                        update_period=ONCE if mode == "config" else 0.2,
-                    )
-                    for key, response in zip(subsystem_keys, responses, strict=False)
-                ]
+        )
+
+        return [
+            parameter
+            for key, response in zip(subsystem_keys, responses, strict=False)
+            for parameter in self._create_parameters(mode, key, response)
+        ] + await self._introspect_arrays(
+            mode, [key for key in keys if is_array_key(key)]
+        )
+
+    async def _introspect_arrays(
+        self, mode: Literal["status", "config"], keys: list[str]
+    ) -> list[EigerParameterRef]:
+        """Create parameters for array keys without getting their values.
+
+        The values are large, so their shape is taken from the dimensions of the
+        detector instead.
+
+        """
+        if not keys:
+            return []
+
+        responses = await self.connection.get_many(
+            [
+                f"detector/api/{self._api_version}/config/{key}"
+                for key in ("x_pixels_in_detector", "y_pixels_in_detector")
+            ]
+        )
+        width, height = (response["value"] for response in responses)
+        if not (isinstance(width, int) and isinstance(height, int)):
+            logger.warning(
+                "Failed to get detector dimensions, array parameters will not be added",
+                width=width,
+                height=height,
+            )
+            return []
+
+        return [
+            self._create_parameter(
+                mode,
+                key,
+                {
+                    "value": None,
+                    "value_type": ARRAY_PARAMETERS[key.rsplit("/", 1)[-1]],
+                    "access_mode": "rw" if mode == "config" else "r",
+                },
+                shape=array_shape(key, width, height),
             )
+            for key in keys
+        ]
 
-        return parameters
+    def _create_parameters(
+        self, mode: Literal["status", "config"], key: str, response: dict[str, Any]
+    ) -> list[EigerParameterRef]:
+        """Create a parameter from the response of a GET of a key, or a parameter for
+        each element of its value if it is split."""
+        if key in SPLIT_PARAMETERS:
+            return [
+                self._create_parameter(mode, key, response, index=index)
+                for index in range(len(SPLIT_PARAMETERS[key]))
+            ]
 
-    async def initialise(self) -> None:
-        parameters = await self._introspect_detector_subsystem()
+        return [
+            self._create_parameter(
+                mode,
+                key,
+                response,
+                shape=list_shape(response.get("value_type", ""), response["value"]),
+            )
+        ]
+
+    def _create_parameter(
+        self,
+        mode: Literal["status", "config"],
+        key: str,
+        response: dict[str, Any],
+        shape: tuple[int, ...] | None = None,
+        index: int | None = None,
+    ) -> EigerParameterRef:
+        return EigerParameterRef(
+            key=key,
+            subsystem=self._subsystem,
+            api_version=self._api_version,
+            mode=mode,
+            response=EigerParameterResponse.model_validate(response),
+            # status parameters are updated by `poll_status` and array parameters are
+            # only read on demand
+            update_period=ONCE if mode == "config" and not is_array_key(key) else None,
+            shape=shape,
+            index=index,
+        )
+
+    def parameters_from_schema(
+        self, schema: list[dict[str, Any]]
+    ) -> list[EigerParameterRef]:
+        """Create ``EigerParameterRef``s from serialised parameters.
+
+        Values are not included in the schema, so are set to ``None`` until the
+        parameters are updated from the detector.
+
+        Args:
+            schema: Serialised parameters from a ``SchemaCache``
+
+        """
+        return [
+            self._create_parameter(
+                parameter["mode"],
+                parameter["key"],
+                {"value": None, **parameter["response"]},
+                shape=tuple(parameter["shape"]) if "shape" in parameter else None,
+                index=parameter.get("index"),
+            )
+            for parameter in schema
+        ]
+
+    @property
+    def saved_requests(self) -> int:
+        """Number of requests skipped because polling was throttled."""
+        return self._poller.saved_requests
+
+    def throttle_polling(self, throttle: PollThrottle | None):
+        """Restrict polling of the subsystem, or remove the restriction.
+
+        Args:
+            throttle: Restriction to apply, or ``None`` to poll normally
+
+        """
+        if self._poller.throttle is not None and throttle is None:
+            # Catch up on parameters that were throttled
+            self._poller.reset()
+
+        self._poller.throttle = throttle
+
+    async def initialise(self, parameters: list[EigerParameterRef] | None = None):
+        """Create attributes for the parameters of the subsystem.
+
+        Args:
+            parameters: Parameters to create attributes for, or ``None`` to introspect
+                them from the detector
+
+        """
+        if parameters is None:
+            parameters = await self._introspect_detector_subsystem()
+
+        self.parameters = parameters
         attributes = self._create_attributes(parameters)
 
         for name, attribute in attributes.items():
             self.add_attribute(name, attribute)
+            match attribute:
+                case AttrR(io_ref=EigerParameterRef(mode="status")):
+                    self._poller.add_attribute(attribute)
+
+    @scan(STATUS_POLL_PERIOD)
+    async def poll_status(self):
+        """Update all status parameters of the subsystem in one sweep."""
+        if not self._poller.attributes:
+            return
+
+        await self._poller.poll(
+            self.poll_concurrency.get(),
+            adaptive=self.adaptive_polling.get(),
+            max_period=self.max_poll_period.get(),
+        )
+
+        await asyncio.gather(
+            self.poll_duration.update(self._poller.last_duration),
+            self.poll_max_duration.update(self._poller.max_duration),
+            self.polled_parameters.update(self._poller.last_count),
+        )
 
     @classmethod
     def _group(cls, parameter: EigerParameterRef):
@@ -140,14 +367,131 @@ class EigerSubsystemController(Controller):
     async def queue_update(self, parameters: Iterable[str]):
         """Add the given parameters to the list of parameters to update.
 
+        Parameters without an ``Attribute`` are not queued.
+
         Args:
             parameters: Parameters to be updated
 
         """
         if not parameters:
             return
-        coros: list[Coroutine] = self._get_update_coros_for_parameters(parameters)
-        await self._queue_subsystem_update(coros)
+
+        keys = dict.fromkeys(
+            attribute.io_ref.key
+            for attribute in self._get_attributes_for_parameters(parameters)
+        )
+        if keys:
+            await self._queue_subsystem_update(self._subsystem, keys)
+
+    async def queue_verification(self, parameters: Iterable[str]):
+        """Add the given parameters to the list of parameters to read back at low
+        priority, after any parameters queued with ``queue_update``.
+
+        Args:
+            parameters: Parameters to be verified
+
+        """
+        if parameters and self._queue_subsystem_verification is not None:
+            await self._queue_subsystem_verification(self._subsystem, parameters)
+
+    @property
+    def write_through(self) -> bool:
+        """Whether parameters that echo exactly are updated from the value put."""
+        return self._io.write_through
+
+    @write_through.setter
+    def write_through(self, write_through: bool):
+        self._io.write_through = write_through
+
+    @property
+    def dependency_graph(self) -> DependencyGraph:
+        """Parameters changed by puts of each parameter and their fetch latencies."""
+        return self._io.dependency_graph
+
+    @dependency_graph.setter
+    def dependency_graph(self, dependency_graph: DependencyGraph):
+        self._io.dependency_graph = dependency_graph
+
+    def prefetch_parameters(self, parameters: Iterable[str]):
+        """Start fetching the given parameters, slowest first, without waiting for
+        them to be updated.
+
+        ``update_parameters`` uses the values fetched, so parameters changed by a put
+        are requested as soon as it returns, rather than when they get to the front of
+        the update queue.
+
+        Args:
+            parameters: Keys of parameters changed by a put
+
+        """
+        if not self.prefetch:
+            return
+
+        attributes = [
+            attribute
+            for attribute in self._get_attributes_for_parameters(parameters)
+            if not attribute.io_ref.is_array
+        ]
+        # Tasks start in order, so the slowest requests get connections first
+        for attribute in self._slowest_first(attributes):
+            name = attribute.io_ref.attribute_name
+            if (previous := self._prefetches.get(name)) is not None:
+                # Started before this put, so it may return the old value
+                previous.cancel()
+
+            prefetch = asyncio.create_task(self._io.fetch(attribute))
+            prefetch.add_done_callback(self._prefetch_done)
+            self._prefetches[name] = prefetch
+
+    def _prefetch_done(self, task: asyncio.Task):
+        # Retrieve the error here, as the task is not awaited if it is replaced
+        if not task.cancelled() and (exception := task.exception()) is not None:
+            logger.warning("Failed to prefetch parameter", exception=repr(exception))
+
+    def _slowest_first(
+        self, attributes: list[AttrR[Any, EigerParameterRef]]
+    ) -> list[AttrR[Any, EigerParameterRef]]:
+        order = {
+            key: index
+            for index, key in enumerate(
+                self.dependency_graph.slowest_first(
+                    dict.fromkeys(attribute.io_ref.key for attribute in attributes)
+                )
+            )
+        }
+        return sorted(attributes, key=lambda attribute: order[attribute.io_ref.key])
+
+    async def verify_parameters(self, parameters: Iterable[str]) -> list[str]:
+        """Read back parameters that were updated from the value put to them.
+
+        The attributes are updated with the values from the detector, in case they
+        were not taken as put.
+
+        Args:
+            parameters: Keys of parameters to be verified
+
+        Returns: Keys of parameters whose values differed from the detector
+
+        """
+        attributes = self._get_attributes_for_parameters(parameters)
+        values = await self._io.fetch_many(attributes)
+        mismatched = [
+            attr.io_ref.key
+            for attr, value in zip(attributes, values, strict=True)
+            if not attr.datatype.equal(attr.get(), attr.datatype.validate(value))
+        ]
+        if mismatched:
+            logger.warning(
+                "Parameters differ from the values put", parameters=mismatched
+            )
+
+        await asyncio.gather(
+            *[
+                attr.update(value)
+                for attr, value in zip(attributes, values, strict=True)
+            ]
+        )
+        return mismatched
 
     async def update_now(self, parameters: Iterable[str]):
         """Update the given parameters immediately without queueing or setting the
@@ -157,23 +501,89 @@ class EigerSubsystemController(Controller):
 
         """
         if parameters:
-            coros = self._get_update_coros_for_parameters(parameters)
-            await asyncio.gather(*coros)
+            await self.update_parameters(parameters)
             logger.info("Parameters updated during put", parameters=parameters)
 
-    def _get_update_coros_for_parameters(
+    async def update_parameters(self, parameters: Iterable[str]):
+        """Update the given parameters from the detector concurrently.
+
+        Args:
+            parameters: Keys of parameters to be updated
+
+        """
+        attributes: list[AttrR[Any, EigerParameterRef]] = []
+        prefetched: dict[AttrR[Any, EigerParameterRef], asyncio.Task] = {}
+        for attribute in self._get_attributes_for_parameters(parameters):
+            if attribute.io_ref.is_array:
+                # Too large to read every time they change, so read on demand
+                self._io.invalidate_array(attribute)
+            elif prefetch := self._prefetches.pop(
+                attribute.io_ref.attribute_name, None
+            ):
+                prefetched[attribute] = prefetch
+            else:
+                attributes.append(attribute)
+
+        attributes = self._slowest_first(attributes)
+        values, prefetched_values = await asyncio.gather(
+            self._io.fetch_many(attributes), asyncio.gather(*prefetched.values())
+        )
+        await asyncio.gather(
+            *[
+                attr.update(value)
+                for attr, value in zip(
+                    attributes + list(prefetched),
+                    values + prefetched_values,
+                    strict=True,
+                )
+            ]
+        )
+
+    def _array_attributes(self) -> list[AttrR[Any, EigerParameterRef]]:
+        return [
+            attribute
+            for attribute in self.attributes.values()
+            if isinstance(attribute, AttrR)
+            and attribute.has_io_ref()
+            and isinstance(attribute.io_ref, EigerParameterRef)
+            and attribute.io_ref.is_array
+        ]
+
+    async def read_array_parameters(self, stale_only: bool = True):
+        """Read the values of array parameters from the detector.
+
+        Args:
+            stale_only: Only read arrays that may have changed since they were last
+                read or put
+
+        """
+        attributes = [
+            attribute
+            for attribute in self._array_attributes()
+            if not stale_only or self._io.array_stale(attribute)
+        ]
+        values = await self._io.fetch_many(attributes)
+        await asyncio.gather(
+            *[
+                attr.update(value)
+                for attr, value in zip(attributes, values, strict=True)
+            ]
+        )
+
+    def _get_attributes_for_parameters(
         self, parameters: Iterable[str]
-    ) -> list[Coroutine]:
-        coros: list[Coroutine] = []
+    ) -> list[AttrR[Any, EigerParameterRef]]:
+        attributes: list[AttrR[Any, EigerParameterRef]] = []
         for parameter in parameters:
             attr_name = key_to_attribute_name(parameter)
-            match self.attributes.get(attr_name, None):
-                case AttrR(io_ref=EigerParameterRef()) as attr:
-                    coros.append(self._io.update(attr))  # type: ignore
-                case _ as attr:
-                    if parameter not in IGNORED_KEYS:
-                        print(
-                            f"Failed to find updater for {parameter}"
-                            f"with attribute {attr}"
-                        )
-        return coros
+            for suffix in SPLIT_PARAMETERS.get(parameter, ("",)):
+                match self.attributes.get(attr_name + suffix, None):
+                    case AttrR(io_ref=EigerParameterRef()) as attr:
+                        attributes.append(attr)  # type: ignore
+                    case _ as attr:
+                        if parameter not in IGNORED_KEYS:
+                            print(
+                                f"Failed to find updater for {parameter}"
+                                f"with attribute {attr}"
+                            )
+        return attributes
@@ -1,13 +1,34 @@
 import asyncio
+import time
+from dataclasses import dataclass
+from pathlib import Path
 
-from fastcs.attributes import AttrRW
+import numpy as np
+from fastcs.attributes import AttrR, AttrRW
 from fastcs.connections import IPConnectionSettings
-from fastcs.datatypes import Bool, Int
+from fastcs.datatypes import Bool, Float, Int, String
+from fastcs.logging import logger
 from fastcs.methods import command
 
 from fastcs_eiger.controllers.eiger_controller import COMMAND_GROUP, EigerController
 from fastcs_eiger.controllers.odin.odin_controller import OdinController
 from fastcs_eiger.eiger_parameter import EigerAPIVersion
+from fastcs_eiger.http_connection import ConnectionPoolSettings
+from fastcs_eiger.vds import create_interleaved_vds
+
+
+@dataclass(frozen=True)
+class _VdsParameters:
+    """Parameters of the file writers for an acquisition, captured when it starts"""
+
+    directory: Path
+    file_prefix: str
+    frames: int
+    frame_shape: tuple[int, int]
+    dtype: np.dtype
+    frames_per_block: int
+    blocks_per_file: int
+    file_writers: int
 
 
 class EigerOdinController(EigerController):
@@ -19,15 +40,37 @@ class EigerOdinController(EigerController):
         description="Timeout for start writing command",
         group=COMMAND_GROUP,
     )
-    enable_vds_creation = AttrRW(Bool())
+    enable_vds_creation = AttrRW(
+        Bool(), description="Create a VDS of the frames when writing finishes"
+    )
+    vds_timeout = AttrRW(
+        Int(min=1),
+        initial_value=3600,
+        description="Time to wait for writing to finish before not creating the VDS",
+        group=COMMAND_GROUP,
+    )
+    vds_complete = AttrR(
+        Bool(), description="Whether the VDS of the last acquisition has been created"
+    )
+    vds_duration = AttrR(
+        Float(units="s", prec=3),
+        description="Time taken to create the VDS of the last acquisition",
+    )
+    vds_file = AttrR(String(), description="Path of the VDS of the last acquisition")
+
+    _vds_task: asyncio.Task | None = None
 
     def __init__(
         self,
         detector_connection_settings: IPConnectionSettings,
         odin_connection_settings: IPConnectionSettings,
         api_version: EigerAPIVersion,
+        pool_settings: ConnectionPoolSettings | None = None,
+        schema_cache_dir: Path | None = None,
     ) -> None:
-        super().__init__(detector_connection_settings, api_version)
+        super().__init__(
+            detector_connection_settings, api_version, pool_settings, schema_cache_dir
+        )
 
         self.OD = OdinController(odin_connection_settings)
 
@@ -64,6 +107,11 @@ class EigerOdinController(EigerController):
             self.OD.FP.data_datatype.put(f"uint{self.detector.bit_depth_image.get()}"),
         )
 
+        if self._vds_task is not None:
+            self._vds_task.cancel()
+            self._vds_task = None
+        await self.vds_complete.update(False)
+
         await self.OD.FP.start_writing()
 
         try:
@@ -72,3 +120,66 @@ class EigerOdinController(EigerController):
             )
         except TimeoutError as e:
             raise TimeoutError("File writers failed to start") from e
+
+        if self.enable_vds_creation.get():
+            parameters = self._vds_parameters()
+            self._vds_task = asyncio.create_task(self._create_vds(parameters))
+            self._vds_task.add_done_callback(self._vds_done)
+
+    def _vds_parameters(self) -> _VdsParameters:
+        return _VdsParameters(
+            directory=Path(self.OD.file_path.get()),
+            file_prefix=self.OD.file_prefix.get() or self.OD.acquisition_id.get(),
+            frames=self.OD.FP.frames.get(),
+            frame_shape=(self.OD.FP.data_dims_0.get(), self.OD.FP.data_dims_1.get()),
+            dtype=np.dtype(self.OD.FP.data_datatype.get()),
+            frames_per_block=max(self.OD.block_size.get(), 1),
+            blocks_per_file=self.OD.FP.process_blocks_per_file.get(),
+            file_writers=len(self.OD.FP),
+        )
+
+    async def _create_vds(self, parameters: _VdsParameters):
+        """Wait for the file writers to finish writing and create a VDS of the frames
+
+        The VDS maps the frames of the files of every file writer in the order they
+        were acquired, so it can be read as soon as writing finishes.
+
+        """
+        await self.OD.writing.wait_for_value(False, timeout=self.vds_timeout.get())
+
+        # Frames may be 0 to write until stopped, so map the frames that were written
+        frames = parameters.frames or self.OD.FP.frames_written.get()
+        if not frames:
+            logger.warning("No frames written, so not creating VDS")
+            return
+
+        path = parameters.directory / f"{parameters.file_prefix}_vds.h5"
+        start = time.monotonic()
+        await asyncio.to_thread(
+            create_interleaved_vds,
+            path,
+            parameters.file_prefix,
+            frames,
+            parameters.frame_shape,
+            parameters.dtype,
+            parameters.frames_per_block,
+            parameters.blocks_per_file,
+            parameters.file_writers,
+        )
+
+        await asyncio.gather(
+            self.vds_file.update(str(path)),
+            self.vds_duration.update(time.monotonic() - start),
+        )
+        await self.vds_complete.update(True)
+
+    def _vds_done(self, task: asyncio.Task):
+        if not task.cancelled() and (exception := task.exception()) is not None:
+            logger.error("Failed to create VDS", exception=repr(exception))
+
+    async def disconnect(self) -> None:
+        if self._vds_task is not None:
+            self._vds_task.cancel()
+            self._vds_task = None
+
+        await super().disconnect()
@@ -0,0 +1,128 @@
+import json
+import math
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+from fastcs.logging import logger
+
+LATENCY_SMOOTHING = 0.2
+"""Weight of the latest measurement in the moving average of fetch latencies"""
+
+
+class DependencyGraph:
+    """Parameters of a subsystem that change when each parameter is put, and how long
+    each parameter takes to fetch, as learned from the detector.
+
+    The detector responds to a PUT with the keys whose values may have changed as a
+    result, e.g. putting ``photon_energy`` changes the thresholds, so these can be
+    fetched as soon as the PUT returns, slowest first.
+
+    """
+
+    def __init__(
+        self,
+        dependents: dict[str, list[str]] | None = None,
+        latencies: dict[str, float] | None = None,
+    ):
+        self._dependents = {
+            key: dict.fromkeys(keys) for key, keys in (dependents or {}).items()
+        }
+        self._latencies = dict(latencies or {})
+        self.changed = False
+        """Whether dependents have been learned since the graph was last saved"""
+
+    def record_put(self, key: str, parameters: Iterable[str]):
+        """Record the parameters the detector reported changed by a PUT of ``key``.
+
+        Args:
+            key: Key of the parameter put
+            parameters: Keys of parameters in the response to the PUT
+
+        """
+        dependents = self._dependents.setdefault(key, {})
+        for parameter in parameters:
+            if parameter not in dependents:
+                dependents[parameter] = None
+                self.changed = True
+
+    def dependents(self, key: str) -> list[str]:
+        """Get the parameters that have changed when ``key`` was put."""
+        return list(self._dependents.get(key, ()))
+
+    def record_latency(self, key: str, latency: float):
+        """Add a measurement of the time in seconds taken to fetch ``key``."""
+        previous = self._latencies.get(key)
+        self._latencies[key] = (
+            latency
+            if previous is None
+            else previous + LATENCY_SMOOTHING * (latency - previous)
+        )
+
+    def latency(self, key: str) -> float | None:
+        """Get the average time in seconds taken to fetch ``key``, if known."""
+        return self._latencies.get(key)
+
+    def slowest_first(self, keys: Iterable[str]) -> list[str]:
+        """Order keys so that the slowest to fetch are requested first.
+
+        Keys that have not been fetched yet are put first, as they may be slow, and
+        otherwise keep their order.
+
+        """
+        return sorted(keys, key=lambda key: -self._latencies.get(key, math.inf))
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "dependents": {
+                key: list(dependents) for key, dependents in self._dependents.items()
+            },
+            "latencies": self._latencies,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "DependencyGraph":
+        return cls(data.get("dependents"), data.get("latencies"))
+
+
+class DependencyCache:
+    """On-disk cache of the ``DependencyGraph`` of each subsystem of a detector.
+
+    Args:
+        path: Path of the cache file
+
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def load(self) -> dict[str, DependencyGraph]:
+        """Load the cached graphs by subsystem, or none if there is no cache."""
+        if not self.path.is_file():
+            return {}
+
+        try:
+            return {
+                subsystem: DependencyGraph.from_dict(data)
+                for subsystem, data in json.loads(self.path.read_text()).items()
+            }
+        except (OSError, ValueError, AttributeError, TypeError):
+            logger.exception("Failed to load dependency cache", path=self.path)
+            return {}
+
+    def save(self, graphs: dict[str, DependencyGraph]):
+        """Write the graphs of each subsystem to the cache."""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(
+                json.dumps(
+                    {subsystem: graph.to_dict() for subsystem, graph in graphs.items()},
+                    indent=4,
+                )
+            )
+        except OSError:
+            logger.exception("Failed to save dependency cache", path=self.path)
+            return
+
+        for graph in graphs.values():
+            graph.changed = False
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+
+from fastcs.logging import logger
+
+from fastcs_eiger.http_connection import HTTPConnection
+
+
+@dataclass
+class DownloadProgress:
+    """Progress of a download of files from the filewriter"""
+
+    files: int = 0
+    """Number of files to download"""
+    files_downloaded: int = 0
+    """Number of files downloaded completely"""
+    bytes_downloaded: int = 0
+    """Number of bytes written, including files still downloading"""
+    start: float = field(default_factory=time.monotonic)
+    """Time the download started"""
+    end: float | None = None
+    """Time the download finished, if it has"""
+    in_progress: dict[str, float] = field(default_factory=dict)
+    """Fraction downloaded of each file still downloading"""
+
+    @property
+    def fraction(self) -> float:
+        """Fraction of all files downloaded, counting partly downloaded files."""
+        if not self.files:
+            return 1.0 if self.end is not None else 0.0
+
+        return (self.files_downloaded + sum(self.in_progress.values())) / self.files
+
+    @property
+    def throughput(self) -> float:
+        """Mean rate of the download in bytes per second."""
+        duration = (self.end or time.monotonic()) - self.start
+        return self.bytes_downloaded / duration if duration > 0 else 0.0
+
+
+def data_uri(filename: str) -> str:
+    """Get the URI of a file written by the filewriter."""
+    return f"data/{filename}"
+
+
+async def download_files(
+    connection: HTTPConnection,
+    filenames: Sequence[str],
+    directory: Path,
+    concurrency: int,
+    progress: DownloadProgress,
+):
+    """Download files from the filewriter concurrently, streaming each to disk.
+
+    Master files link to data files, so they are downloaded after the data files have
+    started, and each file only appears in ``directory`` once it is complete.
+
+    Args:
+        connection: Connection to the detector
+        filenames: Names of the files to download
+        directory: Directory to write the files to
+        concurrency: Maximum number of files to download at once
+        progress: Updated as the files are downloaded
+
+    Raises: ExceptionGroup of the errors of any downloads that fail, after the other
+        downloads are cancelled
+
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    progress.files = len(filenames)
+
+    async def _download(filename: str):
+        async with semaphore:
+            written = 0
+
+            def on_progress(received: int, total: int | None):
+                nonlocal written
+                progress.bytes_downloaded += received - written
+                written = received
+                progress.in_progress[filename] = received / total if total else 0.0
+
+            try:
+                await connection.download(
+                    data_uri(filename),
+                    # The detector only gives names, but do not write outside directory
+                    directory / PurePosixPath(filename).name,
+                    on_progress=on_progress,
+                )
+            finally:
+                progress.in_progress.pop(filename, None)
+
+            progress.files_downloaded += 1
+            logger.info("Downloaded file", filename=filename, size=written)
+
+    try:
+        # If one download fails the others are cancelled, rather than left running
+        async with asyncio.TaskGroup() as task_group:
+            for filename in sorted(filenames, key=lambda name: "_master" in name):
+                task_group.create_task(_download(filename))
+    finally:
+        progress.end = time.monotonic()
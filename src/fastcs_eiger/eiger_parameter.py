@@ -1,12 +1,41 @@
+import math
 from dataclasses import dataclass
 from typing import Any, Literal
 
+import numpy as np
 from fastcs.attributes import AttributeIORef
-from fastcs.datatypes import Bool, DataType, Float, Int, String
+from fastcs.datatypes import Bool, DataType, Float, Int, String, Waveform
 from pydantic import BaseModel
 
+from fastcs_eiger.image import ImageWaveform
+
 EigerAPIVersion = Literal["1.6.0", "1.8.0"]
 
+ARRAY_PARAMETERS: dict[str, Literal["float", "uint"]] = {
+    "pixel_mask": "uint",
+    "flatfield": "float",
+    "countrate_correction_table": "float",
+}
+"""Last section of the keys of parameters with array values, and their value types.
+
+These are transferred as TIFF images rather than JSON, and only read on demand.
+"""
+_ARRAY_DTYPES: dict[str, type[np.generic]] = {"float": np.float32, "uint": np.uint32}
+COUNTRATE_CORRECTION_TABLE_LENGTH = 1 << 16
+"""Maximum length of the count rate correction table"""
+SPLIT_PARAMETERS: dict[str, tuple[str, ...]] = {
+    # Value is [value, max], rather than using max metadata
+    "buffer_fill_level": ("", "_max"),
+}
+"""Keys of parameters with list values to create an attribute for each element of,
+and the suffix of the attribute name of each element"""
+_LIST_DTYPES: dict[str, Any] = {
+    "float": np.float64,
+    "int": np.int32,
+    "uint": np.uint32,
+    "bool": np.bool_,
+}
+
 
 class EigerParameterResponse(BaseModel):
     access_mode: Literal["r", "w", "rw"] | None = None
@@ -26,7 +55,7 @@ class EigerParameterRef(AttributeIORef):
     """Poll period for parameter"""
     key: str
     """Last section of URI within a subsystem/mode."""
-    subsystem: Literal["detector", "stream", "monitor"]
+    subsystem: Literal["detector", "stream", "monitor", "filewriter"]
     """Subsystem within detector API."""
     api_version: EigerAPIVersion = "1.8.0"
     """Version of API to use."""
@@ -34,18 +63,54 @@ class EigerParameterRef(AttributeIORef):
     """Mode of parameter within subsystem."""
     response: EigerParameterResponse
     """JSON response from GET of parameter."""
+    shape: tuple[int, ...] | None = None
+    """Maximum shape of the value, if it is a list or array. Array values have the
+    shape of the detector, but the attribute value is flattened."""
+    index: int | None = None
+    """Index of the element of a list value to use as the value, if it is split."""
 
     @property
     def attribute_name(self):
-        return key_to_attribute_name(self.key)
+        name = key_to_attribute_name(self.key)
+        if self.index is not None:
+            name += SPLIT_PARAMETERS[self.key][self.index]
+
+        return name
 
     @property
     def uri(self) -> str:
         """Full URI for HTTP requests."""
         return f"{self.subsystem}/api/{self.api_version}/{self.mode}/{self.key}"
 
+    @property
+    def is_array(self) -> bool:
+        """Whether the value is a large array, transferred as a TIFF image."""
+        return self.shape is not None and is_array_key(self.key)
+
+    @property
+    def echoes_exactly(self) -> bool:
+        """Whether the detector takes values exactly as they are put, without rounding
+        or clamping them, so the value put can be used without reading it back."""
+        if self.shape is not None or self.index is not None:
+            return False
+
+        return self.response.value_type == "bool" or (
+            self.response.value_type == "string"
+            and self.response.allowed_values is not None
+        )
+
     @property
     def fastcs_datatype(self) -> DataType:
+        if self.is_array:
+            assert self.shape is not None
+            # Flattened, as the CA transport only supports 1-D waveforms
+            return ImageWaveform(
+                _ARRAY_DTYPES[self.response.value_type],
+                shape=(math.prod(self.shape),),
+            )
+        elif self.shape is not None:
+            return Waveform(_LIST_DTYPES[self.response.value_type], shape=self.shape)
+
         match self.response.value_type:
             case "float":
                 return Float(prec=minimum_to_precision(self.response.min))
@@ -79,6 +144,45 @@ def key_to_attribute_name(key: str):
     return key.replace("/", "_")
 
 
+def is_array_key(key: str) -> bool:
+    """Check if a key is of a parameter with array values, e.g. ``pixel_mask``."""
+    return key.rsplit("/", 1)[-1] in ARRAY_PARAMETERS
+
+
+def list_shape(value_type: str, value: Any) -> tuple[int, ...] | None:
+    """Get the shape of a parameter with a numeric list value, or ``None`` if the
+    value is not a numeric list.
+
+    Numeric lists have a fixed length, e.g. the axes of the detector orientation.
+    Lists of strings vary in length, e.g. a list of errors, so they are kept as
+    ``String`` parameters.
+
+    Args:
+        value_type: Type of the value given in the response of the parameter
+        value: Value of the parameter
+
+    """
+    if value_type in _LIST_DTYPES and isinstance(value, list):
+        return (len(value),)
+
+    return None
+
+
+def array_shape(key: str, width: int, height: int) -> tuple[int, ...]:
+    """Get the maximum shape of an array parameter of a detector.
+
+    Args:
+        key: Key of the parameter
+        width: Number of pixels in each row of the detector
+        height: Number of rows of pixels in the detector
+
+    """
+    if key.rsplit("/", 1)[-1] == "countrate_correction_table":
+        return (COUNTRATE_CORRECTION_TABLE_LENGTH,)
+
+    return (height, width)
+
+
 def minimum_to_precision(value: float | None) -> int:
     if value is not None:
         value_as_str = str(value)
@@ -0,0 +1,472 @@
+import asyncio
+import re
+import struct
+import sys
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from fastcs.logging import logger
+
+FRAME_RING_SLOTS = 8
+"""Default number of frames kept in a ``FrameRing``"""
+MAX_DIMENSIONS = 4
+"""Maximum number of dimensions of a frame in a ``FrameRing``"""
+FRAME_RING_POLL_PERIOD = 0.01
+"""Default period in seconds for a ``FrameRingReader`` to check for new frames"""
+
+_MAGIC = b"EIGRING1"
+_CLOSED = bytes(len(_MAGIC))
+# magic, slots, slot capacity in bytes, frames written
+_HEADER = struct.Struct("<8sIxxxxQQ")
+_HEADER_SIZE = 64
+# sequence, frame number, series id, dtype, ndim, shape, nbytes, timestamp,
+# total counts, max count, processing duration
+_SLOT_HEADER = struct.Struct(f"<Qqq8sIxxxx{MAX_DIMENSIONS}QQdddd")
+_SLOT_HEADER_SIZE = 128
+_WRITE_COUNT_OFFSET = _HEADER.size - 8
+
+
+def frame_ring_name(host: str, subsystem: str) -> str:
+    """Default name of the shared memory of the frame ring of a detector subsystem.
+
+    The name includes the detector host, so IOCs of different detectors on the same
+    host do not share a ring.
+
+    Args:
+        host: Host name or IP address of the detector
+        subsystem: Subsystem writing to the ring, e.g. ``monitor``
+
+    """
+    host = re.sub(r"[^\w.-]", "_", host)
+    return f"fastcs_eiger_{host}_{subsystem}"
+
+
+@dataclass
+class FrameRingEntry:
+    """A frame in a ``FrameRing`` and its header"""
+
+    frame_number: int
+    series_id: int
+    timestamp: float
+    """Time the frame was written, as seconds since the epoch"""
+    total_counts: float
+    """Sum of the unmasked pixels of the frame, if calculated by the writer"""
+    max_count: float
+    """Maximum unmasked pixel of the frame, if calculated by the writer"""
+    duration: float
+    """Time taken by the writer to process the frame in seconds"""
+    frame: np.ndarray
+    """The frame, which is a view of the shared memory unless copied"""
+
+
+class FrameRing:
+    """Ring buffer of recent frames in POSIX shared memory.
+
+    The ring has a header of the number of slots, their capacity and the number of
+    frames written. Each slot has a header of the frame number, series id, dtype and
+    shape of its frame, along with statistics, followed by the frame data.
+
+    There is one writer. Each slot header starts with a sequence number that is odd
+    while the slot is being written, so readers can check if a slot was overwritten
+    while they read it.
+
+    Use ``FrameRing.create`` to create a ring to write to, or ``FrameRing.attach`` to
+    read from an existing ring.
+
+    """
+
+    def __init__(self, shared_memory: SharedMemory, owner: bool):
+        self._shared_memory = shared_memory
+        self._owner = owner
+        buffer = shared_memory.buf
+        assert buffer is not None
+        self._buffer = buffer
+
+        magic, self.slots, self.slot_capacity, _ = _HEADER.unpack_from(self._buffer)
+        if magic != _MAGIC:
+            del self._buffer
+            shared_memory.close()
+            raise ValueError(f"Shared memory {shared_memory.name} is not a FrameRing")
+
+    @classmethod
+    def create(
+        cls, name: str, slot_capacity: int, slots: int = FRAME_RING_SLOTS
+    ) -> "FrameRing":
+        """Create a ring to write frames to.
+
+        Args:
+            name: Name of the shared memory, e.g. ``fastcs_eiger_i03-eiger_stream``
+            slot_capacity: Maximum size in bytes of each frame
+            slots: Number of frames to keep
+
+        """
+        size = _HEADER_SIZE + slots * (_SLOT_HEADER_SIZE + slot_capacity)
+        shared_memory = SharedMemory(name, create=True, size=size)
+        assert shared_memory.buf is not None
+        _HEADER.pack_into(shared_memory.buf, 0, _MAGIC, slots, slot_capacity, 0)
+        return cls(shared_memory, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, track: bool = True) -> "FrameRing":
+        """Attach to an existing ring to read frames from it.
+
+        Args:
+            name: Name of the shared memory
+            track: Whether the resource tracker of this process may remove the shared
+                memory when the process exits. This should be ``False`` unless the
+                process shares the resource tracker of the writer, i.e. it was
+                started by ``multiprocessing`` from the writer or is the writer.
+
+        """
+        if sys.version_info >= (3, 13):
+            return cls(SharedMemory(name, track=track), owner=False)
+
+        shared_memory = SharedMemory(name)
+        if not track:
+            resource_tracker.unregister(f"/{shared_memory.name}", "shared_memory")
+
+        return cls(shared_memory, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self._shared_memory.name
+
+    @property
+    def closed(self) -> bool:
+        """Whether the writer has closed the ring, e.g. to create a larger one."""
+        return bytes(self._buffer[: len(_MAGIC)]) != _MAGIC
+
+    @property
+    def write_count(self) -> int:
+        """Number of frames written to the ring."""
+        (count,) = struct.unpack_from("<Q", self._buffer, _WRITE_COUNT_OFFSET)
+        return count
+
+    def _slot_offset(self, index: int) -> int:
+        return _HEADER_SIZE + (index % self.slots) * (
+            _SLOT_HEADER_SIZE + self.slot_capacity
+        )
+
+    def _sequence(self, offset: int) -> int:
+        (sequence,) = struct.unpack_from("<Q", self._buffer, offset)
+        return sequence
+
+    def write(
+        self,
+        frame: np.ndarray,
+        frame_number: int,
+        series_id: int,
+        total_counts: float = 0.0,
+        max_count: float = 0.0,
+        duration: float = 0.0,
+    ):
+        """Write a frame to the next slot, overwriting the oldest frame.
+
+        Args:
+            frame: Frame to write
+            frame_number: Index of the frame in the series
+            series_id: Id of the series
+            total_counts: Sum of the unmasked pixels of the frame
+            max_count: Maximum unmasked pixel of the frame
+            duration: Time taken to process the frame in seconds
+
+        Raises:
+            ValueError: If the frame is larger than the capacity of the slots
+
+        """
+        if frame.nbytes > self.slot_capacity or frame.ndim > MAX_DIMENSIONS:
+            raise ValueError(
+                f"Frame of shape {frame.shape} and dtype {frame.dtype} does not fit "
+                f"in ring with slots of {self.slot_capacity} bytes"
+            )
+
+        count = self.write_count
+        offset = self._slot_offset(count)
+        sequence = self._sequence(offset) + 1
+        struct.pack_into("<Q", self._buffer, offset, sequence)
+
+        data_offset = offset + _SLOT_HEADER_SIZE
+        np.copyto(
+            np.ndarray(
+                frame.shape,
+                dtype=frame.dtype,
+                buffer=self._buffer,
+                offset=data_offset,
+            ),
+            frame,
+        )
+        _SLOT_HEADER.pack_into(
+            self._buffer,
+            offset,
+            sequence + 1,
+            frame_number,
+            series_id,
+            frame.dtype.str.encode(),
+            frame.ndim,
+            *frame.shape,
+            *[0] * (MAX_DIMENSIONS - frame.ndim),
+            frame.nbytes,
+            time.time(),
+            total_counts,
+            max_count,
+            duration,
+        )
+        struct.pack_into("<Q", self._buffer, _WRITE_COUNT_OFFSET, count + 1)
+
+    def read(self, index: int, copy: bool = True) -> FrameRingEntry | None:
+        """Read a frame from the ring.
+
+        Args:
+            index: Index of the frame in the order written, which is kept until
+                ``slots`` more frames are written
+            copy: Whether to copy the frame out of the shared memory. If not, the
+                frame is a view that is overwritten when the slot is reused.
+
+        Returns: The frame, or ``None`` if it has not been written or was overwritten
+
+        """
+        count = self.write_count
+        if not max(count - self.slots, 0) <= index < count:
+            return None
+
+        offset = self._slot_offset(index)
+        (
+            sequence,
+            frame_number,
+            series_id,
+            dtype,
+            ndim,
+            *fields,
+        ) = _SLOT_HEADER.unpack_from(self._buffer, offset)
+        shape = tuple(fields[:ndim])
+        _, timestamp, total_counts, max_count, duration = fields[MAX_DIMENSIONS:]
+        if sequence % 2:
+            # Being written
+            return None
+
+        frame = np.ndarray(
+            shape,
+            dtype=np.dtype(dtype.rstrip(b"\0").decode()),
+            buffer=self._buffer,
+            offset=offset + _SLOT_HEADER_SIZE,
+        )
+        if copy:
+            frame = frame.copy()
+
+        if self._sequence(offset) != sequence or self.write_count - self.slots > index:
+            # Overwritten while reading
+            return None
+
+        return FrameRingEntry(
+            frame_number=frame_number,
+            series_id=series_id,
+            timestamp=timestamp,
+            total_counts=total_counts,
+            max_count=max_count,
+            duration=duration,
+            frame=frame,
+        )
+
+    def latest(self, copy: bool = True) -> FrameRingEntry | None:
+        """Read the last frame written to the ring, if any.
+
+        Args:
+            copy: Whether to copy the frame out of the shared memory
+
+        """
+        return self.read(self.write_count - 1, copy=copy)
+
+    def close(self):
+        """Close the ring, and remove it if this is the writer.
+
+        Any frames read without copying must be released first.
+
+        """
+        if self._owner:
+            # Tell readers the ring is gone, as they can still read it after unlink
+            self._buffer[: len(_CLOSED)] = _CLOSED
+
+        del self._buffer
+        self._shared_memory.close()
+        if self._owner:
+            self._shared_memory.unlink()
+
+
+class FrameRingWriter:
+    """Write frames to a ``FrameRing`` that is sized to fit them.
+
+    The ring is created when the first frame is written, and created again under the
+    same name if a larger frame is written. ``FrameRingReader`` follows the ring
+    when it is created again.
+
+    Shared memory that already exists under the name, and so was not created by this
+    writer, is never removed. Frames are not written until it is removed.
+
+    Args:
+        name: Name of the shared memory of the ring
+        slots: Number of frames to keep
+
+    """
+
+    def __init__(self, name: str, slots: int = FRAME_RING_SLOTS):
+        self.name = name
+        self.slots = slots
+        self.generation = 0
+        """Number of times the ring has been created"""
+        self._ring: FrameRing | None = None
+        self._name_in_use = False
+
+    def write(
+        self,
+        frame: np.ndarray,
+        frame_number: int,
+        series_id: int,
+        total_counts: float = 0.0,
+        max_count: float = 0.0,
+        duration: float = 0.0,
+    ):
+        """Write a frame to the ring, creating the ring if the frame does not fit.
+
+        See ``FrameRing.write``.
+
+        """
+        if self._ring is None or frame.nbytes > self._ring.slot_capacity:
+            self.close()
+            try:
+                self._ring = FrameRing.create(self.name, frame.nbytes, self.slots)
+            except FileExistsError:
+                # Belongs to another writer, or was left behind by one that did not
+                # close its ring, so only warn once rather than remove it
+                if not self._name_in_use:
+                    logger.warning("Shared memory already exists", name=self.name)
+                    self._name_in_use = True
+                return
+
+            self._name_in_use = False
+            self.generation += 1
+
+        self._ring.write(
+            frame, frame_number, series_id, total_counts, max_count, duration
+        )
+
+    def close(self):
+        """Close and remove the ring, if it has been created."""
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+
+class FrameRingReader:
+    """Read new frames from a ``FrameRing`` written by another process.
+
+    Frames written after the reader is created are read. The reader can be created
+    before the ring, and attaches to the ring again if the writer creates it again.
+
+    Frames can be read without copying them out of the shared memory, but such frames
+    are only valid until the writer reuses their slot, i.e. until ``slots`` more
+    frames are written, and must be released before the reader is closed.
+
+    Example::
+
+        reader = FrameRingReader("fastcs_eiger_i03-eiger_monitor")
+        async for entry in reader.frames():
+            print(entry.frame_number, entry.frame.sum())
+
+    Args:
+        name: Name of the shared memory of the ring
+        track: See ``FrameRing.attach``
+
+    """
+
+    def __init__(self, name: str, track: bool = False):
+        self.name = name
+        self.missed_frames = 0
+        """Number of frames overwritten before they were read"""
+        self._track = track
+        self._ring: FrameRing | None = None
+        self._next_index = 0
+        if (ring := self._attach()) is not None:
+            self._next_index = ring.write_count
+
+    def _attach(self) -> FrameRing | None:
+        if self._ring is not None and not self._ring.closed:
+            return self._ring
+
+        self.close()
+        try:
+            self._ring = FrameRing.attach(self.name, track=self._track)
+        except (FileNotFoundError, ValueError):
+            # Not created yet, or being created
+            return None
+
+        self._next_index = 0
+        return self._ring
+
+    def read_new(self, copy: bool = True) -> list[FrameRingEntry]:
+        """Read the frames written since the last read.
+
+        Frames that were overwritten before they could be read are counted in
+        ``missed_frames``.
+
+        Args:
+            copy: Whether to copy the frames out of the shared memory
+
+        """
+        ring = self._attach()
+        if ring is None:
+            return []
+
+        count = ring.write_count
+        oldest = max(count - ring.slots, 0)
+        if self._next_index < oldest:
+            self.missed_frames += oldest - self._next_index
+            self._next_index = oldest
+
+        entries: list[FrameRingEntry] = []
+        for index in range(self._next_index, count):
+            entry = ring.read(index, copy=copy)
+            if entry is None:
+                self.missed_frames += 1
+            else:
+                entries.append(entry)
+
+        self._next_index = count
+        return entries
+
+    def latest(self, copy: bool = True) -> FrameRingEntry | None:
+        """Read the last frame written to the ring, if any.
+
+        Args:
+            copy: Whether to copy the frame out of the shared memory
+
+        """
+        ring = self._attach()
+        return None if ring is None else ring.latest(copy=copy)
+
+    async def frames(
+        self, copy: bool = True, poll_period: float = FRAME_RING_POLL_PERIOD
+    ) -> AsyncIterator[FrameRingEntry]:
+        """Iterate over new frames as they are written.
+
+        Args:
+            copy: Whether to copy the frames out of the shared memory
+            poll_period: Period in seconds to check for new frames
+
+        """
+        while True:
+            entries = self.read_new(copy=copy)
+            for entry in entries:
+                yield entry
+
+            if not entries:
+                await asyncio.sleep(poll_period)
+
+    def close(self):
+        """Detach from the ring, if attached."""
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
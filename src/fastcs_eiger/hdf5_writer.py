@@ -0,0 +1,299 @@
+import asyncio
+import json
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any
+
+import h5py
+import numpy as np
+from fastcs.logging import logger
+
+from fastcs_eiger.stream import CompressedArray, StreamMessage
+
+WRITE_QUEUE_SIZE = 64
+"""Number of messages to queue for writing before the stream consumer waits"""
+
+# HDF5 filters with the same framing as the compression algorithms of the detector,
+# so compressed images can be written as chunks without recompressing them
+_BITSHUFFLE_FILTER = 32008
+_LZ4_FILTER = 32004
+
+
+def _filter_options(algorithm: str, dtype: np.dtype) -> tuple[int, tuple[int, ...]]:
+    match algorithm:
+        case "bslz4":
+            # The filter is not registered to fill in its version and element size
+            # when the dataset is created, so give all of its options: version 0.5,
+            # the element size, automatic block size and LZ4 compression
+            return _BITSHUFFLE_FILTER, (0, 5, dtype.itemsize, 0, 2)
+        case _:
+            return _LZ4_FILTER, (0,)
+
+
+def _create_dataset(
+    group: h5py.Group,
+    name: str,
+    shape: tuple[int, ...],
+    dtype: np.dtype,
+    chunks: tuple[int, ...],
+    maxshape: tuple[int | None, ...] | None = None,
+    algorithm: str | None = None,
+) -> h5py.Dataset:
+    compression, compression_opts = (
+        _filter_options(algorithm, dtype) if algorithm is not None else (None, None)
+    )
+    return group.create_dataset(
+        name,
+        shape=shape,
+        dtype=dtype,
+        chunks=chunks,
+        maxshape=maxshape,
+        compression=compression,
+        compression_opts=compression_opts,
+        # The filter is only needed to read the data, not to write chunks directly
+        allow_unknown_filter=True,
+    )
+
+
+def _write_metadata(group: h5py.Group, metadata: Mapping[str, Any]):
+    """Write the parameters from a start message as datasets in ``group``."""
+    for key, value in metadata.items():
+        match value:
+            case None:
+                continue
+            case Mapping():
+                _write_metadata(group.require_group(key), value)
+            case CompressedArray(shape=shape, dtype=dtype, algorithm=algorithm):
+                dataset = _create_dataset(
+                    group, key, shape, dtype, chunks=shape, algorithm=algorithm
+                )
+                dataset.id.write_direct_chunk((0,) * len(shape), value.data)
+            case _:
+                try:
+                    array = np.asarray(value)
+                except ValueError:
+                    # Ragged lists do not make an array
+                    group[key] = json.dumps(value, default=str)
+                    continue
+
+                if array.dtype.kind not in "OUS":
+                    group[key] = array
+                elif array.ndim == 0:
+                    group[key] = str(value)
+                else:
+                    group[key] = json.dumps(value, default=str)
+
+
+def _nx_group(parent: h5py.Group, name: str, nx_class: str) -> h5py.Group:
+    group = parent.require_group(name)
+    group.attrs["NX_class"] = nx_class
+    return group
+
+
+class Hdf5StreamWriter:
+    """Write the messages of a series from the stream to NeXus style HDF5 files.
+
+    Each series is written to a master file, with the parameters of the acquisition
+    from the start message in ``/entry/instrument/detector``, and data files of up to
+    ``frames_per_file`` images in ``/entry/data/data``, or a dataset per channel if
+    there are several. The master file links to the datasets of each data file.
+
+    Compressed images are written as chunks with ``write_direct_chunk``, so they are
+    never decompressed. The bslz4 and lz4 framing of the detector is the same as that
+    of the HDF5 bitshuffle and LZ4 filters, so the files can be read with the filters
+    installed, e.g. with ``hdf5plugin``. These images have one image per chunk, as the
+    detector compresses each image separately, while uncompressed images are chunked
+    by ``chunk_frames``.
+
+    Only messages in the stream2 CBOR format have the images and parameters to write.
+
+    Args:
+        directory: Directory to write files to
+        name_pattern: Name of the files of each series, where ``$id`` is replaced by
+            the series id
+        frames_per_file: Maximum number of images in each data file
+        chunk_frames: Number of images in each chunk of uncompressed images
+        queue_size: Number of messages to queue before ``put`` waits
+
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        name_pattern: str = "series_$id",
+        frames_per_file: int = 1000,
+        chunk_frames: int = 1,
+        queue_size: int = WRITE_QUEUE_SIZE,
+    ):
+        self.directory = directory
+        self.name_pattern = name_pattern
+        self.frames_per_file = frames_per_file
+        self.chunk_frames = chunk_frames
+        self.frames_written = 0
+        """Number of images written"""
+        self.files_written = 0
+        """Number of data files created"""
+        # None is queued by `stop`, after the last message to write
+        self._queue: asyncio.Queue[StreamMessage | None] = asyncio.Queue(queue_size)
+        self._series_id: int | None = None
+        self._name = ""
+        self._master: h5py.File | None = None
+        self._data_file: tuple[int, h5py.File] | None = None
+        self._data_file_numbers: set[int] = set()
+
+    @property
+    def queued(self) -> int:
+        """Number of messages waiting to be written."""
+        return self._queue.qsize()
+
+    async def put(self, message: StreamMessage):
+        """Queue a message to be written, waiting if the queue is full.
+
+        Waiting holds up receiving from the stream, so the detector buffers images
+        rather than this process if writing falls behind.
+
+        """
+        await self._queue.put(message)
+
+    async def stop(self):
+        """Make ``run`` return once the messages already queued have been written."""
+        await self._queue.put(None)
+
+    async def run(self):
+        """Write queued messages in a worker thread until ``stop`` is called.
+
+        If this is cancelled, messages still queued are not written, but the write in
+        progress is finished before the files are closed, so they are not corrupted.
+
+        """
+        write: asyncio.Future | None = None
+        try:
+            while (message := await self._queue.get()) is not None:
+                write = asyncio.ensure_future(asyncio.to_thread(self.write, message))
+                try:
+                    # The thread cannot be stopped, so do not cancel its future
+                    await asyncio.shield(write)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception(
+                        "Failed to write stream message",
+                        series_id=message.series_id,
+                        image_id=message.image_id,
+                    )
+        finally:
+            if write is not None:
+                await asyncio.gather(write, return_exceptions=True)
+            await asyncio.to_thread(self.close)
+
+    def write(self, message: StreamMessage):
+        """Write a message to the files of its series.
+
+        This blocks on file IO, so should be run in a thread rather than on the event
+        loop, e.g. by ``run``.
+
+        """
+        match message.type:
+            case "start":
+                self._start_series(message.series_id, message.metadata)
+            case "image" if message.image_id is not None and message.data:
+                if message.series_id != self._series_id:
+                    # Missed the start of the series, so write without its parameters
+                    self._start_series(message.series_id, {})
+
+                self._write_image(message.image_id, message.data)
+            case "end":
+                self.close()
+
+    def _start_series(self, series_id: int, metadata: Mapping[str, Any]):
+        self.close()
+        self._series_id = series_id
+        self._name = self.name_pattern.replace("$id", str(series_id))
+        self._master = h5py.File(self.directory / f"{self._name}_master.h5", "w")
+
+        entry = _nx_group(self._master, "entry", "NXentry")
+        instrument = _nx_group(entry, "instrument", "NXinstrument")
+        _write_metadata(_nx_group(instrument, "detector", "NXdetector"), metadata)
+        _nx_group(entry, "data", "NXdata")
+
+    def _write_image(
+        self, image_id: int, data: Mapping[str, np.ndarray | CompressedArray]
+    ):
+        file_index, index = divmod(image_id, self.frames_per_file)
+        file_number = file_index + 1
+        group = self._open_data_file(file_number)["entry/data"]
+        for channel, image in data.items():
+            name = "data" if len(data) == 1 else channel
+            dataset = group.get(name)
+            if dataset is None:
+                dataset = self._create_image_dataset(group, name, image)
+                assert self._master is not None
+                # Link relative to the master file, so the files can be moved
+                self._master["entry/data"][f"{name}_{file_number:06d}"] = (
+                    h5py.ExternalLink(Path(group.file.filename).name, dataset.name)
+                )
+
+            if dataset.shape[0] <= index:
+                dataset.resize(index + 1, axis=0)
+
+            match image:
+                case CompressedArray():
+                    dataset.id.write_direct_chunk(
+                        (index,) + (0,) * len(image.shape), image.data
+                    )
+                case _:
+                    dataset[index] = image
+
+        self.frames_written += 1
+
+    def _create_image_dataset(
+        self, group: h5py.Group, name: str, image: np.ndarray | CompressedArray
+    ) -> h5py.Dataset:
+        match image:
+            case CompressedArray(shape=shape, dtype=dtype, algorithm=algorithm):
+                chunks = (1, *shape)
+            case _:
+                shape, dtype, algorithm = image.shape, image.dtype, None
+                chunks = (min(self.chunk_frames, self.frames_per_file), *shape)
+
+        return _create_dataset(
+            group,
+            name,
+            (0, *shape),
+            dtype,
+            chunks=chunks,
+            maxshape=(self.frames_per_file, *shape),
+            algorithm=algorithm,
+        )
+
+    def _open_data_file(self, file_number: int) -> h5py.File:
+        if self._data_file is not None and self._data_file[0] == file_number:
+            return self._data_file[1]
+
+        self._close_data_file()
+        path = self.directory / f"{self._name}_data_{file_number:06d}.h5"
+        if file_number in self._data_file_numbers:
+            file = h5py.File(path, "a")
+        else:
+            file = h5py.File(path, "w")
+            _nx_group(_nx_group(file, "entry", "NXentry"), "data", "NXdata")
+            self._data_file_numbers.add(file_number)
+            self.files_written += 1
+
+        self._data_file = (file_number, file)
+        return file
+
+    def _close_data_file(self):
+        if self._data_file is not None:
+            self._data_file[1].close()
+            self._data_file = None
+
+    def close(self):
+        """Close the files of the current series, if any."""
+        self._close_data_file()
+        if self._master is not None:
+            self._master.close()
+            self._master = None
+
+        self._series_id = None
+        self._data_file_numbers.clear()
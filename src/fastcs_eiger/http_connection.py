@@ -1,8 +1,17 @@
-from typing import Any
+import asyncio
+import os
+import time
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Literal, overload
 
-from aiohttp import ClientResponse, ClientSession, ClientTimeout
+from aiohttp import ClientResponse, ClientSession, ClientTimeout, TCPConnector
 from fastcs.connections import IPConnectionSettings
 
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+"""Size in bytes of the chunks to write downloaded files in"""
+
 
 class HTTPRequestError(ConnectionError):
     def __init__(self, message: str, response: ClientResponse):
@@ -10,13 +19,70 @@ class HTTPRequestError(ConnectionError):
             f"{message} - "
             f"Response({response.status}): '{response.content.read_nowait().decode()}'"
         )
+        self.status = response.status
+
+
+@dataclass
+class ConnectionPoolSettings:
+    """Settings for the pool of connections an ``HTTPConnection`` holds open and the
+    requests made over them"""
+
+    limit: int = 8
+    """Maximum number of simultaneous connections to the server"""
+    keepalive_timeout: float = 30
+    """Time in seconds to keep an idle connection open for reuse"""
+    dns_cache_ttl: int = 300
+    """Time in seconds to cache resolved host names"""
+    prewarm: int = 0
+    """Number of connections to open before they are first needed"""
+    bulk_window: int = 8
+    """Maximum number of requests in flight at once for bulk reads"""
+    request_timeout: float = 3
+    """Timeout in seconds for GET requests"""
+
+
+@dataclass
+class BulkRequestStats:
+    """Statistics of the requests made by ``HTTPConnection.get_many``"""
+
+    requests: int = 0
+    """Total number of requests made"""
+    duration: float = 0.0
+    """Total time in seconds spent making requests"""
+    total_latency: float = 0.0
+    """Sum of the latencies in seconds of all requests"""
+    max_latency: float = 0.0
+    """Longest latency in seconds of any request"""
+
+    @property
+    def throughput(self) -> float:
+        """Mean number of requests completed per second."""
+        return self.requests / self.duration if self.duration else 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        """Mean latency in seconds of a request."""
+        return self.total_latency / self.requests if self.requests else 0.0
 
 
 class HTTPConnection:
-    def __init__(self, connection_settings: IPConnectionSettings):
+    def __init__(
+        self,
+        connection_settings: IPConnectionSettings,
+        pool_settings: ConnectionPoolSettings | None = None,
+    ):
         self._session: ClientSession | None = None
         self._ip = connection_settings.ip
         self._port = connection_settings.port
+        self._pool_settings = pool_settings
+        self._settings = pool_settings or ConnectionPoolSettings()
+        self._pending_gets: dict[str, asyncio.Future[dict[str, Any]]] = {}
+        self.bulk_stats = BulkRequestStats()
+
+    @property
+    def ip(self) -> str:
+        """IP address of the server."""
+        return self._ip
 
     def full_url(self, uri) -> str:
         """Expand IP address, port and URI into full URL.
@@ -33,8 +99,49 @@ class HTTPConnection:
         When called the session will be created in the context of the current running
         asyncio loop.
 
+        If the connection has ``ConnectionPoolSettings``, the session will share a
+        connector limited to that many connections, otherwise the aiohttp defaults are
+        used.
+
         """
-        self._session = ClientSession()
+        if self._pool_settings is None:
+            self._session = ClientSession()
+        else:
+            connector = TCPConnector(
+                limit=self._pool_settings.limit,
+                limit_per_host=self._pool_settings.limit,
+                keepalive_timeout=self._pool_settings.keepalive_timeout,
+                ttl_dns_cache=self._pool_settings.dns_cache_ttl,
+            )
+            self._session = ClientSession(connector=connector)
+
+    async def prewarm(self, uri: str):
+        """Open pooled connections up front by making concurrent requests.
+
+        The connections are kept alive by the pool, so the first requests made after
+        this do not pay for TCP connection setup. Requests that fail or time out are
+        ignored, as the connections are opened when first needed instead.
+
+        Args:
+            uri: Identifier for a cheap resource to request
+
+        """
+        if self._pool_settings is None or not self._pool_settings.prewarm:
+            return
+
+        session = self.get_session()
+
+        async def _request():
+            async with session.get(
+                self.full_url(uri),
+                timeout=ClientTimeout(total=self._settings.request_timeout),
+            ) as response:
+                await response.read()
+
+        await asyncio.gather(
+            *[_request() for _ in range(self._pool_settings.prewarm)],
+            return_exceptions=True,
+        )
 
     def get_session(self) -> ClientSession:
         """Get session or raise exception if session is not open.
@@ -52,34 +159,168 @@ class HTTPConnection:
     async def get(self, uri) -> dict[str, Any]:
         """Perform HTTP GET request and return response content as JSON.
 
+        If a GET request for the same URI is already in flight, wait for its response
+        instead of making another request. Requests started before a PUT are not
+        shared with callers that arrive after it, so they cannot see stale values.
+
         Args:
             uri: Identifier for resource
 
         Returns: Response payload as JSON
 
         """
+        pending = self._pending_gets.get(uri)
+        if pending is None:
+            pending = asyncio.ensure_future(self._get(uri))
+            self._pending_gets[uri] = pending
+            pending.add_done_callback(lambda _: self._forget_get(uri, pending))
+
+        # Shield the shared request so that one caller being cancelled does not
+        # cancel it for the others
+        return await asyncio.shield(pending)
+
+    def _forget_get(self, uri: str, request: asyncio.Future):
+        if self._pending_gets.get(uri) is request:
+            del self._pending_gets[uri]
+
+    async def _get(self, uri) -> dict[str, Any]:
         session = self.get_session()
         async with session.get(
-            self.full_url(uri), timeout=ClientTimeout(total=3)
+            self.full_url(uri),
+            timeout=ClientTimeout(total=self._settings.request_timeout),
         ) as response:
             if response.status != 200:
                 raise HTTPRequestError(f"Failed to get {uri}", response)
             else:
                 return await response.json()
 
-    async def get_bytes(self, uri) -> tuple[ClientResponse, bytes]:
+    @overload
+    async def get_many(
+        self,
+        uris: Sequence[str],
+        window: int | None = None,
+        return_exceptions: Literal[False] = False,
+    ) -> list[dict[str, Any]]: ...
+
+    @overload
+    async def get_many(
+        self,
+        uris: Sequence[str],
+        window: int | None = None,
+        *,
+        return_exceptions: Literal[True],
+    ) -> list[dict[str, Any] | BaseException]: ...
+
+    async def get_many(
+        self,
+        uris: Sequence[str],
+        window: int | None = None,
+        return_exceptions: bool = False,
+    ) -> list[dict[str, Any]] | list[dict[str, Any] | BaseException]:
+        """Perform HTTP GET requests for many resources with bounded concurrency.
+
+        Args:
+            uris: Identifiers for resources
+            window: Maximum number of requests in flight at once, defaults to the
+                ``bulk_window`` of the connection settings
+            return_exceptions: Return the error of any request that fails in place of
+                its response, rather than raising it
+
+        Returns: Response payloads as JSON, in the same order as ``uris``
+
+        """
+        semaphore = asyncio.Semaphore(window or self._settings.bulk_window)
+        latencies: list[float] = []
+
+        async def _get(uri: str) -> dict[str, Any]:
+            async with semaphore:
+                request_start = time.monotonic()
+                response = await self.get(uri)
+                latencies.append(time.monotonic() - request_start)
+                return response
+
+        start = time.monotonic()
+        try:
+            return await asyncio.gather(
+                *[_get(uri) for uri in uris], return_exceptions=return_exceptions
+            )
+        finally:
+            self.bulk_stats.requests += len(latencies)
+            self.bulk_stats.duration += time.monotonic() - start
+            self.bulk_stats.total_latency += sum(latencies)
+            self.bulk_stats.max_latency = max([self.bulk_stats.max_latency, *latencies])
+
+    async def get_bytes(
+        self, uri, accept: str | None = None
+    ) -> tuple[ClientResponse, bytes]:
         """Perform HTTP GET request and return response content as bytes.
 
         Args:
             uri: Identifier for resource
+            accept: Content type to request, e.g. ``application/tiff``
 
         Returns: ClientResponse header and response payload as bytes
 
         """
         session = self.get_session()
-        async with session.get(self.full_url(uri)) as response:
+        async with session.get(
+            self.full_url(uri), headers={"Accept": accept} if accept else None
+        ) as response:
             return response, await response.read()
 
+    async def download(
+        self,
+        uri,
+        path: Path,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        on_progress: Callable[[int, int | None], None] | None = None,
+    ) -> int:
+        """Perform HTTP GET request and stream the response content to a file.
+
+        The content is written in chunks as it is received, rather than read into
+        memory whole. It is written to a ``.part`` file next to ``path``, which is
+        renamed to ``path`` once complete, so ``path`` never holds a partial file.
+
+        Args:
+            uri: Identifier for resource
+            path: Path to write the content to
+            chunk_size: Size in bytes of the chunks to write
+            on_progress: Called with the number of bytes written so far and the
+                content length, if known, after each chunk
+
+        Returns: Number of bytes written
+
+        Raises: HTTPRequestError if the request fails
+
+        """
+        session = self.get_session()
+        partial_path = path.with_name(f"{path.name}.part")
+        async with session.get(
+            self.full_url(uri),
+            # Only limit the time between chunks, as large files take a while
+            timeout=ClientTimeout(total=None, sock_read=self._settings.request_timeout),
+        ) as response:
+            if response.status != 200:
+                raise HTTPRequestError(f"Failed to download {uri}", response)
+
+            written = 0
+            file = await asyncio.to_thread(partial_path.open, "wb")
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    await asyncio.to_thread(file.write, chunk)
+                    written += len(chunk)
+                    if on_progress is not None:
+                        on_progress(written, response.content_length)
+            except BaseException:
+                # Do not leave a partial file behind if cancelled or interrupted
+                file.close()
+                partial_path.unlink(missing_ok=True)
+                raise
+
+            await asyncio.to_thread(file.close)
+            await asyncio.to_thread(os.replace, partial_path, path)
+            return written
+
     async def put(self, uri, value=None) -> list[str]:
         """Perform HTTP PUT request and return response content as json.
 
@@ -98,15 +339,40 @@ class HTTPConnection:
             json={"value": value} if value is not None else None,
             headers={"Content-Type": "application/json"},
         ) as response:
-            if response.status != 200:
-                raise HTTPRequestError(
-                    f"Failed to set {uri}" + (f" to {value}" if str(value) else ""),
-                    response,
-                )
-            elif response.content_type == "application/json":
-                return await response.json()
-            else:
-                return []
+            return await self._put_response(
+                response,
+                f"Failed to set {uri}" + (f" to {value}" if str(value) else ""),
+            )
+
+    async def put_bytes(
+        self, uri, data: bytes | bytearray, content_type: str
+    ) -> list[str]:
+        """Perform HTTP PUT request of binary content and return response content as
+        json.
+
+        Args:
+            uri: Identifier for resource
+            data: Content to put
+            content_type: Content type of ``data``, e.g. ``application/tiff``
+
+        Returns: List of parameters whose values may have changed
+
+        """
+        session = self.get_session()
+        async with session.put(
+            self.full_url(uri), data=data, headers={"Content-Type": content_type}
+        ) as response:
+            return await self._put_response(response, f"Failed to set {uri}")
+
+    async def _put_response(self, response: ClientResponse, message: str) -> list[str]:
+        # GETs still in flight may return values from before this PUT
+        self._pending_gets.clear()
+        if response.status != 200:
+            raise HTTPRequestError(message, response)
+        elif response.content_type == "application/json":
+            return await response.json()
+        else:
+            return []
 
     async def close(self):
         """Close the underlying aiohttp ClientSession."""
@@ -0,0 +1,349 @@
+import enum
+import struct
+from collections.abc import Sequence
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+from fastcs.datatypes import Waveform
+from numpy.lib.stride_tricks import as_strided
+from PIL import Image
+
+
+class BinningMode(enum.Enum):
+    """How to combine the pixels of each block when binning an image"""
+
+    SUM = "sum"
+    MAX = "max"
+
+
+Roi = tuple[int, int, int, int]
+"""Region of interest of an image as ``(x, y, width, height)``"""
+
+# Pillow raw modes of uncompressed TIFF images and the equivalent numpy dtypes
+_RAW_MODE_DTYPES: dict[str, str] = {
+    "L": "u1",
+    "I;8": "u1",
+    "I;16": "<u2",
+    "I;16B": ">u2",
+    "I;16N": "=u2",
+    "I;32": "<u4",
+    "I;32B": ">u4",
+    "I;32N": "=u4",
+    "I;32S": "<i4",
+    "I;32BS": ">i4",
+    "F;32F": "<f4",
+    "F;32BF": ">f4",
+}
+
+
+@dataclass(frozen=True)
+class ImageWaveform(Waveform):
+    """``Waveform`` for images that does not copy values of the right dtype.
+
+    ``Waveform`` casts every value with ``astype``, which copies the whole image even
+    when it is already of the right dtype.
+
+    """
+
+    def validate(self, value: np.ndarray) -> np.ndarray:
+        _value = np.asarray(value, dtype=self.array_dtype)
+
+        if len(self.shape) != len(_value.shape) or any(
+            shape1 > shape2
+            for shape1, shape2 in zip(_value.shape, self.shape, strict=True)
+        ):
+            raise ValueError(
+                f"Value shape {_value.shape} exceeds the maximum shape {self.shape}"
+            )
+
+        return _value
+
+
+def decode_tiff(data: bytes) -> np.ndarray:
+    """Decode a TIFF image into a 2-D array.
+
+    Uncompressed images, such as those from the monitor interface, are returned as a
+    read-only view of ``data`` rather than being copied out of Pillow. Other images
+    are decoded by Pillow.
+
+    This is CPU bound for large images, so should be run in a thread rather than on
+    the event loop.
+
+    Args:
+        data: Bytes of the TIFF file
+
+    """
+    image = Image.open(BytesIO(data))
+    width, height = image.size
+
+    dtype = _raw_dtype(image)
+    if dtype is None:
+        return np.asarray(image)
+
+    return np.frombuffer(
+        data, dtype=dtype, count=width * height, offset=image.tile[0].offset
+    ).reshape(height, width)
+
+
+# TIFF sample formats of numpy dtype kinds
+_SAMPLE_FORMATS = {"u": 1, "i": 2, "f": 3}
+
+
+def encode_tiff(array: np.ndarray) -> bytearray:
+    """Encode an array as an uncompressed little-endian TIFF image.
+
+    The pixels are stored as one strip after the header, so they are copied once,
+    straight into the returned buffer. 1-D arrays are encoded as an image of one row.
+
+    Args:
+        array: 1-D or 2-D array of integers or floats
+
+    """
+    height, width = array.shape if array.ndim == 2 else (1, array.size)
+    dtype = array.dtype.newbyteorder("<")
+    # Tags as (tag, type, value), where type 3 is a short and 4 is a long
+    tags = [
+        (256, 4, width),  # ImageWidth
+        (257, 4, height),  # ImageLength
+        (258, 3, 8 * dtype.itemsize),  # BitsPerSample
+        (259, 3, 1),  # Compression: none
+        (262, 3, 1),  # PhotometricInterpretation: black is zero
+        (273, 4, 8 + 2 + 12 * 10 + 4),  # StripOffsets: after this header
+        (277, 3, 1),  # SamplesPerPixel
+        (278, 4, height),  # RowsPerStrip
+        (279, 4, array.nbytes),  # StripByteCounts
+        (339, 3, _SAMPLE_FORMATS[dtype.kind]),  # SampleFormat
+    ]
+    header = b"".join(
+        [
+            struct.pack("<2sHIH", b"II", 42, 8, len(tags)),
+            *(
+                struct.pack("<HHII" if type_ == 4 else "<HHIHxx", tag, type_, 1, value)
+                for tag, type_, value in tags
+            ),
+            struct.pack("<I", 0),
+        ]
+    )
+    data = bytearray(len(header) + array.nbytes)
+    data[: len(header)] = header
+    np.frombuffer(data, dtype=dtype, offset=len(header)).reshape(array.shape)[...] = (
+        array
+    )
+    return data
+
+
+def _raw_dtype(image: Image.Image) -> np.dtype | None:
+    """Get the dtype of an image if its pixels are stored contiguously, else None."""
+    width, _ = image.size
+    if not image.tile:
+        return None
+
+    first = image.tile[0]
+    if first.codec_name != "raw" or first.args[0] not in _RAW_MODE_DTYPES:
+        return None
+
+    dtype = np.dtype(_RAW_MODE_DTYPES[first.args[0]])
+    for tile in image.tile:
+        x0, y0, x1, _ = tile.extents
+        _, stride, orientation = tile.args
+        if (
+            tile.codec_name != "raw"
+            or tile.args[0] != first.args[0]
+            or stride not in (0, width * dtype.itemsize)
+            or orientation != 1
+            or (x0, x1) != (0, width)
+            or tile.offset != first.offset + y0 * width * dtype.itemsize
+        ):
+            return None
+
+    return dtype
+
+
+@dataclass
+class ImageStatistics:
+    """Statistics of the unmasked pixels of an image"""
+
+    total: int | float
+    """Sum of all pixel values"""
+    max: int | float
+    """Maximum pixel value"""
+    mean: float
+    """Mean pixel value"""
+    saturated: int
+    """Number of pixels at or above the count cutoff"""
+    masked: int
+    """Number of masked pixels"""
+    centroid_x: float
+    """Intensity weighted mean column"""
+    centroid_y: float
+    """Intensity weighted mean row"""
+    roi_sums: list[int | float]
+    """Sum of pixel values in each region of interest"""
+
+
+def masked_pixel_value(dtype: np.dtype) -> int | None:
+    """Get the value the detector gives masked pixels in images of a dtype.
+
+    Masked pixels, including gaps between modules, have all bits set, i.e. the
+    maximum value of an unsigned integer, or -1 if the image was decoded as signed.
+
+    """
+    match dtype.kind:
+        case "u":
+            return int(np.iinfo(dtype).max)
+        case "i":
+            return -1
+        case _:
+            return None
+
+
+def _valid_pixels(image: np.ndarray) -> np.ndarray:
+    masked_value = masked_pixel_value(image.dtype)
+    if masked_value is None:
+        return np.isfinite(image)
+
+    return np.not_equal(image, masked_value)
+
+
+def _accumulator(dtype: np.dtype) -> type[np.generic]:
+    return np.float64 if dtype.kind == "f" else np.int64
+
+
+def parse_rois(rois: str) -> list[Roi]:
+    """Parse regions of interest from a string.
+
+    Args:
+        rois: Semicolon separated regions of ``x,y,width,height``, e.g.
+            ``"0,0,100,100;200,200,50,50"``
+
+    Raises:
+        ValueError: If a region is not four non-negative integers
+
+    """
+    regions: list[Roi] = []
+    for roi in rois.split(";"):
+        if not roi.strip():
+            continue
+
+        try:
+            x, y, width, height = (int(value) for value in roi.split(","))
+        except ValueError as e:
+            raise ValueError(f"Invalid region of interest {roi!r}") from e
+
+        if min(x, y, width, height) < 0:
+            raise ValueError(f"Invalid region of interest {roi!r}")
+
+        regions.append((x, y, width, height))
+
+    return regions
+
+
+def image_statistics(
+    image: np.ndarray, count_cutoff: int | None = None, rois: Sequence[Roi] = ()
+) -> ImageStatistics:
+    """Calculate statistics of the unmasked pixels of an image.
+
+    The masked pixels are found once and excluded from each reduction with ``where``,
+    rather than copying the unmasked pixels out of the image.
+
+    This is CPU bound for large images, so should be run in a thread rather than on
+    the event loop.
+
+    Args:
+        image: 2-D image to calculate statistics of
+        count_cutoff: Pixel value at which a pixel is counted as saturated
+        rois: Regions of interest to sum the pixel values of
+
+    """
+    accumulator = _accumulator(image.dtype)
+    valid = _valid_pixels(image)
+    pixels = np.count_nonzero(valid)
+
+    # Project onto each axis once and derive the total and centroid from these
+    rows = image.sum(axis=1, where=valid, dtype=accumulator)
+    columns = image.sum(axis=0, where=valid, dtype=accumulator)
+    total = rows.sum()
+    if total:
+        centroid_x = float(columns @ np.arange(len(columns)) / total)
+        centroid_y = float(rows @ np.arange(len(rows)) / total)
+    else:
+        centroid_x = centroid_y = float("nan")
+
+    saturated = 0
+    if count_cutoff is not None:
+        saturated = np.count_nonzero(np.greater_equal(image, count_cutoff) & valid)
+
+    return ImageStatistics(
+        total=total.item(),
+        max=image.max(where=valid, initial=0).item(),
+        mean=float(total / pixels) if pixels else 0.0,
+        saturated=int(saturated),
+        masked=int(image.size - pixels),
+        centroid_x=centroid_x,
+        centroid_y=centroid_y,
+        roi_sums=[
+            image[y : y + height, x : x + width]
+            .sum(where=valid[y : y + height, x : x + width], dtype=accumulator)
+            .item()
+            for x, y, width, height in rois
+        ],
+    )
+
+
+def _blocks(array: np.ndarray, factor: int) -> np.ndarray:
+    """View a 2-D array as blocks of ``factor`` x ``factor`` elements, without copying.
+
+    Elements at the bottom and right edges that do not fill a whole block are dropped.
+
+    """
+    height, width = array.shape[0] // factor, array.shape[1] // factor
+    row_stride, column_stride = array.strides
+    return as_strided(
+        array,
+        shape=(height, width, factor, factor),
+        strides=(
+            row_stride * factor,
+            column_stride * factor,
+            row_stride,
+            column_stride,
+        ),
+        writeable=False,
+    )
+
+
+def bin_image(
+    image: np.ndarray, factor: int, mode: BinningMode = BinningMode.SUM
+) -> np.ndarray:
+    """Downsample an image by combining blocks of ``factor`` x ``factor`` pixels.
+
+    The blocks are strided views of the image, so the only array allocated at full
+    resolution is the mask of valid pixels. Masked pixels are excluded from each block.
+
+    This is CPU bound for large images, so should be run in a thread rather than on
+    the event loop.
+
+    Args:
+        image: 2-D image to bin
+        factor: Number of pixels along each side of a block
+        mode: Whether to sum the pixels of each block or take the maximum
+
+    Returns: Binned image of the same dtype as ``image``, with sums clipped to below
+        the value of masked pixels
+
+    """
+    blocks = _blocks(image, factor)
+    valid = _blocks(_valid_pixels(image), factor)
+
+    match mode:
+        case BinningMode.MAX:
+            return blocks.max(axis=(2, 3), where=valid, initial=0)
+        case BinningMode.SUM:
+            binned = blocks.sum(
+                axis=(2, 3), where=valid, dtype=_accumulator(image.dtype)
+            )
+            if image.dtype.kind in "ui":
+                # Keep sums below the value of masked pixels
+                np.minimum(binned, np.iinfo(image.dtype).max - 1, out=binned)
+
+            return binned.astype(image.dtype)
@@ -1,14 +1,34 @@
+import asyncio
+import hashlib
+import time
 from collections.abc import Awaitable, Callable, Sequence
 from dataclasses import dataclass
+from typing import Any, Literal, overload
 
+import numpy as np
 from fastcs.attributes import AttributeIO, AttrR, AttrW
-from fastcs.datatypes import DType_T
+from fastcs.datatypes import DType_T, String
 from fastcs.logging import logger
 
+from fastcs_eiger.dependency_graph import DependencyGraph
 from fastcs_eiger.eiger_parameter import EigerParameterRef
-from fastcs_eiger.http_connection import HTTPConnection
+from fastcs_eiger.http_connection import HTTPConnection, HTTPRequestError
+from fastcs_eiger.image import decode_tiff, encode_tiff
 
 FETCH_BEFORE_RETURNING = {"bit_depth_image", "bit_depth_readout"}
+TIFF_CONTENT_TYPE = "application/tiff"
+
+
+def array_digest(array: np.ndarray) -> str:
+    """Hash the shape, dtype and contents of an array.
+
+    This is CPU bound for large arrays, so should be run in a thread rather than on
+    the event loop.
+
+    """
+    digest = hashlib.blake2b(f"{array.dtype.str}{array.shape}".encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
 
 
 @dataclass
@@ -20,11 +40,26 @@ class EigerAttributeIO(AttributeIO[DType_T, EigerParameterRef]):
         connection: HTTPConnection,
         update_now: Callable[[Sequence[str]], Awaitable[None]],
         queue_update: Callable[[Sequence[str]], Awaitable[None]],
+        on_put: Callable[[Sequence[str]], None] | None = None,
+        queue_verification: Callable[[Sequence[str]], Awaitable[None]] | None = None,
+        prefetch: Callable[[Sequence[str]], None] | None = None,
     ):
         super().__init__()
         self.connection = connection
         self.update_now = update_now
         self.queue_update = queue_update
+        self.on_put = on_put
+        self.queue_verification = queue_verification
+        self.prefetch = prefetch
+        self.dependency_graph = DependencyGraph()
+        """Parameters changed by puts of each parameter and their fetch latencies"""
+        self.write_through = True
+        """Update parameters that echo exactly from the value put, rather than waiting
+        to read them back"""
+        self._array_digests: dict[str, str] = {}
+        """Digests of the values of array parameters on the detector, by URI"""
+        self.skipped_array_uploads = 0
+        """Number of puts of array parameters skipped as the value was unchanged"""
 
     def _handle_params_to_update(
         self, parameters: list[str], uri: str
@@ -47,10 +82,30 @@ class EigerAttributeIO(AttributeIO[DType_T, EigerParameterRef]):
     async def send(
         self, attr: AttrW[DType_T, EigerParameterRef], value: DType_T
     ) -> None:
-        parameters_to_update = await self.connection.put(attr.io_ref.uri, value)
-        update_now, update_later = self._handle_params_to_update(
-            parameters_to_update, attr.io_ref.uri
+        if attr.io_ref.is_array:
+            await self._send_array(attr, value)  # type: ignore
+            return
+
+        write_through = self._writes_through(attr)
+        parameters_to_update = self._learn_dependents(
+            attr.io_ref.key, await self.connection.put(attr.io_ref.uri, value)
         )
+        if not write_through:
+            update_now, update_later = self._handle_params_to_update(
+                parameters_to_update, attr.io_ref.uri
+            )
+        else:
+            # Use the value put rather than reading it back, but update any other
+            # parameters the detector reports have changed
+            update_now, update_later = (
+                self._handle_params_to_update(parameters_to_update, attr.io_ref.uri)
+                if parameters_to_update
+                else ([], [])
+            )
+            key = attr.io_ref.key
+            update_now = [parameter for parameter in update_now if parameter != key]
+            update_later = [parameter for parameter in update_later if parameter != key]
+            await attr.update(value)  # type: ignore
 
         logger.info(
             "Parameter put",
@@ -59,16 +114,211 @@ class EigerAttributeIO(AttributeIO[DType_T, EigerParameterRef]):
             update_now=update_now,
             update_later=update_later,
         )
+        await self._update_after_put(update_now, update_later)
+
+        if write_through and self.queue_verification is not None:
+            # Check the value was taken as put, without holding up other updates
+            await self.queue_verification([attr.io_ref.key])
+
+    def _learn_dependents(self, key: str, parameters: list[str]) -> list[str]:
+        """Record the parameters the detector reported changed by a put, or use the
+        parameters learned from earlier puts if it did not report any."""
+        if parameters:
+            self.dependency_graph.record_put(key, parameters)
+            return parameters
+
+        return self.dependency_graph.dependents(key)
+
+    def _writes_through(self, attr: AttrW[Any, EigerParameterRef]) -> bool:
+        return (
+            self.write_through
+            and isinstance(attr, AttrR)
+            and attr.io_ref.echoes_exactly
+        )
+
+    async def _send_array(
+        self, attr: AttrW[np.ndarray, EigerParameterRef], value: np.ndarray
+    ) -> None:
+        """Upload an array as a TIFF image, unless the detector already has it."""
+        uri = attr.io_ref.uri
+        digest = await asyncio.to_thread(array_digest, value)
+        if self._array_digests.get(uri) == digest:
+            self.skipped_array_uploads += 1
+            logger.info("Array parameter unchanged, not putting", attribute=attr)
+            return
+
+        # Attribute values are flattened, but images have the shape of the detector
+        shape = attr.io_ref.shape or ()
+        data = await asyncio.to_thread(
+            encode_tiff, value.reshape(shape) if len(shape) == 2 else value
+        )
+        parameters_to_update = [
+            parameter
+            for parameter in self._learn_dependents(
+                attr.io_ref.key,
+                await self.connection.put_bytes(uri, data, TIFF_CONTENT_TYPE),
+            )
+            if parameter != attr.io_ref.key
+        ]
+        self._array_digests[uri] = digest
+        # The detector holds exactly the array that was put, so it is not read back
+        update_now, update_later = (
+            self._handle_params_to_update(parameters_to_update, uri)
+            if parameters_to_update
+            else ([], [])
+        )
+        if isinstance(attr, AttrR):
+            await attr.update(value)
+
+        logger.info(
+            "Array parameter put",
+            attribute=attr,
+            shape=value.shape,
+            update_now=update_now,
+            update_later=update_later,
+        )
+        await self._update_after_put(update_now, update_later)
+
+    async def _update_after_put(self, update_now: list[str], update_later: list[str]):
+        if self.prefetch is not None:
+            # Start fetching every changed parameter now, rather than when the update
+            # queue gets to them, and only wait for those needed before returning
+            self.prefetch(update_now + update_later)
+
+        if self.on_put is not None:
+            self.on_put(update_now + update_later)
 
         await self.update_now(update_now)
         await self.queue_update(update_later)
 
     async def update(self, attr: AttrR[DType_T, EigerParameterRef]) -> None:
+        await attr.update(await self.fetch(attr))
+
+    async def fetch(self, attr: AttrR[DType_T, EigerParameterRef]) -> DType_T:
+        """Get the current value of the parameter without updating the attribute.
+
+        Args:
+            attr: Attribute to get the value for
+
+        Returns: Value of the parameter, converted to be valid for the attribute
+
+        """
+        if attr.io_ref.is_array:
+            return await self._fetch_array(attr)  # type: ignore
+
+        start = time.monotonic()
         response = await self.connection.get(attr.io_ref.uri)
+        self.dependency_graph.record_latency(attr.io_ref.key, time.monotonic() - start)
+        return self.value_from_response(attr, response)
+
+    async def _fetch_array(
+        self, attr: AttrR[np.ndarray, EigerParameterRef]
+    ) -> np.ndarray:
+        """Download an array as a TIFF image.
+
+        The array is a flattened view of the downloaded bytes, so it is only held in
+        memory once.
+
+        """
+        uri = attr.io_ref.uri
+        response, data = await self.connection.get_bytes(uri, TIFF_CONTENT_TYPE)
+        if response.status != 200:
+            raise HTTPRequestError(f"Failed to get {uri}", response)
+
+        def _decode() -> tuple[np.ndarray, str]:
+            array = decode_tiff(data).reshape(-1)
+
+            return array, array_digest(array)
+
+        array, self._array_digests[uri] = await asyncio.to_thread(_decode)
+        self.log_event("Query for array parameter", uri=uri, shape=array.shape)
+        return array
+
+    def array_stale(self, attr: AttrR[Any, EigerParameterRef]) -> bool:
+        """Check if an array parameter may differ from the value last read or put."""
+        return attr.io_ref.uri not in self._array_digests
+
+    def invalidate_array(self, attr: AttrR[Any, EigerParameterRef]):
+        """Mark the value of an array parameter as changed on the detector."""
+        self._array_digests.pop(attr.io_ref.uri, None)
+
+    @overload
+    async def fetch_many(
+        self,
+        attrs: Sequence[AttrR[DType_T, EigerParameterRef]],
+        window: int | None = None,
+        return_exceptions: Literal[False] = False,
+    ) -> list[DType_T]: ...
+
+    @overload
+    async def fetch_many(
+        self,
+        attrs: Sequence[AttrR[DType_T, EigerParameterRef]],
+        window: int | None = None,
+        *,
+        return_exceptions: Literal[True],
+    ) -> list[DType_T | BaseException]: ...
+
+    async def fetch_many(
+        self,
+        attrs: Sequence[AttrR[DType_T, EigerParameterRef]],
+        window: int | None = None,
+        return_exceptions: bool = False,
+    ) -> list[DType_T] | list[DType_T | BaseException]:
+        """Get the current values of many parameters with bounded concurrency.
+
+        Args:
+            attrs: Attributes to get the values for
+            window: Maximum number of requests in flight at once
+            return_exceptions: Return the error of any request that fails in place of
+                its value, rather than raising it
+
+        Returns: Values of the parameters, in the same order as ``attrs``
+
+        """
+        if any(attr.io_ref.is_array for attr in attrs):
+            return list(
+                await asyncio.gather(
+                    *[self.fetch(attr) for attr in attrs],
+                    return_exceptions=return_exceptions,
+                )
+            )
+
+        responses = await self.connection.get_many(
+            [attr.io_ref.uri for attr in attrs],
+            window,
+            return_exceptions=return_exceptions,  # type: ignore
+        )
+        return [
+            response
+            if isinstance(response, BaseException)
+            else self.value_from_response(attr, response)
+            for attr, response in zip(attrs, responses, strict=True)
+        ]
+
+    def value_from_response(
+        self, attr: AttrR[DType_T, EigerParameterRef], response: dict[str, Any]
+    ) -> DType_T:
+        """Convert the response of a GET of a parameter into a value for the attribute.
+
+        Args:
+            attr: Attribute the parameter belongs to
+            response: JSON response from GET of parameter
+
+        """
         value = response["value"]
-        if isinstance(value, list) and all(
-            isinstance(s, str) for s in value
-        ):  # error is a list of strings
+        if attr.io_ref.index is not None:
+            # Split list value, e.g. [value, max]
+            value = (
+                value[attr.io_ref.index]
+                if isinstance(value, list) and len(value) > attr.io_ref.index
+                else None
+            )
+        elif (
+            isinstance(value, list)
+            and isinstance(attr.datatype, String)
+            and all(isinstance(s, str) for s in value)
+        ):  # list of strings cached as a string parameter
             value = ", ".join(value)
 
         self.log_event(
@@ -82,4 +332,4 @@ class EigerAttributeIO(AttributeIO[DType_T, EigerParameterRef]):
         if value is None:
             value = attr.datatype.initial_value
 
-        await attr.update(value)
+        return value
@@ -0,0 +1,60 @@
+from collections.abc import Iterable
+
+import numpy as np
+
+MASKED = 1
+"""Flag set in the pixel mask for masked pixels by default"""
+
+
+def _indices(pixels: Iterable[int] | np.ndarray, size: int) -> np.ndarray:
+    """Get sorted unique pixel indices, checking they are within the mask."""
+    if not isinstance(pixels, np.ndarray):
+        pixels = np.fromiter(pixels, dtype=np.intp)
+
+    indices = np.unique(pixels.astype(np.intp, copy=False))
+    if indices.size and (indices[0] < 0 or indices[-1] >= size):
+        raise IndexError(f"Pixel indices must be between 0 and {size - 1}")
+
+    return indices
+
+
+def merge_pixel_mask(
+    mask: np.ndarray,
+    add: Iterable[int] | np.ndarray = (),
+    remove: Iterable[int] | np.ndarray = (),
+    flags: int = MASKED,
+) -> tuple[np.ndarray, int] | None:
+    """Set and clear flags of pixels in a copy of a pixel mask.
+
+    Only the given pixels are compared and changed, with vectorised indexing, so the
+    cost is dominated by copying the mask rather than the size of the changes.
+
+    Args:
+        mask: Current pixel mask
+        add: Flat indices of pixels to set ``flags`` of
+        remove: Flat indices of pixels to clear ``flags`` of
+        flags: Bits of the mask to set or clear
+
+    Returns: New mask and the number of pixels changed, or ``None`` if no pixels
+        would change
+
+    Raises:
+        IndexError: If an index is outside of the mask
+        ValueError: If a pixel is both added and removed
+
+    """
+    add, remove = _indices(add, mask.size), _indices(remove, mask.size)
+    if np.intersect1d(add, remove, assume_unique=True).size:
+        raise ValueError("Pixels cannot be both added to and removed from the mask")
+
+    flat = mask.reshape(-1)
+    added = add[(flat[add] & flags) != flags]
+    removed = remove[(flat[remove] & flags) != 0]
+    if not (added.size or removed.size):
+        return None
+
+    merged = mask.copy()
+    merged_flat = merged.reshape(-1)
+    merged_flat[added] |= flags
+    merged_flat[removed] &= ~np.asarray(flags, dtype=mask.dtype)
+    return merged, added.size + removed.size
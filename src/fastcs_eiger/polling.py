@@ -0,0 +1,200 @@
+import asyncio
+import time
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+from fastcs.attributes import AttrR
+from fastcs.logging import logger
+
+from fastcs_eiger.eiger_parameter import EigerParameterRef
+from fastcs_eiger.io import EigerAttributeIO
+
+STATUS_POLL_PERIOD = 0.2
+"""Period in seconds of the sweep over status parameters of a subsystem"""
+POLL_BACKOFF_FACTOR = 2
+"""Factor to increase the poll period of a parameter by when its value is unchanged"""
+NO_BACKOFF_KEYS = frozenset({"state"})
+"""Keys of parameters always polled at the fastest rate, as changes must be seen
+promptly even after the value has been steady for a long time"""
+
+
+@dataclass(frozen=True)
+class PollThrottle:
+    """Restriction on polling of status parameters, e.g. during an acquisition"""
+
+    period: float | None
+    """Minimum period in seconds between polls, or ``None`` to suspend polling"""
+    keep: frozenset[str] = frozenset()
+    """Keys of parameters that are not throttled"""
+
+
+@dataclass
+class _PollSchedule:
+    period: float = STATUS_POLL_PERIOD
+    """Current period in seconds between polls of the parameter"""
+    next_poll: float = 0
+    """Monotonic time in seconds at which the parameter is next due to be polled"""
+    last_poll: float = float("-inf")
+    """Monotonic time in seconds at which the parameter was last polled"""
+
+
+class StatusPoller:
+    """Poll the status parameters of a subsystem together in one sweep.
+
+    Rather than running a periodic update for each status ``Attribute``, the values of
+    all parameters are fetched with a bounded number of concurrent requests and then
+    the ``Attribute``s are updated together.
+
+    With adaptive polling, each time a parameter is polled and its value has not
+    changed its poll period is increased, up to a maximum. When its value changes, or
+    the schedule is reset, the parameter goes back to being polled on every sweep.
+    Parameters in ``NO_BACKOFF_KEYS``, or kept by the throttle, are not backed off.
+
+    Each ``Attribute`` has its own schedule, keyed by its name, as the elements of a
+    split parameter change independently.
+
+    Args:
+        io: ``EigerAttributeIO`` to fetch parameter values with
+
+    """
+
+    def __init__(self, io: EigerAttributeIO):
+        self._io = io
+        self._attributes: list[AttrR[Any, EigerParameterRef]] = []
+        self._schedules: dict[str, _PollSchedule] = {}
+
+        self.last_duration = 0.0
+        """Duration in seconds of the last sweep"""
+        self.max_duration = 0.0
+        """Longest duration in seconds of any sweep"""
+        self.last_count = 0
+        """Number of parameters polled in the last sweep"""
+        self.throttle: PollThrottle | None = None
+        """Current restriction on polling, if any"""
+        self.saved_requests = 0
+        """Number of scheduled polls skipped because of the throttle"""
+
+    @property
+    def attributes(self) -> Sequence[AttrR[Any, EigerParameterRef]]:
+        return self._attributes
+
+    def add_attribute(self, attr: AttrR[Any, EigerParameterRef]):
+        """Add an ``Attribute`` to be updated by each sweep."""
+        self._attributes.append(attr)
+        self._schedules[attr.io_ref.attribute_name] = _PollSchedule()
+
+    def period(self, name: str) -> float:
+        """Get the current poll period of an ``Attribute``."""
+        return self._schedules[name].period
+
+    def reset(self, names: Iterable[str] | None = None):
+        """Poll parameters at the fastest rate again, starting from the next sweep.
+
+        Args:
+            names: Names of ``Attribute``s to reset, or ``None`` to reset all of them
+
+        """
+        for name in self._schedules.keys() if names is None else names:
+            if name in self._schedules:
+                self._schedules[name].period = STATUS_POLL_PERIOD
+                self._schedules[name].next_poll = 0
+
+    def _throttled(self, ref: EigerParameterRef, now: float) -> bool:
+        if self.throttle is None or ref.key in self.throttle.keep:
+            return False
+        elif self.throttle.period is None:
+            return True
+
+        last_poll = self._schedules[ref.attribute_name].last_poll
+        return now < last_poll + self.throttle.period
+
+    def _skip_throttled(self, name: str, now: float):
+        """Skip a poll of a throttled parameter, until the throttle next allows it."""
+        assert self.throttle is not None
+        schedule = self._schedules[name]
+        if self.throttle.period is None:
+            schedule.next_poll = now + schedule.period
+        else:
+            schedule.next_poll = schedule.last_poll + self.throttle.period
+
+    def _never_backed_off(self, key: str) -> bool:
+        return key in NO_BACKOFF_KEYS or (
+            self.throttle is not None and key in self.throttle.keep
+        )
+
+    def _due_attributes(self, now: float) -> list[AttrR[Any, EigerParameterRef]]:
+        due = []
+        for attr in self._attributes:
+            name = attr.io_ref.attribute_name
+            if self._schedules[name].next_poll > now:
+                continue
+            elif self._throttled(attr.io_ref, now):
+                self._skip_throttled(name, now)
+                self.saved_requests += 1
+                continue
+
+            due.append(attr)
+
+        return due
+
+    def _reschedule(
+        self,
+        ref: EigerParameterRef,
+        changed: bool,
+        now: float,
+        adaptive: bool,
+        max_period: float,
+    ):
+        schedule = self._schedules[ref.attribute_name]
+        if changed or not adaptive or self._never_backed_off(ref.key):
+            schedule.period = STATUS_POLL_PERIOD
+        else:
+            schedule.period = min(schedule.period * POLL_BACKOFF_FACTOR, max_period)
+        schedule.next_poll = now + schedule.period
+        schedule.last_poll = now
+
+    async def poll(
+        self,
+        max_concurrency: int,
+        adaptive: bool = False,
+        max_period: float = STATUS_POLL_PERIOD,
+    ):
+        """Fetch the values of all due parameters and then update their attributes.
+
+        Parameters that fail to be fetched keep their last value and are polled again
+        when they are next due.
+
+        Args:
+            max_concurrency: Maximum number of requests to have in flight at once
+            adaptive: Whether to back off the poll period of unchanging parameters
+            max_period: Maximum poll period in seconds for adaptive polling
+
+        """
+        start = time.monotonic()
+
+        attributes = self._due_attributes(start)
+        results = await self._io.fetch_many(
+            attributes, max_concurrency, return_exceptions=True
+        )
+        polled: list[tuple[AttrR[Any, EigerParameterRef], Any]] = []
+        errors: dict[str, str] = {}
+        for attr, result in zip(attributes, results, strict=True):
+            if isinstance(result, BaseException):
+                errors[attr.io_ref.attribute_name] = repr(result)
+            else:
+                polled.append((attr, result))
+        if errors:
+            # Keep the last values, so one bad parameter does not stop the others
+            logger.warning("Failed to poll parameters", errors=errors)
+
+        previous_values = [attr.get() for attr in attributes]
+        await asyncio.gather(*[attr.update(value) for attr, value in polled])
+
+        for attr, previous_value in zip(attributes, previous_values, strict=True):
+            changed = not attr.datatype.equal(attr.get(), previous_value)
+            self._reschedule(attr.io_ref, changed, start, adaptive, max_period)
+
+        self.last_duration = time.monotonic() - start
+        self.max_duration = max(self.max_duration, self.last_duration)
+        self.last_count = len(attributes)
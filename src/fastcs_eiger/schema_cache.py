@@ -0,0 +1,100 @@
+import json
+import re
+from pathlib import Path
+from typing import Any
+
+from fastcs.logging import logger
+
+from fastcs_eiger.eiger_parameter import EigerAPIVersion, EigerParameterRef
+
+Schema = dict[str, list[dict[str, Any]]]
+"""Serialised parameters of each subsystem of a detector"""
+
+
+def serialise_parameters(parameters: list[EigerParameterRef]) -> list[dict[str, Any]]:
+    """Serialise ``EigerParameterRef``s without their values.
+
+    Args:
+        parameters: ``EigerParameterRef``s to serialise
+
+    """
+    return [
+        {
+            "mode": parameter.mode,
+            "key": parameter.key,
+            "response": parameter.response.model_dump(
+                exclude_none=True, exclude={"value"}
+            ),
+            **({} if parameter.shape is None else {"shape": list(parameter.shape)}),
+            **({} if parameter.index is None else {"index": parameter.index}),
+        }
+        for parameter in parameters
+    ]
+
+
+def schema_diff(schema: Schema, other: Schema) -> list[str]:
+    """Find the parameters that differ between two schemas.
+
+    Returns: Sorted list of ``subsystem/mode/key`` of parameters that were added,
+        removed or changed
+
+    """
+
+    def _flatten(schema: Schema) -> dict[str, dict[str, Any]]:
+        return {
+            f"{subsystem}/{parameter['mode']}/{parameter['key']}"
+            + (f"/{parameter['index']}" if "index" in parameter else ""): parameter
+            for subsystem, parameters in schema.items()
+            for parameter in parameters
+        }
+
+    flat, other_flat = _flatten(schema), _flatten(other)
+    return sorted(
+        name
+        for name in flat.keys() | other_flat.keys()
+        if flat.get(name) != other_flat.get(name)
+    )
+
+
+class SchemaCache:
+    """On-disk cache of the parameters introspected from a detector.
+
+    The cache is specific to the detector host, the API version and the detector
+    software version, so that a firmware update will not use a stale cache.
+
+    Args:
+        directory: Directory to store cache files in
+        host: Host name or IP address and port of the detector
+        api_version: Version of the Eiger API
+        software_version: Software version reported by the detector
+
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        host: str,
+        api_version: EigerAPIVersion,
+        software_version: str,
+    ):
+        name = re.sub(r"[^\w.-]", "_", f"{host}_{api_version}_{software_version}")
+        self.path = directory / f"{name}.json"
+
+    def load(self) -> Schema | None:
+        """Load the cached schema, if there is one."""
+        if not self.path.is_file():
+            return None
+
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            logger.exception("Failed to load schema cache", path=self.path)
+            return None
+
+    def save(self, schema: Schema):
+        """Write the schema to the cache."""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(schema, indent=4))
+        except OSError:
+            logger.exception("Failed to save schema cache", path=self.path)
@@ -0,0 +1,543 @@
+import asyncio
+import enum
+import json
+import os
+import struct
+import time
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Literal
+
+import numpy as np
+from fastcs.logging import logger
+
+from fastcs_eiger.image import ImageStatistics, image_statistics
+
+StreamFormat = Literal["legacy", "cbor"]
+"""Format of messages sent by the stream interface, from the ``format`` config"""
+
+STREAM_PORTS: dict[StreamFormat, int] = {"legacy": 9999, "cbor": 31001}
+"""Port the stream interface sends messages of each format on"""
+DECODE_WORKERS = min(4, os.cpu_count() or 1)
+"""Number of threads to decode images in"""
+
+MessageType = Literal["start", "image", "end"]
+
+# Legacy header types of the first part of each message
+_LEGACY_TYPES: dict[str, MessageType] = {
+    "dheader-1.0": "start",
+    "dimage-1.0": "image",
+    "dseries_end-1.0": "end",
+}
+
+
+@dataclass
+class StreamMessage:
+    """Summary of a message received from the stream interface"""
+
+    type: MessageType
+    series_id: int
+    image_id: int | None = None
+    """Index of the image in the series, for image messages"""
+    size: int = 0
+    """Size in bytes of the message"""
+    data: dict[str, "np.ndarray | CompressedArray"] = field(default_factory=dict)
+    """Image of each channel, e.g. ``threshold_1``, for decoded image messages"""
+    metadata: dict[str, Any] = field(default_factory=dict)
+    """Parameters of the acquisition, for decoded start messages"""
+
+
+@dataclass(frozen=True)
+class CompressedArray:
+    """Compressed array from an image message, to be decompressed by ``decompress``"""
+
+    algorithm: Literal["bslz4", "lz4"]
+    dtype: np.dtype
+    shape: tuple[int, ...]
+    data: bytes
+
+
+def parse_legacy_message(parts: list[memoryview]) -> StreamMessage | None:
+    """Parse a multipart message in the legacy JSON format.
+
+    The first part of each message is a JSON header with an ``htype``. The remaining
+    parts, including the image data, are not parsed.
+
+    Args:
+        parts: Parts of the message
+
+    Returns: The message, or ``None`` if it is not a header, image or end message
+
+    """
+    header = json.loads(bytes(parts[0]))
+    message_type = _LEGACY_TYPES.get(header.get("htype"))
+    if message_type is None:
+        return None
+
+    return StreamMessage(
+        type=message_type,
+        series_id=header["series"],
+        image_id=header.get("frame"),
+        size=sum(part.nbytes for part in parts),
+    )
+
+
+# Tags of RFC 8746 typed arrays and the equivalent numpy dtypes
+_TYPED_ARRAY_DTYPES: dict[int, str] = {
+    64: "u1",
+    65: ">u2",
+    66: ">u4",
+    67: ">u8",
+    68: "u1",
+    69: "<u2",
+    70: "<u4",
+    71: "<u8",
+    72: "i1",
+    73: ">i2",
+    74: ">i4",
+    75: ">i8",
+    77: "<i2",
+    78: "<i4",
+    79: "<i8",
+    80: ">f2",
+    81: ">f4",
+    82: ">f8",
+    84: "<f2",
+    85: "<f4",
+    86: "<f8",
+}
+
+
+class _Tag(enum.IntEnum):
+    MULTI_DIMENSIONAL_ARRAY = 40
+    DECTRIS_COMPRESSION = 56500
+
+
+@dataclass(frozen=True)
+class _Compression:
+    algorithm: Literal["bslz4", "lz4"]
+    element_size: int
+    data: bytes
+
+
+@dataclass(frozen=True)
+class _TypedCompression:
+    dtype: np.dtype
+    compression: _Compression
+
+
+class CborDecoder:
+    """Decoder of messages in the stream2 CBOR format.
+
+    Image data is mapped to numpy arrays of the dtype of its typed array tag, or of
+    ``bit_depth_image`` from the start message of the series if it is untyped.
+    Uncompressed data is viewed with ``np.frombuffer``, so the only copy made is the
+    one cbor2 makes when decoding the byte string. Compressed data is returned as a
+    ``CompressedArray`` to be decompressed by ``decompress``, e.g. in a worker pool.
+
+    """
+
+    def __init__(self):
+        self.bit_depth_image = 32
+        """Bit depth of images in the current series"""
+
+    def decode(self, parts: list[memoryview]) -> StreamMessage | None:
+        """Decode a message.
+
+        Args:
+            parts: Parts of the message, of which there should be one
+
+        Returns: The message, or ``None`` if it is not a start, image or end message
+
+        """
+        import cbor2
+
+        message = cbor2.loads(parts[0], tag_hook=self._tag_hook)
+        message_type = message.get("type")
+        if message_type not in ("start", "image", "end"):
+            return None
+        elif message_type == "start":
+            self.bit_depth_image = message.get("bit_depth_image", self.bit_depth_image)
+
+        return StreamMessage(
+            type=message_type,
+            series_id=message["series_id"],
+            image_id=message.get("image_id"),
+            size=sum(part.nbytes for part in parts),
+            data=message.get("data", {}) if message_type == "image" else {},
+            metadata={
+                key: value
+                for key, value in message.items()
+                if key not in ("type", "series_id")
+            }
+            if message_type == "start"
+            else {},
+        )
+
+    def _tag_hook(self, tag: Any, immutable: bool) -> Any:
+        match tag.tag, tag.value:
+            case _Tag.DECTRIS_COMPRESSION, [algorithm, element_size, bytes() as data]:
+                return _Compression(algorithm, element_size, data)
+            case tag_number, bytes() as data if tag_number in _TYPED_ARRAY_DTYPES:
+                return np.frombuffer(data, dtype=_TYPED_ARRAY_DTYPES[tag_number])
+            case tag_number, _Compression() as compression if (
+                tag_number in _TYPED_ARRAY_DTYPES
+            ):
+                return _TypedCompression(
+                    np.dtype(_TYPED_ARRAY_DTYPES[tag_number]), compression
+                )
+            case _Tag.MULTI_DIMENSIONAL_ARRAY, [dimensions, contents]:
+                return self._multi_dimensional_array(tuple(dimensions), contents)
+            case _:
+                return tag
+
+    def _multi_dimensional_array(
+        self, shape: tuple[int, ...], contents: Any
+    ) -> np.ndarray | CompressedArray:
+        match contents:
+            case np.ndarray():
+                return contents.reshape(shape)
+            case bytes():
+                return np.frombuffer(contents, dtype=self._image_dtype).reshape(shape)
+            case _TypedCompression(dtype=dtype, compression=compression):
+                return CompressedArray(
+                    compression.algorithm, dtype, shape, compression.data
+                )
+            case _Compression(algorithm=algorithm, data=data):
+                return CompressedArray(algorithm, self._image_dtype, shape, data)
+            case _:
+                return np.asarray(contents).reshape(shape)
+
+    @property
+    def _image_dtype(self) -> np.dtype:
+        return np.dtype(f"<u{self.bit_depth_image // 8}")
+
+
+def decompress(array: CompressedArray) -> np.ndarray:
+    """Decompress an array compressed by the detector.
+
+    Both algorithms use the framing of the HDF5 filters, i.e. a 12 byte header of the
+    uncompressed size and the block size in bytes, followed by the blocks. Requires
+    bitshuffle for ``bslz4`` and lz4 for ``lz4``.
+
+    This is CPU bound, so should be run in a worker rather than on the event loop.
+
+    Args:
+        array: Array to decompress
+
+    """
+    size, block_size = struct.unpack(">QI", array.data[:12])
+    match array.algorithm:
+        case "bslz4":
+            import bitshuffle
+
+            return bitshuffle.decompress_lz4(
+                np.frombuffer(array.data, dtype=np.uint8, offset=12),
+                array.shape,
+                array.dtype,
+                block_size // array.dtype.itemsize,
+            )
+        case "lz4":
+            import lz4.block
+
+            output = bytearray(size)
+            offset, position = 12, 0
+            while position < size:
+                (compressed_size,) = struct.unpack(
+                    ">I", array.data[offset : offset + 4]
+                )
+                offset += 4
+                block = lz4.block.decompress(
+                    array.data[offset : offset + compressed_size],
+                    uncompressed_size=min(block_size, size - position),
+                )
+                output[position : position + len(block)] = block
+                offset += compressed_size
+                position += len(block)
+
+            return np.frombuffer(output, dtype=array.dtype).reshape(array.shape)
+
+
+class StreamStatistics:
+    """Counters of the messages received from the stream interface.
+
+    Missing frames are found from gaps in the image ids of each series.
+
+    """
+
+    def __init__(self):
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.missing_frames = 0
+        self.series_id = 0
+        self.series_ended = False
+        self._last_image_id: int | None = None
+        self._sample_time = time.monotonic()
+        self._sample_frames = 0
+        self._sample_bytes = 0
+
+    def add(self, message: StreamMessage):
+        """Count a message received from the stream."""
+        self.bytes_received += message.size
+        match message.type:
+            case "start":
+                self.series_id = message.series_id
+                self.series_ended = False
+                self._last_image_id = None
+            case "image":
+                self.frames_received += 1
+                if message.series_id != self.series_id:
+                    # Missed the start of the series
+                    self.series_id = message.series_id
+                    self.series_ended = False
+                    self._last_image_id = None
+
+                if message.image_id is not None:
+                    # Image ids of each series count up from 0
+                    expected = (
+                        0 if self._last_image_id is None else self._last_image_id + 1
+                    )
+                    self.missing_frames += max(message.image_id - expected, 0)
+                    self._last_image_id = message.image_id
+            case "end":
+                self.series_ended = True
+
+    def sample_rates(self) -> tuple[float, float]:
+        """Calculate the rates since the last sample.
+
+        Returns: Frames per second and megabytes per second
+
+        """
+        now = time.monotonic()
+        elapsed = now - self._sample_time
+        frames = self.frames_received - self._sample_frames
+        megabytes = (self.bytes_received - self._sample_bytes) / 1e6
+        self._sample_time = now
+        self._sample_frames = self.frames_received
+        self._sample_bytes = self.bytes_received
+
+        if elapsed <= 0:
+            return 0.0, 0.0
+
+        return frames / elapsed, megabytes / elapsed
+
+
+class StreamReceiver:
+    """Receive messages from the ZeroMQ stream interface of a detector.
+
+    The stream interface pushes each message to one of the connected receivers, so
+    messages received here are not received by any other consumer of the stream, e.g.
+    a file writer.
+
+    Requires the ``stream`` extra, i.e. pyzmq and cbor2.
+
+    Args:
+        endpoint: ZeroMQ endpoint of the stream interface, e.g. ``tcp://1.2.3.4:9999``
+        stream_format: Format of the messages sent by the stream interface
+
+    """
+
+    def __init__(self, endpoint: str, stream_format: StreamFormat):
+        import zmq
+        import zmq.asyncio
+
+        self.endpoint = endpoint
+        self.stream_format: StreamFormat = stream_format
+        self._socket = zmq.asyncio.Context.instance().socket(zmq.PULL)
+        self._cbor_decoder = CborDecoder()
+        self._socket.connect(endpoint)
+
+    async def receive_parts(self) -> list[memoryview]:
+        """Receive the parts of the next message, without copying them."""
+        frames = await self._socket.recv_multipart(copy=False)
+        return [frame.buffer for frame in frames]
+
+    async def receive(self) -> StreamMessage | None:
+        """Receive and parse the next message.
+
+        Returns: The message, or ``None`` if it is not a start, image or end message
+
+        """
+        parts = await self.receive_parts()
+        match self.stream_format:
+            case "legacy":
+                return parse_legacy_message(parts)
+            case "cbor":
+                # The whole message is parsed, image data included, so do it in a
+                # thread to keep the event loop free to poll the detector
+                return await asyncio.to_thread(self._cbor_decoder.decode, parts)
+
+    def close(self):
+        self._socket.close(linger=0)
+
+
+def decode_images(
+    data: dict[str, np.ndarray | CompressedArray],
+) -> dict[str, np.ndarray]:
+    """Decompress the image of each channel of an image message, if compressed.
+
+    Args:
+        data: Image of each channel from ``StreamMessage.data``
+
+    """
+    return {
+        channel: decompress(image) if isinstance(image, CompressedArray) else image
+        for channel, image in data.items()
+    }
+
+
+@dataclass
+class DecodeResult:
+    """Results of decoding an image, published by the stream controller"""
+
+    total_counts: float
+    """Sum of unmasked pixels of the first channel"""
+    max_count: float
+    """Maximum unmasked pixel of the first channel"""
+    duration: float
+    """Time taken to decode the image and calculate statistics in seconds"""
+
+
+@dataclass
+class DecodedImage:
+    """Images of an image message decoded by a ``StreamConsumer``"""
+
+    series_id: int
+    image_id: int
+    images: dict[str, np.ndarray]
+    """Image of each channel"""
+    statistics: ImageStatistics | None
+    """Statistics of the image of the first channel"""
+    duration: float
+    """Time taken to decode the images and calculate statistics in seconds"""
+
+    @property
+    def result(self) -> DecodeResult:
+        statistics = self.statistics
+        return DecodeResult(
+            total_counts=0 if statistics is None else statistics.total,
+            max_count=0 if statistics is None else statistics.max,
+            duration=self.duration,
+        )
+
+
+def _decode(message: StreamMessage) -> DecodedImage:
+    start = time.monotonic()
+    images = decode_images(message.data)
+    statistics = image_statistics(next(iter(images.values()))) if images else None
+    return DecodedImage(
+        series_id=message.series_id,
+        image_id=message.image_id or 0,
+        images=images,
+        statistics=statistics,
+        duration=time.monotonic() - start,
+    )
+
+
+class StreamConsumer:
+    """Receive messages from the stream, count them and decode every nth image.
+
+    Images are decoded in a pool of worker threads. Waiting for a decode would stop
+    messages being received from the stream, which would hold up the detector, so
+    images are skipped while all the workers are busy.
+
+    Args:
+        receiver: ``StreamReceiver`` to receive messages from
+        decimation: Callable returning n, to decode every nth image
+        on_decoded: Callback for each decoded image
+        on_message: Coroutine function awaited with each message before the next is
+            received, e.g. to pass every message to a file writer
+        workers: Number of threads to decode images in
+
+    """
+
+    def __init__(
+        self,
+        receiver: StreamReceiver,
+        decimation: Callable[[], int] = lambda: 1,
+        on_decoded: Callable[[DecodedImage], None] | None = None,
+        on_message: Callable[[StreamMessage], Awaitable[None]] | None = None,
+        workers: int = DECODE_WORKERS,
+    ):
+        self._receiver = receiver
+        self._decimation = decimation
+        self._on_decoded = on_decoded
+        self._on_message = on_message
+        self._workers = workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._decodes_in_flight = 0
+
+        self.statistics = StreamStatistics()
+        self.decoded_frames = 0
+        """Number of images decoded"""
+        self.skipped_decodes = 0
+        """Number of images not decoded because all workers were busy"""
+        self.latest: DecodedImage | None = None
+        """Last decoded image"""
+
+    @property
+    def last_result(self) -> DecodeResult | None:
+        """Results of the last decoded image, if any."""
+        return None if self.latest is None else self.latest.result
+
+    @property
+    def decoding(self) -> bool:
+        """Whether any images are being decoded."""
+        return self._decodes_in_flight > 0
+
+    async def run(self):
+        """Receive messages until cancelled."""
+        logger.info("Receiving frames from stream", endpoint=self._receiver.endpoint)
+        try:
+            while True:
+                try:
+                    message = await self._receiver.receive()
+                except (ValueError, KeyError):
+                    logger.exception("Failed to parse stream message")
+                    continue
+
+                if message is not None:
+                    self.statistics.add(message)
+                    self._schedule_decode(message)
+                    if self._on_message is not None:
+                        await self._on_message(message)
+        finally:
+            self._receiver.close()
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _schedule_decode(self, message: StreamMessage):
+        if (
+            not message.data
+            or message.image_id is None
+            or message.image_id % self._decimation()
+        ):
+            return
+        elif self._decodes_in_flight >= self._workers:
+            self.skipped_decodes += 1
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self._workers, thread_name_prefix="stream-decode"
+            )
+
+        self._decodes_in_flight += 1
+        asyncio.wrap_future(self._executor.submit(_decode, message)).add_done_callback(
+            self._decoded
+        )
+
+    def _decoded(self, future: asyncio.Future[DecodedImage]):
+        self._decodes_in_flight -= 1
+        if future.cancelled():
+            return
+        elif (exception := future.exception()) is not None:
+            logger.error("Failed to decode stream image", exception=repr(exception))
+            return
+
+        self.latest = future.result()
+        self.decoded_frames += 1
+        if self._on_decoded is not None:
+            self._on_decoded(self.latest)
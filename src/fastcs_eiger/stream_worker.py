@@ -0,0 +1,202 @@
+import asyncio
+import enum
+import multiprocessing
+from multiprocessing.sharedctypes import Synchronized, SynchronizedArray
+from multiprocessing.synchronize import Event
+
+from fastcs.logging import logger
+
+from fastcs_eiger.frame_ring import FrameRing, FrameRingWriter
+from fastcs_eiger.stream import (
+    DecodedImage,
+    DecodeResult,
+    StreamConsumer,
+    StreamFormat,
+    StreamReceiver,
+    StreamStatistics,
+)
+
+WORKER_UPDATE_PERIOD = 0.1
+"""Period in seconds the worker process publishes its counters at"""
+
+
+class _Counter(enum.IntEnum):
+    FRAMES_RECEIVED = 0
+    BYTES_RECEIVED = enum.auto()
+    MISSING_FRAMES = enum.auto()
+    SERIES_ID = enum.auto()
+    SERIES_ENDED = enum.auto()
+    DECODED_FRAMES = enum.auto()
+    SKIPPED_DECODES = enum.auto()
+    RING_GENERATION = enum.auto()
+    """Incremented each time the ring is created, e.g. for larger frames"""
+
+
+def _run_worker(
+    endpoint: str,
+    stream_format: StreamFormat,
+    ring_name: str,
+    counters: SynchronizedArray,
+    decimation: Synchronized,
+    stop: Event,
+):
+    asyncio.run(_work(endpoint, stream_format, ring_name, counters, decimation, stop))
+
+
+async def _work(
+    endpoint: str,
+    stream_format: StreamFormat,
+    ring_name: str,
+    counters: SynchronizedArray,
+    decimation: Synchronized,
+    stop: Event,
+):
+    ring = FrameRingWriter(ring_name)
+
+    def on_decoded(decoded: DecodedImage):
+        image = next(iter(decoded.images.values()), None)
+        if image is None:
+            return
+
+        result = decoded.result
+        ring.write(
+            image,
+            decoded.image_id,
+            decoded.series_id,
+            total_counts=result.total_counts,
+            max_count=result.max_count,
+            duration=result.duration,
+        )
+        counters[_Counter.RING_GENERATION] = ring.generation
+
+    consumer = StreamConsumer(
+        StreamReceiver(endpoint, stream_format),
+        decimation=lambda: decimation.value,
+        on_decoded=on_decoded,
+    )
+    task = asyncio.create_task(consumer.run())
+    try:
+        while not (stop.is_set() or task.done()):
+            statistics = consumer.statistics
+            counters[_Counter.FRAMES_RECEIVED] = statistics.frames_received
+            counters[_Counter.BYTES_RECEIVED] = statistics.bytes_received
+            counters[_Counter.MISSING_FRAMES] = statistics.missing_frames
+            counters[_Counter.SERIES_ID] = statistics.series_id
+            counters[_Counter.SERIES_ENDED] = statistics.series_ended
+            counters[_Counter.DECODED_FRAMES] = consumer.decoded_frames
+            counters[_Counter.SKIPPED_DECODES] = consumer.skipped_decodes
+            await asyncio.sleep(WORKER_UPDATE_PERIOD)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        ring.close()
+
+
+class StreamWorker:
+    """Receive and decode frames from the stream in a separate process.
+
+    The worker process runs a ``StreamConsumer`` and writes the first channel of each
+    decoded image, along with its statistics, to a ``FrameRing`` in shared memory.
+    Its counters are shared through a shared memory array. This keeps the work of
+    receiving and decoding frames off the event loop of the IOC and its process.
+
+    Args:
+        endpoint: ZeroMQ endpoint of the stream interface
+        stream_format: Format of the messages sent by the stream interface
+        ring_name: Name of the shared memory of the ``FrameRing``
+
+    """
+
+    def __init__(self, endpoint: str, stream_format: StreamFormat, ring_name: str):
+        context = multiprocessing.get_context("spawn")
+        self.ring_name = ring_name
+        self._counters = context.Array("d", len(_Counter))
+        self._decimation = context.Value("i", 1)
+        self._stop = context.Event()
+        self._process = context.Process(
+            target=_run_worker,
+            args=(
+                endpoint,
+                stream_format,
+                ring_name,
+                self._counters,
+                self._decimation,
+                self._stop,
+            ),
+            name="stream-worker",
+            daemon=True,
+        )
+        self._ring: FrameRing | None = None
+        self._ring_generation = 0
+        self.statistics = StreamStatistics()
+        """Counters of the worker process, updated by ``refresh``"""
+
+    @property
+    def decimation(self) -> int:
+        return self._decimation.value
+
+    @decimation.setter
+    def decimation(self, decimation: int):
+        self._decimation.value = decimation
+
+    @property
+    def decoded_frames(self) -> int:
+        return int(self._counters[_Counter.DECODED_FRAMES])
+
+    @property
+    def skipped_decodes(self) -> int:
+        return int(self._counters[_Counter.SKIPPED_DECODES])
+
+    def refresh(self):
+        """Update ``statistics`` from the counters of the worker process."""
+        self.statistics.frames_received = int(self._counters[_Counter.FRAMES_RECEIVED])
+        self.statistics.bytes_received = int(self._counters[_Counter.BYTES_RECEIVED])
+        self.statistics.missing_frames = int(self._counters[_Counter.MISSING_FRAMES])
+        self.statistics.series_id = int(self._counters[_Counter.SERIES_ID])
+        self.statistics.series_ended = bool(self._counters[_Counter.SERIES_ENDED])
+
+    @property
+    def last_result(self) -> DecodeResult | None:
+        """Results of the last image decoded by the worker process, if any."""
+        generation = int(self._counters[_Counter.RING_GENERATION])
+        if generation != self._ring_generation:
+            # The worker has created a new ring
+            self._close_ring()
+            try:
+                # The worker process removes the ring, not the tracker of this one
+                self._ring = FrameRing.attach(self.ring_name, track=False)
+            except (FileNotFoundError, ValueError):
+                # The worker is still creating the ring, so try again next time
+                return None
+
+            self._ring_generation = generation
+
+        if self._ring is None or (entry := self._ring.latest(copy=False)) is None:
+            return None
+
+        result = DecodeResult(entry.total_counts, entry.max_count, entry.duration)
+        del entry
+        return result
+
+    async def run(self):
+        """Run the worker process until it exits or this is cancelled."""
+        self._process.start()
+        try:
+            while self._process.is_alive():
+                await asyncio.sleep(WORKER_UPDATE_PERIOD)
+
+            logger.error("Stream worker exited", exit_code=self._process.exitcode)
+        finally:
+            await self._stop_process()
+            self._close_ring()
+
+    async def _stop_process(self):
+        self._stop.set()
+        await asyncio.to_thread(self._process.join, 5)
+        if self._process.is_alive():
+            self._process.terminate()
+
+    def _close_ring(self):
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+
+@dataclass(frozen=True)
+class VdsMapping:
+    """Mapping of a run of frames in a file to evenly spaced blocks of the VDS"""
+
+    source_start: int
+    """First frame in the file"""
+    vds_start: int
+    """Frame of the VDS the first frame maps to"""
+    stride: int
+    """Frames between the start of each block in the VDS"""
+    count: int
+    """Number of blocks"""
+    block: int
+    """Frames in each block"""
+
+    @property
+    def frames(self) -> int:
+        return self.count * self.block
+
+
+def frame_distribution(
+    frame_count: int, frames_per_block: int, blocks_per_file: int, file_writers: int
+) -> dict[int, list[VdsMapping]]:
+    """Calculate where the frames of each file written by the file writers go.
+
+    Blocks of ``frames_per_block`` frames are sent to each file writer in turn, and
+    file writer ``n`` writes files ``n``, ``n + file_writers``, etc., each of up to
+    ``blocks_per_file`` blocks. So each file maps to every ``file_writers``th block,
+    which is one mapping, plus a mapping for the last block if it is not full. This
+    scales with the number of files rather than the number of blocks.
+
+    Args:
+        frame_count: Number of frames in the acquisition
+        frames_per_block: Number of consecutive frames sent to each file writer
+        blocks_per_file: Number of blocks in each file, or 0 for one file per writer
+        file_writers: Number of file writers
+
+    Returns: Mappings of each file, by its zero based index
+
+    """
+    blocks = -(-frame_count // frames_per_block)
+    last_block_frames = frame_count - (blocks - 1) * frames_per_block
+
+    distribution: dict[int, list[VdsMapping]] = {}
+    for writer in range(min(file_writers, blocks)):
+        writer_blocks = -(-(blocks - writer) // file_writers)
+        file_blocks = blocks_per_file or writer_blocks
+        for first in range(0, writer_blocks, file_blocks):
+            # Block of the writer and of the acquisition at the start of the file
+            last = min(first + file_blocks, writer_blocks)
+            full_blocks = last - first
+            partial = (last - 1) * file_writers + writer == blocks - 1 and (
+                last_block_frames < frames_per_block
+            )
+            if partial:
+                full_blocks -= 1
+
+            mappings = []
+            if full_blocks:
+                mappings.append(
+                    VdsMapping(
+                        source_start=0,
+                        vds_start=(first * file_writers + writer) * frames_per_block,
+                        stride=file_writers * frames_per_block,
+                        count=full_blocks,
+                        block=frames_per_block,
+                    )
+                )
+            if partial:
+                mappings.append(
+                    VdsMapping(
+                        source_start=full_blocks * frames_per_block,
+                        vds_start=(blocks - 1) * frames_per_block,
+                        stride=last_block_frames,
+                        count=1,
+                        block=last_block_frames,
+                    )
+                )
+
+            file_index = (first // file_blocks) * file_writers + writer
+            distribution[file_index] = mappings
+
+    return distribution
+
+
+def create_interleaved_vds(
+    path: Path,
+    file_prefix: str,
+    frame_count: int,
+    frame_shape: tuple[int, ...],
+    dtype: np.dtype,
+    frames_per_block: int,
+    blocks_per_file: int,
+    file_writers: int,
+    dataset: str = "data",
+):
+    """Create a VDS of the frames written by file writers sent interleaved blocks.
+
+    The files do not need to exist, or to be complete. Frames that have not been
+    written read as zero.
+
+    This blocks on file IO, so should be run in a thread rather than on the event
+    loop.
+
+    Args:
+        path: Path of the VDS file, in the same directory as the files
+        file_prefix: Prefix of the files, which are named ``<prefix>_000001.h5``, etc.
+        frame_count: Number of frames in the acquisition
+        frame_shape: Shape of each frame
+        dtype: Data type of the frames
+        frames_per_block: Number of consecutive frames sent to each file writer
+        blocks_per_file: Number of blocks in each file, or 0 for one file per writer
+        file_writers: Number of file writers
+        dataset: Name of the dataset in the files and the VDS
+
+    """
+    layout = h5py.VirtualLayout(shape=(frame_count, *frame_shape), dtype=dtype)
+    for file_index, mappings in frame_distribution(
+        frame_count, frames_per_block, blocks_per_file, file_writers
+    ).items():
+        frames = sum(mapping.frames for mapping in mappings)
+        # Relative to the VDS, so the files can be moved together
+        source = h5py.VirtualSource(
+            f"{file_prefix}_{file_index + 1:06d}.h5",
+            dataset,
+            shape=(frames, *frame_shape),
+            dtype=dtype,
+        )
+        for mapping in mappings:
+            layout[
+                h5py.MultiBlockSlice(
+                    start=mapping.vds_start,
+                    stride=mapping.stride,
+                    count=mapping.count,
+                    block=mapping.block,
+                )
+            ] = source[mapping.source_start : mapping.source_start + mapping.frames]
+
+    with h5py.File(path, "w", libver="latest") as file:
+        file.create_virtual_dataset(dataset, layout, fillvalue=0)
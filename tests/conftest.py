@@ -1,3 +1,4 @@
+import asyncio
 import signal
 import subprocess
 from time import sleep
@@ -43,6 +44,15 @@ def mock_connection(mocker: MockerFixture):
         IPConnectionSettings("127.0.0.1", 80), api_version="1.8.0"
     )
     connection = mocker.patch.object(eiger_controller, "connection")
+    connection.ip = "127.0.0.1"
     connection.get = mock.AsyncMock()
     connection.put = mock.AsyncMock()
+    connection.prewarm = mock.AsyncMock()
+
+    async def get_many(uris, window=None, return_exceptions=False):
+        return await asyncio.gather(
+            *[connection.get(uri) for uri in uris], return_exceptions=return_exceptions
+        )
+
+    connection.get_many = mock.AsyncMock(side_effect=get_many)
     return eiger_controller, connection
@@ -13,6 +13,9 @@ from pytest_mock import MockerFixture
 
 from fastcs_eiger.controllers.eiger_controller import EigerController
 from fastcs_eiger.controllers.eiger_detector_controller import EigerDetectorController
+from fastcs_eiger.controllers.eiger_filewriter_controller import (
+    EigerFilewriterController,
+)
 from fastcs_eiger.controllers.eiger_monitor_controller import EigerMonitorController
 from fastcs_eiger.controllers.eiger_stream_controller import EigerStreamController
 from fastcs_eiger.controllers.eiger_subsystem_controller import (
@@ -30,7 +33,7 @@ EIGER_PARAMETER_VALID_VALUES = EigerParameterResponse.__annotations__[
 
 
 def _serialise_parameter(parameter: EigerParameterRef) -> dict:
-    return {
+    serialised: dict[str, Any] = {
         "subsystem": parameter.subsystem,
         "mode": parameter.mode,
         "key": parameter.key,
@@ -40,6 +43,12 @@ def _serialise_parameter(parameter: EigerParameterRef) -> dict:
             if k not in ("max", "min", "unit", "value")
         },
     }
+    if parameter.shape is not None:
+        serialised["shape"] = list(parameter.shape)
+    if parameter.index is not None:
+        serialised["index"] = parameter.index
+
+    return serialised
 
 
 @pytest.mark.asyncio
@@ -57,13 +66,13 @@ async def test_attribute_creation(sim_eiger):
             subcontroller._subsystem
         ] = await subcontroller._introspect_detector_subsystem()
         for param in subsystem_parameters[subcontroller._subsystem]:
-            serialised_parameters[subcontroller._subsystem][param.key] = (
+            serialised_parameters[subcontroller._subsystem][param.attribute_name] = (
                 _serialise_parameter(param)
             )
 
     expected_file = HERE / "parameters.json"
     if os.environ.get("REGENERATE_TEST_OUTPUT", None):
-        expected_file.write_text(json.dumps(serialised_parameters, indent=4))
+        expected_file.write_text(json.dumps(serialised_parameters, indent=4) + "\n")
 
     expected_parameters = json.loads(expected_file.read_text())
 
@@ -81,6 +90,10 @@ async def test_attribute_creation(sim_eiger):
         subsystem_parameters["stream"]
     )
     assert len(stream_attributes) == 8
+    filewriter_attributes = EigerFilewriterController._create_attributes(
+        subsystem_parameters["filewriter"]
+    )
+    assert len(filewriter_attributes) == 1
 
     assert isinstance(detector_attributes["humidity"], AttrR)
     assert isinstance(detector_attributes["humidity"].datatype, Float)
@@ -151,65 +164,76 @@ async def test_threshold_mode_api_inconsistency_handled(
     assert api_put_response == ["difference_mode"]
     # would expect threshold/difference/mode but Eiger API 1.8.0 has this inconsistency
 
+    # Without write-through the value is read back after the put
+    detector_controller._io.write_through = False
     await detector_controller._io.send(attr, "enabled")
     queue_update_spy.assert_called_with(["threshold/difference/mode"])
     await controller.update()
     assert attr.get() == "enabled"
+
+    # With write-through the value put is used straight away and verified later
+    detector_controller._io.write_through = True
+    queue_verification_spy = mocker.spy(detector_controller._io, "queue_verification")
+    await detector_controller._io.send(attr, "disabled")
+    assert attr.get() == "disabled"
+    queue_verification_spy.assert_awaited_once_with(["threshold/difference/mode"])
+    await controller.update()
+    assert attr.get() == "disabled"
     await detector_controller.connection.close()
 
 
 @pytest.mark.asyncio
 @pytest.mark.parametrize("sim_eiger", [str(HERE / "eiger.yaml")], indirect=True)
 async def test_fetch_before_returning_parameters(sim_eiger, mocker: MockerFixture):
-    # Need to mock @scan to spy controller.update()
-    with patch("fastcs_eiger.controllers.eiger_controller.scan"):
-        controller = EigerController(
-            IPConnectionSettings("127.0.0.1", 8081), api_version="1.8.0"
-        )
-        await controller.initialise()
-
-        detector_controller = controller.sub_controllers["detector"]
-        assert isinstance(detector_controller, EigerDetectorController)
-
-        count_time_attr: AttrRW[float, EigerParameterRef] = (
-            detector_controller.attributes.get("count_time")
-        )  # type: ignore
-        count_time_attr.io_ref.update_period = None
-        frame_time_attr = detector_controller.attributes.get("frame_time")
-        bit_depth_image_attr = detector_controller.attributes.get("bit_depth_image")
-        assert isinstance(count_time_attr, AttrRW)
-        assert isinstance(frame_time_attr, AttrRW)
-        assert isinstance(bit_depth_image_attr, AttrR)
-
-        queue_update_spy = mocker.spy(detector_controller._io, "queue_update")
-        update_now_spy = mocker.spy(detector_controller._io, "update_now")
-        io_update_spy = mocker.spy(detector_controller._io, "update")
-        await detector_controller._io.send(count_time_attr, 2.0)
-
-        # bit_depth_image and bit_depth_readout handled early
-        update_now_spy.assert_awaited_once_with(
-            ["bit_depth_image", "bit_depth_readout"]
-        )
-
-        queue_update_spy.assert_awaited_once_with(
-            [
-                "count_time",
-                "countrate_correction_count_cutoff",
-                "frame_count_time",
-                "frame_time",
-            ]
-        )
-
-        updated = [call.args[0].io_ref.key for call in io_update_spy.await_args_list]
-        assert "bit_depth_image" in updated
-        assert "count_time" not in updated
-
-        # queued updated not updated until controller.update()
-        await controller.update()
-        updated = [call.args[0].io_ref.key for call in io_update_spy.await_args_list]
-        assert "count_time" in updated
-
-        await controller.connection.close()
+    controller = EigerController(
+        IPConnectionSettings("127.0.0.1", 8081), api_version="1.8.0"
+    )
+    await controller.initialise()
+
+    detector_controller = controller.sub_controllers["detector"]
+    assert isinstance(detector_controller, EigerDetectorController)
+
+    count_time_attr: AttrRW[float, EigerParameterRef] = (
+        detector_controller.attributes.get("count_time")
+    )  # type: ignore
+    count_time_attr.io_ref.update_period = None
+    frame_time_attr = detector_controller.attributes.get("frame_time")
+    bit_depth_image_attr = detector_controller.attributes.get("bit_depth_image")
+    assert isinstance(count_time_attr, AttrRW)
+    assert isinstance(frame_time_attr, AttrRW)
+    assert isinstance(bit_depth_image_attr, AttrR)
+
+    queue_update_spy = mocker.spy(detector_controller._io, "queue_update")
+    update_now_spy = mocker.spy(detector_controller._io, "update_now")
+    update_parameters_spy = mocker.spy(detector_controller, "update_parameters")
+    await detector_controller._io.send(count_time_attr, 2.0)
+
+    # bit_depth_image and bit_depth_readout handled early
+    update_now_spy.assert_awaited_once_with(["bit_depth_image", "bit_depth_readout"])
+
+    queue_update_spy.assert_awaited_once_with(
+        [
+            "count_time",
+            "countrate_correction_count_cutoff",
+            "frame_count_time",
+            "frame_time",
+        ]
+    )
+
+    updated = [
+        key for call in update_parameters_spy.await_args_list for key in call.args[0]
+    ]
+    assert "bit_depth_image" in updated
+    assert "count_time" not in updated
+
+    # queued updated not updated until controller.update()
+    await controller.update()
+    updated = [
+        key for call in update_parameters_spy.await_args_list for key in call.args[0]
+    ]
+    assert "count_time" in updated
+
+    await controller.connection.close()
 
 
 @pytest.mark.asyncio
@@ -227,16 +251,16 @@ async def test_stale_propagates_to_top_controller(
     await detector_controller.queue_update(["threshold_energy"])
     assert controller.stale_parameters.get() is True
     # top controller should be set to stale
-    assert not controller.queue.empty()
+    assert controller._pending_updates
     await controller.update()
-    assert controller.queue.empty()
+    assert not controller._pending_updates
     assert controller.stale_parameters.get() is False
 
     await detector_controller.queue_update(
         ["nonexistent_parameter"]
     )  # only gets set to stale if there's a real attribute update to queue...
     assert controller.stale_parameters.get() is False
-    assert controller.queue.empty()
+    assert not controller._pending_updates
 
     await controller.connection.close()
 
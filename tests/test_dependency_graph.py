@@ -0,0 +1,57 @@
+import pytest
+
+from fastcs_eiger.dependency_graph import DependencyCache, DependencyGraph
+
+
+def test_dependency_graph_learns_dependents():
+    graph = DependencyGraph()
+    assert graph.dependents("photon_energy") == []
+
+    graph.record_put("photon_energy", ["photon_energy", "threshold_energy"])
+    assert graph.changed
+    graph.changed = False
+
+    graph.record_put("photon_energy", ["threshold_energy", "bit_depth_image"])
+    assert graph.changed
+    assert graph.dependents("photon_energy") == [
+        "photon_energy",
+        "threshold_energy",
+        "bit_depth_image",
+    ]
+
+    graph.changed = False
+    graph.record_put("photon_energy", ["bit_depth_image"])
+    assert not graph.changed
+
+
+def test_dependency_graph_orders_slowest_first():
+    graph = DependencyGraph()
+    graph.record_latency("threshold_energy", 0.1)
+    graph.record_latency("threshold_energy", 0.2)
+    assert graph.latency("threshold_energy") == pytest.approx(0.12)
+
+    graph.record_latency("bit_depth_image", 0.01)
+    graph.record_latency("bit_depth_readout", 0.5)
+    assert graph.latency("photon_energy") is None
+    assert graph.slowest_first(
+        ["bit_depth_image", "threshold_energy", "photon_energy", "bit_depth_readout"]
+    ) == ["photon_energy", "bit_depth_readout", "threshold_energy", "bit_depth_image"]
+
+
+def test_dependency_cache_round_trip(tmp_path):
+    cache = DependencyCache(tmp_path / "cache" / "dependencies.json")
+    assert cache.load() == {}
+
+    graph = DependencyGraph()
+    graph.record_put("photon_energy", ["photon_energy", "threshold_energy"])
+    graph.record_latency("threshold_energy", 0.2)
+    cache.save({"detector": graph})
+    assert not graph.changed
+
+    loaded = cache.load()
+    assert list(loaded) == ["detector"]
+    assert loaded["detector"].to_dict() == graph.to_dict()
+    assert not loaded["detector"].changed
+
+    cache.path.write_text("not json")
+    assert cache.load() == {}
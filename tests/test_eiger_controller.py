@@ -1,9 +1,23 @@
+import asyncio
+from unittest import mock
+
+import numpy as np
 import pytest
 from fastcs.attributes import AttrRW
+from fastcs.connections import IPConnectionSettings
+from fastcs.datatypes import String
+from fastcs.transports.epics.ca import ioc
 from pytest_mock import MockerFixture
 
+from fastcs_eiger.controllers.eiger_controller import (
+    AcquisitionPolling,
+    EigerController,
+)
 from fastcs_eiger.controllers.eiger_detector_controller import EigerDetectorController
+from fastcs_eiger.controllers.eiger_monitor_controller import EigerMonitorController
 from fastcs_eiger.eiger_parameter import EigerParameterRef, EigerParameterResponse
+from fastcs_eiger.image import encode_tiff
+from fastcs_eiger.polling import PollThrottle
 
 
 @pytest.mark.asyncio
@@ -23,6 +37,7 @@ async def test_eiger_controller_creates_subcontrollers(mock_connection):
         "detector",
         "stream",
         "monitor",
+        "filewriter",
     ]
     connection.get.assert_any_call("detector/api/1.8.0/status/state")
     connection.get.assert_any_call("detector/api/1.8.0/status/keys")
@@ -31,6 +46,17 @@ async def test_eiger_controller_creates_subcontrollers(mock_connection):
     connection.get.assert_any_call("monitor/api/1.8.0/config/keys")
     connection.get.assert_any_call("stream/api/1.8.0/status/keys")
     connection.get.assert_any_call("stream/api/1.8.0/config/keys")
+    connection.get.assert_any_call("filewriter/api/1.8.0/status/keys")
+    connection.get.assert_any_call("filewriter/api/1.8.0/config/keys")
+
+    # status parameters are polled by the subsystem rather than individually
+    detector = eiger_controller.sub_controllers["detector"]
+    assert isinstance(detector, EigerDetectorController)
+    assert detector._poller.attributes
+    assert all(
+        attr.io_ref.mode == "status" and attr.io_ref.update_period is None
+        for attr in detector._poller.attributes
+    )
 
 
 @pytest.fixture
@@ -147,3 +173,477 @@ async def test_eiger_accepts_different_api_versions():
     )
 
     assert ref.uri == "detector/api/1.8.0/config/dummy_uri"
+
+
+@pytest.mark.asyncio
+async def test_acquisition_polling_throttle(mock_connection):
+    eiger_controller, connection = mock_connection
+
+    async def get(uri: str):
+        if "pixels_in_detector" in uri:
+            return {"value": 4, "value_type": "uint"}
+        return {"value": "idle", "value_type": "string"}
+
+    connection.get.side_effect = get
+    connection.get_bytes = mock.AsyncMock()
+    await eiger_controller.initialise()
+
+    subsystems = eiger_controller.get_subsystem_controllers()
+    monitor = eiger_controller.sub_controllers["monitor"]
+    assert isinstance(monitor, EigerMonitorController)
+
+    await eiger_controller._update_acquisition_polling("idle")
+    assert all(c._poller.throttle is None for c in subsystems)
+    assert not eiger_controller.polling_throttled.get()
+
+    await eiger_controller._update_acquisition_polling("acquire")
+    assert eiger_controller.polling_throttled.get()
+    assert all(
+        c._poller.throttle == PollThrottle(5.0, frozenset({"state", "error"}))
+        for c in subsystems
+    )
+
+    await eiger_controller.acquisition_polling.put(AcquisitionPolling.SUSPENDED)
+    await eiger_controller.acquisition_poll_keys.put("humidity")
+    await eiger_controller._update_acquisition_polling("ready")
+    assert all(
+        c._poller.throttle == PollThrottle(None, frozenset({"state", "humidity"}))
+        for c in subsystems
+    )
+
+    await monitor.handle_monitor()
+    connection.get_bytes.assert_not_called()
+    await eiger_controller._update_acquisition_polling("ready")
+    assert eiger_controller.saved_requests.get() == 1
+
+    await eiger_controller.acquisition_polling.put(AcquisitionPolling.FULL)
+    await eiger_controller._update_acquisition_polling("acquire")
+    assert all(c._poller.throttle is None for c in subsystems)
+    assert not eiger_controller.polling_throttled.get()
+
+
+@pytest.mark.asyncio
+async def test_queued_updates_are_deduplicated(
+    mock_connection, subsystem_controller_and_connection
+):
+    eiger_controller, _ = mock_connection
+    subsystem_controller, connection = subsystem_controller_and_connection
+    eiger_controller.add_sub_controller("detector", subsystem_controller)
+    ref = EigerParameterRef(
+        key="photon_energy",
+        subsystem="detector",
+        mode="config",
+        response=EigerParameterResponse(
+            access_mode="rw", value=0.0, value_type="float"
+        ),
+    )
+    subsystem_controller.photon_energy = AttrRW(ref.fastcs_datatype, io_ref=ref)
+    connection.get.return_value = {"value": 0.5}
+
+    await subsystem_controller.queue_update(["photon_energy"])
+    await subsystem_controller.queue_update(["photon_energy"])
+    assert eiger_controller.stale_parameters.get()
+    assert list(eiger_controller._pending_updates) == [("detector", "photon_energy")]
+
+    await eiger_controller.update()
+
+    connection.get.assert_awaited_once_with(ref.uri)
+    assert subsystem_controller.photon_energy.get() == 0.5
+    assert not eiger_controller.stale_parameters.get()
+
+    # Parameters without an attribute are not queued
+    await subsystem_controller.queue_update(["nonexistent_parameter"])
+    assert not eiger_controller.stale_parameters.get()
+    assert not eiger_controller._pending_updates
+
+
+@pytest.mark.asyncio
+async def test_queued_updates_are_processed_when_queued(
+    mock_connection, subsystem_controller_and_connection, mocker: MockerFixture
+):
+    eiger_controller, _ = mock_connection
+    subsystem_controller, connection = subsystem_controller_and_connection
+    eiger_controller.add_sub_controller("detector", subsystem_controller)
+    connection.get.return_value = {"value": 0.5}
+    update_spy = mocker.spy(eiger_controller, "update")
+
+    await eiger_controller.connect()
+    await asyncio.sleep(0.05)
+    update_spy.assert_not_called()
+
+    await subsystem_controller.queue_update(["dummy_attr"])
+    await eiger_controller.stale_parameters.wait_for_value(False, timeout=0.05)
+    update_spy.assert_called_once_with()
+
+    await eiger_controller.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_detector_initialized_before_introspection(
+    mock_connection, mocker: MockerFixture
+):
+    eiger_controller, connection = mock_connection
+    time_mock = mocker.patch("fastcs_eiger.controllers.eiger_controller.time")
+    time_mock.monotonic.side_effect = [10.0, 11.5]
+    calls = []
+
+    async def get(uri: str):
+        calls.append(uri)
+        return {"value": "na", "value_type": "string"}
+
+    async def put(uri: str, value=None):
+        calls.append(uri)
+        return []
+
+    connection.get.side_effect = get
+    connection.put.side_effect = put
+
+    await eiger_controller.initialise()
+
+    assert calls[:2] == [
+        "detector/api/1.8.0/status/state",
+        "detector/api/1.8.0/command/initialize",
+    ]
+    assert "detector/api/1.8.0/config/keys" in calls[2:]
+    assert eiger_controller.introspection_duration.get() == 1.5
+
+
+@pytest.mark.asyncio
+async def test_attributes_created_from_schema_cache(mocker: MockerFixture, tmp_path):
+    def create_controller():
+        controller = EigerController(
+            IPConnectionSettings("127.0.0.1", 80),
+            api_version="1.8.0",
+            schema_cache_dir=tmp_path,
+        )
+        connection = mocker.patch.object(controller, "connection")
+        connection.ip = "127.0.0.1"
+        connection.prewarm = mock.AsyncMock()
+        connection.get = mock.AsyncMock(side_effect=get)
+        connection.get_many = mock.AsyncMock(side_effect=get_many)
+        return controller, connection
+
+    keys = ["state", "humidity"]
+
+    async def get(uri: str):
+        if uri.endswith("/keys"):
+            return keys
+        return {"value": "1.8.0", "value_type": "string"}
+
+    async def get_many(uris: list[str], window=None, return_exceptions=False):
+        return await asyncio.gather(
+            *[get(uri) for uri in uris], return_exceptions=return_exceptions
+        )
+
+    controller, connection = create_controller()
+    await controller.initialise()
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # Second startup uses the cache rather than introspecting
+    controller, connection = create_controller()
+    await controller.initialise()
+    assert "humidity" in controller.sub_controllers["detector"].attributes
+    assert not any(call.args[0].endswith("/keys") for call in connection.get.mock_calls)
+
+    # Drift from the cache is reported after connecting
+    keys = ["state"]
+    await controller._check_schema_cache()
+    assert controller.schema_drift.get() == ", ".join(
+        f"{subsystem}/{mode}/humidity"
+        for subsystem in ["detector", "filewriter", "monitor", "stream"]
+        for mode in ["config", "status"]
+    )
+
+
+@pytest.mark.asyncio
+async def test_array_parameters_read_on_demand(mock_connection, mocker, tmp_path):
+    eiger_controller, connection = mock_connection
+    eiger_controller._schema_cache_dir = tmp_path
+
+    async def get(uri: str):
+        if uri == "detector/api/1.8.0/config/keys":
+            return ["pixel_mask", "threshold/1/flatfield", "count_time"]
+        elif uri.endswith("/keys"):
+            return []
+        elif uri.endswith("x_pixels_in_detector"):
+            return {"value": 6, "value_type": "uint"}
+        elif uri.endswith("y_pixels_in_detector"):
+            return {"value": 4, "value_type": "uint"}
+        return {"value": 0.1, "value_type": "float"}
+
+    connection.get.side_effect = get
+    await eiger_controller.initialise()
+
+    detector = eiger_controller.detector
+    # Flattened, as the CA transport only supports 1-D waveforms
+    assert detector.pixel_mask.datatype.shape == (24,)
+    assert detector.threshold_1_flatfield.datatype.shape == (24,)
+    assert detector.threshold_1_flatfield.datatype.array_dtype == np.float32
+    assert detector.pixel_mask.io_ref.update_period is None
+    # The arrays are not read as JSON
+    assert not any(
+        "pixel_mask" in call.args[0] or "flatfield" in call.args[0]
+        for call in connection.get.mock_calls
+    )
+    # The shapes are cached for the next startup
+    schema = eiger_controller._schema()["detector"]
+    assert {
+        parameter["key"]: parameter["shape"]
+        for parameter in schema
+        if "shape" in parameter
+    } == {"pixel_mask": [4, 6], "threshold/1/flatfield": [4, 6]}
+    assert {
+        parameter.key: parameter.shape
+        for parameter in detector.parameters_from_schema(schema)
+        if parameter.is_array
+    } == {"pixel_mask": (4, 6), "threshold/1/flatfield": (4, 6)}
+
+    read_pv = mocker.patch.object(ioc, "_create_and_link_read_pv")
+    mocker.patch.object(ioc, "_create_and_link_write_pv")
+    ioc._create_and_link_attribute_pvs("EIGER", detector._build_api([]))
+    assert {"PixelMask_RBV", "Threshold1Flatfield_RBV"} <= {
+        call.args[1] for call in read_pv.call_args_list
+    }
+
+    mask = np.ones((4, 6), dtype=np.uint32)
+    connection.get_bytes = mock.AsyncMock(
+        return_value=(mock.MagicMock(status=200), bytes(encode_tiff(mask)))
+    )
+    await detector.read_arrays()
+    np.testing.assert_array_equal(detector.pixel_mask.get(), mask.reshape(-1))
+    assert connection.get_bytes.await_count == 2
+
+    # Only arrays the detector reports as changed are read again
+    await detector.update_parameters(["pixel_mask", "count_time"])
+    await detector.read_arrays()
+    assert connection.get_bytes.await_count == 3
+    connection.get_bytes.assert_awaited_with(
+        detector.pixel_mask.io_ref.uri, "application/tiff"
+    )
+
+
+@pytest.mark.asyncio
+async def test_list_parameters(mock_connection):
+    eiger_controller, connection = mock_connection
+    responses = {
+        "stream/api/1.8.0/status/keys": ["buffer_fill_level"],
+        "stream/api/1.8.0/status/buffer_fill_level": {
+            "value": [12, 100],
+            "value_type": "uint",
+        },
+        "detector/api/1.8.0/config/keys": ["detector_translation"],
+        "detector/api/1.8.0/config/detector_translation": {
+            "value": [0.0, 0.5, 1.0],
+            "value_type": "float",
+        },
+        "detector/api/1.8.0/status/error": {
+            "value": ["Link down"],
+            "value_type": "string[]",
+        },
+    }
+
+    async def get(uri: str):
+        if uri in responses:
+            return responses[uri]
+        elif uri.endswith("/keys"):
+            return []
+        return {"value": "na", "value_type": "string"}
+
+    connection.get.side_effect = get
+    await eiger_controller.initialise()
+
+    detector, stream = eiger_controller.detector, eiger_controller.stream
+    assert detector.detector_translation.datatype.shape == (3,)
+    assert detector.error.datatype == String()
+
+    await stream.update_parameters(["buffer_fill_level"])
+    await detector.update_parameters(["detector_translation", "error"])
+    assert stream.buffer_fill_level.get() == 12
+    assert stream.buffer_fill_level_max.get() == 100
+    assert list(detector.detector_translation.get()) == [0.0, 0.5, 1.0]
+    assert detector.error.get() == "Link down"
+
+
+@pytest.mark.asyncio
+async def test_write_through_verifies_without_stale_parameters(mock_connection):
+    eiger_controller, connection = mock_connection
+    detector = eiger_controller._create_subsystem_controller("detector")
+    eiger_controller.add_sub_controller("detector", detector)
+    ref = EigerParameterRef(
+        key="trigger_mode",
+        subsystem="detector",
+        mode="config",
+        response=EigerParameterResponse(
+            allowed_values=["ints", "exts"], value="ints", value_type="string"
+        ),
+    )
+    assert ref.echoes_exactly
+    detector.trigger_mode = AttrRW(ref.fastcs_datatype, io_ref=ref)
+    await detector.initialise([])
+    connection.put.return_value = []
+
+    await detector._io.send(detector.trigger_mode, "exts")
+    # The value put is used straight away and read back later
+    assert detector.trigger_mode.get() == "exts"
+    assert not eiger_controller.stale_parameters.get()
+    assert not eiger_controller._pending_updates
+    assert list(eiger_controller._pending_verifications) == [
+        ("detector", "trigger_mode")
+    ]
+    connection.get.assert_not_awaited()
+
+    # Updates are processed before verifications
+    await eiger_controller.queue_subsystem_update("detector", ["dummy_attr"])
+    await eiger_controller.update()
+    assert eiger_controller._pending_verifications
+    assert eiger_controller._updates_queued.is_set()
+
+    connection.get.return_value = {"value": "ints"}
+    await eiger_controller.update()
+    connection.get.assert_awaited_with(ref.uri)
+    assert detector.trigger_mode.get() == "ints"
+    assert eiger_controller.write_through_mismatches.get() == 1
+    assert not eiger_controller._updates_queued.is_set()
+
+    await eiger_controller.write_through.put(False)
+    await detector._io.send(detector.trigger_mode, "exts")
+    assert detector.trigger_mode.get() == "ints"
+    assert eiger_controller.stale_parameters.get()
+    assert list(eiger_controller._pending_updates) == [("detector", "trigger_mode")]
+
+
+@pytest.mark.asyncio
+async def test_put_prefetches_learned_dependents(mock_connection):
+    eiger_controller, connection = mock_connection
+    detector = eiger_controller._create_subsystem_controller("detector")
+    eiger_controller.add_sub_controller("detector", detector)
+    refs = [
+        EigerParameterRef(
+            key=key,
+            subsystem="detector",
+            mode="config",
+            response=EigerParameterResponse(
+                access_mode="rw", value=0.0, value_type="float"
+            ),
+        )
+        for key in ("photon_energy", "threshold_energy", "count_time")
+    ]
+    await detector.initialise(refs)
+    values = {ref.uri: 0.0 for ref in refs}
+
+    async def get(uri):
+        return {"value": values[uri]}
+
+    connection.get.side_effect = get
+    connection.put.return_value = ["photon_energy", "threshold_energy"]
+    detector.dependency_graph.record_latency("photon_energy", 0.01)
+    detector.dependency_graph.record_latency("threshold_energy", 0.5)
+
+    values[refs[0].uri], values[refs[1].uri] = 9000.0, 4500.0
+    await detector._io.send(detector.photon_energy, 9000.0)  # pyright: ignore[reportAttributeAccessIssue]
+    assert detector.dependency_graph.dependents("photon_energy") == [
+        "photon_energy",
+        "threshold_energy",
+    ]
+    # Fetched slowest first as soon as the put returns
+    await asyncio.sleep(0)
+    assert [call.args[0] for call in connection.get.await_args_list] == [
+        refs[1].uri,
+        refs[0].uri,
+    ]
+
+    # The update queue uses the values already fetched
+    assert eiger_controller.stale_parameters.get()
+    await eiger_controller.update()
+    assert connection.get.await_count == 2
+    assert detector.photon_energy.get() == 9000.0  # pyright: ignore[reportAttributeAccessIssue]
+    assert detector.threshold_energy.get() == 4500.0  # pyright: ignore[reportAttributeAccessIssue]
+    assert not eiger_controller.stale_parameters.get()
+    assert not detector._prefetches
+
+    # Dependents learned from earlier puts are updated if the detector reports none
+    connection.put.return_value = []
+    await eiger_controller.prefetch.put(False)
+    await detector._io.send(detector.photon_energy, 8000.0)  # pyright: ignore[reportAttributeAccessIssue]
+    assert not detector._prefetches
+    assert list(eiger_controller._pending_updates) == [
+        ("detector", "photon_energy"),
+        ("detector", "threshold_energy"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_prefetch_replaces_earlier_prefetch(
+    mock_connection, mocker: MockerFixture
+):
+    eiger_controller, connection = mock_connection
+    detector = eiger_controller._create_subsystem_controller("detector")
+    ref = EigerParameterRef(
+        key="photon_energy",
+        subsystem="detector",
+        mode="config",
+        response=EigerParameterResponse(
+            access_mode="rw", value=0.0, value_type="float"
+        ),
+    )
+    await detector.initialise([ref])
+    requests = 0
+
+    async def get(uri):
+        nonlocal requests
+        requests += 1
+        if requests == 1:
+            await asyncio.Event().wait()
+        return {"value": 9000.0}
+
+    connection.get.side_effect = get
+
+    detector.prefetch_parameters(["photon_energy"])
+    first = detector._prefetches["photon_energy"]
+    await asyncio.sleep(0)
+    # A later put replaces the fetch, which may return the value from before it
+    detector.prefetch_parameters(["photon_energy"])
+    second = detector._prefetches["photon_energy"]
+    await asyncio.wait_for(
+        asyncio.gather(first, second, return_exceptions=True), timeout=1
+    )
+    assert first.cancelled()
+    assert second.result() == 9000.0
+
+    # Errors of prefetches that are never used are logged rather than lost
+    warning = mocker.patch(
+        "fastcs_eiger.controllers.eiger_subsystem_controller.logger"
+    ).warning
+    connection.get.side_effect = ConnectionError("Failed to get")
+    detector.prefetch_parameters(["photon_energy"])
+    await asyncio.gather(detector._prefetches["photon_energy"], return_exceptions=True)
+    warning.assert_called_once_with(
+        "Failed to prefetch parameter",
+        exception=repr(ConnectionError("Failed to get")),
+    )
+
+
+@pytest.mark.asyncio
+async def test_monitor_count_cutoff_follows_detector(mock_connection):
+    eiger_controller, connection = mock_connection
+
+    async def get(uri: str):
+        if uri == "detector/api/1.8.0/config/keys":
+            return ["countrate_correction_count_cutoff"]
+        elif uri.endswith("/keys"):
+            return []
+        elif uri.endswith("x_pixels_in_detector"):
+            return {"value": 4}
+        elif uri.endswith("y_pixels_in_detector"):
+            return {"value": 3}
+        elif uri.endswith("countrate_correction_count_cutoff"):
+            return {"value": 10, "value_type": "uint", "access_mode": "rw"}
+        return {"value": "idle", "value_type": "string", "access_mode": "r"}
+
+    connection.get.side_effect = get
+    await eiger_controller.initialise()
+    monitor = eiger_controller.sub_controllers["monitor"]
+    assert isinstance(monitor, EigerMonitorController)
+
+    await eiger_controller.detector.countrate_correction_count_cutoff.update(20)  # pyright: ignore[reportAttributeAccessIssue]
+    assert monitor._count_cutoff == 20
@@ -0,0 +1,133 @@
+import asyncio
+from unittest import mock
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from fastcs.connections import IPConnectionSettings
+
+from fastcs_eiger.controllers.eiger_filewriter_controller import (
+    EigerFilewriterController,
+)
+from fastcs_eiger.download import DownloadProgress, download_files
+from fastcs_eiger.http_connection import HTTPConnection
+
+FILES = {
+    "series_3_master.h5": b"master",
+    "series_3_data_000001.h5": bytes(300_000),
+    "series_3_data_000002.h5": bytes(200_000),
+}
+
+
+@pytest_asyncio.fixture
+async def filewriter():
+    """Stand-in for the filewriter and data interfaces of a detector."""
+    requested: list[str] = []
+
+    async def handle_files(request: web.Request):
+        return web.json_response(list(FILES))
+
+    async def handle_error(request: web.Request):
+        return web.json_response(
+            {"access_mode": "r", "value": [], "value_type": "string[]"}
+        )
+
+    async def handle_data(request: web.Request):
+        filename = request.match_info["filename"]
+        requested.append(filename)
+        return web.Response(body=FILES[filename])
+
+    app = web.Application()
+    app.router.add_get("/filewriter/api/1.8.0/files", handle_files)
+    app.router.add_get("/filewriter/api/1.8.0/status/error", handle_error)
+    app.router.add_get("/data/{filename}", handle_data)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    connection = HTTPConnection(
+        IPConnectionSettings("127.0.0.1", runner.addresses[0][1])
+    )
+    connection.open()
+
+    yield EigerFilewriterController(connection, mock.AsyncMock(), "1.8.0"), requested
+
+    await connection.close()
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_filewriter_downloads_files(filewriter, tmp_path):
+    controller, requested = filewriter
+    await controller.download_directory.put(str(tmp_path))
+    await controller.download_concurrency.put(2)
+
+    await controller.download()
+    assert controller.downloading.get()
+    assert controller.files_to_download.get() == 3
+    with pytest.raises(RuntimeError):
+        await controller.download()
+
+    assert controller._download_task is not None
+    await asyncio.wait_for(controller._download_task, timeout=5)
+    await controller.update_download_progress()
+
+    assert {path.name: path.read_bytes() for path in tmp_path.iterdir()} == FILES
+    # Master files are downloaded after the data files they link to
+    assert requested[-1] == "series_3_master.h5"
+    assert not controller.downloading.get()
+    assert controller.files_downloaded.get() == 3
+    assert controller.download_progress.get() == 100
+    assert controller.megabytes_downloaded.get() == pytest.approx(0.5)
+    assert controller.download_throughput.get() > 0
+
+
+@pytest.mark.asyncio
+async def test_filewriter_download_requires_directory(filewriter, tmp_path):
+    controller, requested = filewriter
+    await controller.download_directory.put(str(tmp_path / "missing"))
+
+    with pytest.raises(ValueError):
+        await controller.download()
+    assert requested == []
+
+
+@pytest.mark.asyncio
+async def test_filewriter_introspects_known_keys_without_keys_list(filewriter):
+    controller, _ = filewriter
+
+    # The filewriter of the simulator does not list its keys
+    parameters = await controller._introspect_detector_subsystem()
+
+    assert [(parameter.mode, parameter.key) for parameter in parameters] == [
+        ("status", "error")
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_download_cancels_other_downloads(tmp_path):
+    cancelled: list[str] = []
+
+    async def download(uri: str, path, on_progress):
+        if uri.endswith("missing.h5"):
+            raise ConnectionError(f"Failed to download {uri}")
+
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(path.name)
+            raise
+
+    connection = mock.Mock(download=mock.AsyncMock(side_effect=download))
+    progress = DownloadProgress()
+
+    with pytest.raises(ExceptionGroup):
+        await asyncio.wait_for(
+            download_files(
+                connection, ["data_1.h5", "missing.h5"], tmp_path, 2, progress
+            ),
+            timeout=1,
+        )
+
+    assert cancelled == ["data_1.h5"]
+    assert progress.end is not None and progress.in_progress == {}
@@ -0,0 +1,260 @@
+import asyncio
+import threading
+import uuid
+from io import BytesIO
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastcs.transports.epics.ca import ioc
+from PIL import Image
+from pytest_mock import MockerFixture
+
+from fastcs_eiger.controllers.eiger_monitor_controller import EigerMonitorController
+from fastcs_eiger.frame_ring import FrameRingReader
+from fastcs_eiger.image import (
+    BinningMode,
+    ImageWaveform,
+    bin_image,
+    decode_tiff,
+    image_statistics,
+    parse_rois,
+)
+
+
+def _tiff(array: np.ndarray, **kwargs) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(array).save(buffer, format="TIFF", **kwargs)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.int32, np.float32])
+def test_decode_tiff_is_a_view_of_uncompressed_data(dtype):
+    array = np.arange(12, dtype=dtype).reshape(3, 4)
+    data = _tiff(array)
+
+    image = decode_tiff(data)
+
+    np.testing.assert_array_equal(image, array)
+    assert image.base is not None and not image.flags.writeable
+
+
+def test_decode_tiff_compressed():
+    array = np.arange(12, dtype=np.int32).reshape(3, 4)
+
+    np.testing.assert_array_equal(
+        decode_tiff(_tiff(array, compression="tiff_lzw")), array
+    )
+
+
+def test_image_waveform_validate_does_not_copy():
+    datatype = ImageWaveform(np.uint32, shape=(3, 4))
+    array = np.zeros((3, 4), dtype=np.uint32)
+
+    assert datatype.validate(array) is array
+    assert datatype.validate(array.astype(np.int32)).dtype == np.uint32
+    with pytest.raises(ValueError):
+        datatype.validate(np.zeros((4, 4), dtype=np.uint32))
+
+
+def test_image_statistics_exclude_masked_pixels():
+    masked = np.iinfo(np.uint32).max
+    image = np.array(
+        [[0, 1, 2, masked], [3, 4, 20, masked], [0, 0, 0, 0]], dtype=np.uint32
+    )
+
+    statistics = image_statistics(image, count_cutoff=10, rois=[(1, 0, 2, 2)])
+
+    assert statistics.total == 30
+    assert statistics.max == 20
+    assert statistics.mean == 3
+    assert statistics.saturated == 1
+    assert statistics.masked == 2
+    assert statistics.centroid_x == pytest.approx((1 * 5 + 2 * 22) / 30)
+    assert statistics.centroid_y == pytest.approx((3 + 4 + 20) / 30)
+    assert statistics.roi_sums == [27]
+
+
+def test_image_statistics_of_empty_image():
+    statistics = image_statistics(np.zeros((2, 2), dtype=np.uint32))
+
+    assert statistics.total == 0
+    assert statistics.mean == 0
+    assert np.isnan(statistics.centroid_x)
+
+
+def test_parse_rois():
+    assert parse_rois("") == []
+    assert parse_rois("0,0,10,10; 5,5,2,3") == [(0, 0, 10, 10), (5, 5, 2, 3)]
+    with pytest.raises(ValueError):
+        parse_rois("0,0,10")
+    with pytest.raises(ValueError):
+        parse_rois("0,-1,10,10")
+
+
+def test_bin_image_excludes_masked_pixels():
+    masked = np.iinfo(np.uint32).max
+    image = np.arange(35, dtype=np.uint32).reshape(5, 7)
+    image[0, 0] = masked
+
+    binned = bin_image(image, 2)
+    assert binned.dtype == np.uint32
+    np.testing.assert_array_equal(
+        binned,
+        [
+            [1 + 7 + 8, 2 + 3 + 9 + 10, 4 + 5 + 11 + 12],
+            [14 + 15 + 21 + 22, 16 + 17 + 23 + 24, 18 + 19 + 25 + 26],
+        ],
+    )
+    np.testing.assert_array_equal(bin_image(image, 3, BinningMode.MAX), [[16, 19]])
+
+
+def test_bin_image_clips_sums():
+    image = np.full((2, 2), 200, dtype=np.uint8)
+
+    np.testing.assert_array_equal(bin_image(image, 2), [[254]])
+
+
+@pytest.fixture
+def monitor(mocker: MockerFixture):
+    connection = mocker.MagicMock()
+    connection.ip = "i03-eiger01"
+
+    async def get(uri: str):
+        if uri.endswith("/keys"):
+            return []
+        elif uri.endswith("x_pixels_in_detector"):
+            return {"value": 4}
+        elif uri.endswith("y_pixels_in_detector"):
+            return {"value": 3}
+
+    async def get_many(uris, window=None, return_exceptions=False):
+        return await asyncio.gather(
+            *[get(uri) for uri in uris], return_exceptions=return_exceptions
+        )
+
+    connection.get = mock.AsyncMock(side_effect=get)
+    connection.get_many = mock.AsyncMock(side_effect=get_many)
+    connection.get_bytes = mock.AsyncMock()
+    return EigerMonitorController(connection, mock.AsyncMock(), "1.8.0"), connection
+
+
+@pytest.mark.asyncio
+async def test_monitor_image_published(monitor, mocker: MockerFixture):
+    controller, connection = monitor
+    array = np.arange(12, dtype=np.int32).reshape(3, 4)
+    connection.get_bytes.return_value = (mocker.Mock(status=200), _tiff(array))
+
+    await controller.initialise()
+    await controller.update_count_cutoff(10)
+    await controller.rois.put("0,0,2,1;2,1,2,2")
+    assert controller.image is not None
+    assert controller.image.datatype.shape == (12,)
+    assert (controller.image_width.get(), controller.image_height.get()) == (4, 3)
+
+    await controller.handle_monitor()
+
+    connection.get_bytes.assert_awaited_once_with("monitor/api/1.8.0/images/next")
+    # The count cutoff is kept up to date by the detector, not read with each image
+    assert all(
+        "count_cutoff" not in call.args[0] for call in connection.get.await_args_list
+    )
+    np.testing.assert_array_equal(controller.image.get(), array.reshape(-1))
+    assert controller.total_counts.get() == 66
+    assert controller.saturated_pixels.get() == 2
+    np.testing.assert_array_equal(controller.roi_sums.get(), [1, 34])
+
+
+@pytest.mark.asyncio
+async def test_monitor_frame_rate(monitor, mocker: MockerFixture):
+    controller, connection = monitor
+    time_mock = mocker.patch("fastcs_eiger.controllers.eiger_monitor_controller.time")
+    connection.get_bytes.return_value = (mocker.Mock(status=404), b"")
+    await controller.initialise()
+    await controller.frame_rate.put(2.0)
+
+    for now in [10.0, 10.1, 10.5, 10.6]:
+        time_mock.monotonic.return_value = now
+        await controller.handle_monitor()
+    assert connection.get_bytes.await_count == 2
+
+    await controller.frame_rate.put(0)
+    time_mock.monotonic.return_value = 20.0
+    await controller.handle_monitor()
+    assert connection.get_bytes.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_monitor_preview_updated_faster_than_image(
+    monitor, mocker: MockerFixture
+):
+    controller, connection = monitor
+    time_mock = mocker.patch("fastcs_eiger.controllers.eiger_monitor_controller.time")
+    array = np.arange(12, dtype=np.int32).reshape(3, 4)
+    connection.get_bytes.return_value = (mocker.Mock(status=200), _tiff(array))
+    await controller.initialise()
+    await controller.frame_rate.put(2.0)
+    await controller.full_image_rate.put(1.0)
+    await controller.preview_binning.put(2)
+    assert controller.image is not None and controller.preview is not None
+    image_update = mocker.spy(controller.image, "update")
+    preview_update = mocker.spy(controller.preview, "update")
+
+    for now in [10.0, 10.5, 11.0]:
+        time_mock.monotonic.return_value = now
+        await controller.handle_monitor()
+
+    assert image_update.await_count == 2
+    assert preview_update.await_count == 3
+    np.testing.assert_array_equal(controller.preview.get(), [10, 18])
+    assert (controller.preview_width.get(), controller.preview_height.get()) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_monitor_frame_ring(monitor, mocker: MockerFixture):
+    controller, connection = monitor
+    array = np.arange(12, dtype=np.int32).reshape(3, 4)
+    connection.get_bytes.return_value = (mocker.Mock(status=200), _tiff(array))
+    await controller.initialise()
+    assert controller.frame_ring_name.get() == "fastcs_eiger_i03-eiger01_monitor"
+    await controller.frame_ring_name.put(f"test_monitor_{uuid.uuid4().hex[:8]}")
+    await controller.frame_ring.put(True)
+    reader = FrameRingReader(controller.frame_ring_name.get(), track=True)
+    assert controller._frame_ring is not None
+    write = controller._frame_ring.write
+    write_threads = []
+
+    def _write(*args, **kwargs):
+        write_threads.append(threading.get_ident())
+        write(*args, **kwargs)
+
+    mocker.patch.object(controller._frame_ring, "write", side_effect=_write)
+
+    await controller.handle_monitor()
+
+    # Frames are copied into the ring off the event loop
+    assert len(write_threads) == 1 and write_threads[0] != threading.get_ident()
+    (entry,) = reader.read_new()
+    assert entry.frame_number == 1 and entry.total_counts == 66
+    np.testing.assert_array_equal(entry.frame, array)
+
+    await controller.frame_ring.put(False)
+    assert reader.read_new() == []
+    reader.close()
+
+
+@pytest.mark.asyncio
+async def test_monitor_image_exposed_by_ca_transport(monitor, mocker: MockerFixture):
+    controller, _ = monitor
+    await controller.initialise()
+    read_pv = mocker.patch.object(ioc, "_create_and_link_read_pv")
+    mocker.patch.object(ioc, "_create_and_link_write_pv")
+
+    ioc._create_and_link_attribute_pvs("EIGER", controller._build_api([]))
+
+    read_pvs = {call.args[1]: call.args[2] for call in read_pv.call_args_list}
+    assert read_pvs["Image"] == "image"
+    assert read_pvs["Preview"] == "preview"
+    assert {"ImageWidth", "ImageHeight", "PreviewWidth", "PreviewHeight"} <= (
+        read_pvs.keys()
+    )
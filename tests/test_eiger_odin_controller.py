@@ -1,3 +1,6 @@
+from pathlib import Path
+
+import h5py
 import pytest
 from fastcs.attributes import AttrR, AttrRW
 from fastcs.connections import IPConnectionSettings
@@ -91,6 +94,48 @@ async def test_start_writing(eiger_odin_controller, mocker: MockerFixture):
     writing_wait_mock.assert_awaited_with(
         True, timeout=controller.start_writing_timeout.get()
     )
+    assert controller._vds_task is None
 
     controller.enable_vds_creation._value = True
     await controller.start_writing()
+    controller.OD.FP.start_writing.assert_awaited_with()
+    writing_wait_mock.assert_awaited_with(
+        True, timeout=controller.start_writing_timeout.get()
+    )
+    # The VDS is created in the background once writing finishes
+    assert controller._vds_task is not None
+    controller._vds_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_start_writing_creates_vds(
+    eiger_odin_controller, mocker: MockerFixture, tmp_path: Path
+):
+    controller = eiger_odin_controller
+    await controller.OD.file_path.update(str(tmp_path))
+    controller.OD.FP.__len__.return_value = 2
+
+    detector_mock = mocker.patch.object(controller, "detector", create=True)
+    detector_mock.compression.get.return_value = "lz4"
+    detector_mock.bit_depth_image.get.return_value = 16
+    writing_wait_mock = mocker.patch.object(controller.OD.writing, "wait_for_value")
+
+    await controller.enable_vds_creation.update(True)
+    await controller.start_writing()
+    assert not controller.vds_complete.get()
+
+    assert controller._vds_task is not None
+    await controller._vds_task
+    writing_wait_mock.assert_awaited_with(False, timeout=controller.vds_timeout.get())
+    assert controller.vds_complete.get()
+    assert controller.vds_duration.get() >= 0
+
+    vds_path = tmp_path / "test_prefix_vds.h5"
+    assert controller.vds_file.get() == str(vds_path)
+    with h5py.File(vds_path) as vds_file:
+        dataset = vds_file["data"]
+        assert dataset.shape == (100, 512, 1024)
+        assert dataset.dtype == "uint16"
+        # 25 blocks of 4 frames alternate between 2 file writers of 10 blocks per file
+        sources = {source.file_name for source in dataset.virtual_sources()}
+        assert sorted(sources) == [f"test_prefix_{n:06d}.h5" for n in range(1, 5)]
@@ -1,6 +1,12 @@
+import numpy as np
 import pytest
+from fastcs.datatypes import String, Waveform
 
-from fastcs_eiger.eiger_parameter import EigerParameterRef, EigerParameterResponse
+from fastcs_eiger.eiger_parameter import (
+    EigerParameterRef,
+    EigerParameterResponse,
+    list_shape,
+)
 
 
 @pytest.mark.parametrize(
@@ -25,3 +31,38 @@ def test_eiger_access_mode(
         ),
     )
     assert ref.access_mode == expected_access_mode
+
+
+@pytest.mark.parametrize(
+    "value_type, value, array_dtype, shape",
+    [
+        ("float", [0.0, 0.0, 1.5], np.float64, (3,)),
+        ("int", [1, 0, 0, 0, -1, 0], np.int32, (6,)),
+    ],
+)
+def test_list_values_are_waveforms(value_type, value, array_dtype, shape):
+    ref = EigerParameterRef(
+        key="detector_orientation",
+        subsystem="detector",
+        mode="config",
+        response=EigerParameterResponse(value=value, value_type=value_type),
+        shape=list_shape(value_type, value),
+    )
+    assert ref.fastcs_datatype == Waveform(array_dtype, shape=shape)
+    assert not ref.is_array
+    assert list(ref.fastcs_datatype.validate(value)) == value
+
+
+@pytest.mark.parametrize(
+    "value_type, value", [("string[]", ["Link down"]), ("string", []), ("string[]", [])]
+)
+def test_string_list_values_are_strings(value_type, value):
+    ref = EigerParameterRef(
+        key="error",
+        subsystem="detector",
+        mode="status",
+        response=EigerParameterResponse(value=value, value_type=value_type),
+        shape=list_shape(value_type, value),
+    )
+    assert ref.shape is None
+    assert ref.fastcs_datatype == String()
@@ -0,0 +1,112 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from fastcs_eiger.frame_ring import (
+    FrameRing,
+    FrameRingReader,
+    FrameRingWriter,
+    frame_ring_name,
+)
+
+
+def ring_name() -> str:
+    return f"test_{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing.create(ring_name(), slot_capacity=48, slots=2)
+    yield ring
+    ring.close()
+
+
+def test_frame_ring_write_and_read(ring: FrameRing):
+    reader = FrameRing.attach(ring.name)
+    assert (reader.slots, reader.slot_capacity) == (2, 48)
+    assert reader.latest() is None
+
+    frames = [np.full((3, 4), i, dtype=np.uint32) for i in range(3)]
+    for i, frame in enumerate(frames):
+        ring.write(frame, frame_number=i, series_id=5, total_counts=12 * i, max_count=i)
+
+    entry = reader.latest()
+    assert entry is not None
+    assert (entry.frame_number, entry.series_id) == (2, 5)
+    assert (entry.total_counts, entry.max_count) == (24, 2)
+    np.testing.assert_array_equal(entry.frame, frames[2])
+
+    # The first frame has been overwritten
+    assert reader.read(0) is None
+    entry = reader.read(1, copy=False)
+    assert entry is not None
+    np.testing.assert_array_equal(entry.frame, frames[1])
+
+    del entry
+    reader.close()
+
+
+def test_frame_ring_rejects_large_frames(ring: FrameRing):
+    with pytest.raises(ValueError):
+        ring.write(np.zeros(13, dtype=np.uint32), frame_number=0, series_id=0)
+
+
+def test_frame_ring_reader_follows_writer():
+    writer = FrameRingWriter(ring_name(), slots=2)
+    # Readers in this process share its resource tracker
+    reader = FrameRingReader(writer.name, track=True)
+    assert reader.read_new() == []
+
+    for i in range(3):
+        writer.write(np.full(2, i, dtype=np.uint16), frame_number=i, series_id=1)
+    assert [entry.frame_number for entry in reader.read_new()] == [1, 2]
+    assert reader.missed_frames == 1
+
+    # A larger frame does not fit, so the ring is created again
+    writer.write(np.arange(6, dtype=np.uint16), frame_number=3, series_id=1)
+    assert writer.generation == 2
+    (entry,) = reader.read_new(copy=False)
+    assert entry.frame_number == 3
+    np.testing.assert_array_equal(entry.frame, np.arange(6))
+    assert reader.read_new() == []
+
+    del entry
+    reader.close()
+    writer.close()
+
+
+def test_frame_ring_reader_starts_from_new_frames():
+    writer = FrameRingWriter(ring_name())
+    writer.write(np.zeros(2), frame_number=0, series_id=1)
+
+    reader = FrameRingReader(writer.name, track=True)
+    assert reader.read_new() == []
+    latest = reader.latest()
+    assert latest is not None and latest.frame_number == 0
+
+    writer.write(np.zeros(2), frame_number=1, series_id=1)
+    assert [entry.frame_number for entry in reader.read_new()] == [1]
+
+    reader.close()
+    writer.close()
+
+
+def test_frame_ring_writer_does_not_remove_existing_shared_memory(ring: FrameRing):
+    ring.write(np.ones(2, dtype=np.uint16), frame_number=0, series_id=1)
+    writer = FrameRingWriter(ring.name)
+
+    writer.write(np.zeros(2, dtype=np.uint16), frame_number=5, series_id=2)
+    writer.write(np.zeros(2, dtype=np.uint16), frame_number=6, series_id=2)
+
+    assert writer.generation == 0
+    latest = ring.latest()
+    assert latest is not None and latest.frame_number == 0
+    writer.close()
+
+
+def test_frame_ring_name_includes_detector_host():
+    assert frame_ring_name("i03-eiger01", "monitor") == (
+        "fastcs_eiger_i03-eiger01_monitor"
+    )
+    assert frame_ring_name("fe80::1", "stream") == "fastcs_eiger_fe80__1_stream"
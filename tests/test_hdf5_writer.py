@@ -0,0 +1,166 @@
+import asyncio
+import struct
+import threading
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+from pytest_mock import MockerFixture
+
+from fastcs_eiger.hdf5_writer import Hdf5StreamWriter
+from fastcs_eiger.stream import CompressedArray, StreamMessage
+
+IMAGES = [
+    np.full((4, 6), i, dtype=np.uint16) + np.arange(6, dtype=np.uint16)
+    for i in range(3)
+]
+
+
+def bslz4(array: np.ndarray) -> CompressedArray:
+    bitshuffle = pytest.importorskip("bitshuffle")
+    data = (
+        struct.pack(">QI", array.nbytes, 8 * array.itemsize)
+        + bitshuffle.compress_lz4(array, 8).tobytes()
+    )
+    return CompressedArray("bslz4", array.dtype, array.shape, data)
+
+
+def test_writer_writes_compressed_chunks_directly(tmp_path: Path):
+    writer = Hdf5StreamWriter(tmp_path, name_pattern="test_$id", frames_per_file=2)
+    compressed = [bslz4(image) for image in IMAGES]
+    writer.write(
+        StreamMessage(
+            "start",
+            4,
+            metadata={
+                "count_time": 0.1,
+                "detector_description": "EIGER2 X 500K",
+                "threshold_energy": {"threshold_1": 6000.0},
+                "channels": ["threshold_1"],
+                "flatfield": {"threshold_1": compressed[0]},
+            },
+        )
+    )
+    for image_id, image in enumerate(compressed):
+        writer.write(StreamMessage("image", 4, image_id, data={"threshold_1": image}))
+    writer.write(StreamMessage("end", 4))
+
+    assert writer.frames_written == 3
+    assert writer.files_written == 2
+    with h5py.File(tmp_path / "test_4_data_000002.h5") as data_file:
+        dataset = data_file["entry/data/data"]
+        assert dataset.shape == (1, 4, 6) and dataset.chunks == (1, 4, 6)
+        # The chunk is the data from the stream
+        _, chunk = dataset.id.read_direct_chunk((0, 0, 0))
+        assert chunk == compressed[2].data
+
+    pytest.importorskip("bitshuffle.h5")
+    with h5py.File(tmp_path / "test_4_master.h5") as master:
+        detector = master["entry/instrument/detector"]
+        assert detector["count_time"][()] == 0.1
+        assert detector["detector_description"][()] == b"EIGER2 X 500K"
+        assert detector["threshold_energy/threshold_1"][()] == 6000
+        assert detector["channels"][()] == b'["threshold_1"]'
+        np.testing.assert_array_equal(detector["flatfield/threshold_1"], IMAGES[0])
+
+        data = master["entry/data"]
+        assert list(data) == ["data_000001", "data_000002"]
+        np.testing.assert_array_equal(
+            np.concatenate([data["data_000001"], data["data_000002"]]), IMAGES
+        )
+
+
+def test_writer_encodes_ragged_metadata_as_json(tmp_path: Path):
+    writer = Hdf5StreamWriter(tmp_path, name_pattern="test_$id")
+    writer.write(
+        StreamMessage(
+            "start",
+            5,
+            metadata={"count_time": 0.1, "roi_ranges": [[0, 1], [2, 3, 4]]},
+        )
+    )
+    writer.write(StreamMessage("end", 5))
+
+    with h5py.File(tmp_path / "test_5_master.h5") as master:
+        detector = master["entry/instrument/detector"]
+        assert detector["count_time"][()] == 0.1
+        assert detector["roi_ranges"][()] == b"[[0, 1], [2, 3, 4]]"
+
+
+def test_writer_chunks_uncompressed_channels(tmp_path: Path):
+    writer = Hdf5StreamWriter(tmp_path, frames_per_file=10, chunk_frames=4)
+    # The start of the series was missed
+    for image_id, image in enumerate(IMAGES):
+        writer.write(
+            StreamMessage(
+                "image",
+                2,
+                image_id,
+                data={"threshold_1": image, "threshold_2": image * 2},
+            )
+        )
+    writer.close()
+
+    with h5py.File(tmp_path / "series_2_master.h5") as master:
+        data = master["entry/data"]
+        assert list(data) == ["threshold_1_000001", "threshold_2_000001"]
+        assert data["threshold_1_000001"].chunks == (4, 4, 6)
+        np.testing.assert_array_equal(data["threshold_2_000001"], np.stack(IMAGES) * 2)
+
+
+@pytest.mark.asyncio
+async def test_writer_stop_writes_queued_messages(tmp_path: Path):
+    writer = Hdf5StreamWriter(tmp_path, frames_per_file=10)
+    messages = [
+        StreamMessage("start", 1),
+        *[
+            StreamMessage("image", 1, image_id, data={"threshold_1": image})
+            for image_id, image in enumerate(IMAGES)
+        ],
+        StreamMessage("end", 1),
+    ]
+    for message in messages:
+        await writer.put(message)
+    assert writer.queued == len(messages)
+
+    task = asyncio.create_task(writer.run())
+    await writer.stop()
+    await asyncio.wait_for(task, timeout=5)
+
+    assert writer.queued == 0
+    assert writer.frames_written == len(IMAGES)
+    with h5py.File(tmp_path / "series_1_master.h5") as master:
+        np.testing.assert_array_equal(master["entry/data/data_000001"], IMAGES)
+
+
+@pytest.mark.asyncio
+async def test_writer_cancel_finishes_write_before_closing(
+    tmp_path: Path, mocker: MockerFixture
+):
+    writer = Hdf5StreamWriter(tmp_path)
+    writing, release = threading.Event(), threading.Event()
+    write = writer.write
+
+    def slow_write(message: StreamMessage):
+        writing.set()
+        release.wait(5)
+        write(message)
+
+    mocker.patch.object(writer, "write", side_effect=slow_write)
+    close = mocker.spy(writer, "close")
+    await writer.put(StreamMessage("image", 1, 0, data={"threshold_1": IMAGES[0]}))
+    task = asyncio.create_task(writer.run())
+    await asyncio.to_thread(writing.wait, 5)
+
+    task.cancel()
+    await asyncio.sleep(0.05)
+    # Still writing in the thread, so the files are not closed under it
+    close.assert_not_called()
+
+    release.set()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(task, timeout=5)
+    assert writer.frames_written == 1
+    with h5py.File(tmp_path / "series_1_master.h5") as master:
+        np.testing.assert_array_equal(master["entry/data/data_000001"], IMAGES[:1])
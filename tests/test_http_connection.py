@@ -0,0 +1,214 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from fastcs.connections import IPConnectionSettings
+
+from fastcs_eiger.http_connection import (
+    ConnectionPoolSettings,
+    HTTPConnection,
+    HTTPRequestError,
+)
+
+
+@pytest_asyncio.fixture
+async def server():
+    requests: list[str] = []
+
+    async def handle_get(request: web.Request):
+        requests.append(request.path)
+        return web.json_response({"value": request.path})
+
+    async def handle_put(request: web.Request):
+        requests.append(f"PUT {request.path}")
+        return web.json_response([request.path.split("/")[-1]])
+
+    app = web.Application()
+    app.router.add_get("/{uri:.*}", handle_get)
+    app.router.add_put("/{uri:.*}", handle_put)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    yield IPConnectionSettings("127.0.0.1", port), requests
+
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_connection_pool(server):
+    settings, requests = server
+    connection = HTTPConnection(
+        settings, ConnectionPoolSettings(limit=2, keepalive_timeout=5, prewarm=2)
+    )
+    connection.open()
+
+    connector = connection.get_session().connector
+    assert connector is not None
+    assert connector.limit == 2
+    assert connector.limit_per_host == 2
+
+    await connection.prewarm("detector/api/version/")
+    assert requests == ["/detector/api/version/"] * 2
+
+    assert await connection.get("detector/api/1.8.0/status/state") == {
+        "value": "/detector/api/1.8.0/status/state"
+    }
+
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_prewarm_does_nothing_without_pool(server):
+    settings, requests = server
+    connection = HTTPConnection(settings)
+    connection.open()
+
+    await connection.prewarm("detector/api/version/")
+    assert requests == []
+
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_prewarm_times_out_and_ignores_failures():
+    async def never_respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Read until the client gives up and closes the connection
+        await reader.read()
+        writer.close()
+
+    unresponsive = await asyncio.start_server(never_respond, "127.0.0.1", 0)
+    port = unresponsive.sockets[0].getsockname()[1]
+    connection = HTTPConnection(
+        IPConnectionSettings("127.0.0.1", port),
+        ConnectionPoolSettings(prewarm=2, request_timeout=0.1),
+    )
+    connection.open()
+
+    await asyncio.wait_for(connection.prewarm("detector/api/version/"), timeout=1)
+
+    await connection.close()
+    unresponsive.close()
+    await unresponsive.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_gets_are_coalesced(server):
+    settings, requests = server
+    connection = HTTPConnection(settings)
+    connection.open()
+
+    uri = "detector/api/1.8.0/status/state"
+    responses = await asyncio.gather(*[connection.get(uri) for _ in range(5)])
+    assert responses == [{"value": f"/{uri}"}] * 5
+    assert requests == [f"/{uri}"]
+
+    # Once the first request completes, the next get makes a new request
+    await connection.get(uri)
+    assert requests == [f"/{uri}"] * 2
+
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_get_after_put_is_not_coalesced(server):
+    settings, requests = server
+    connection = HTTPConnection(settings)
+    connection.open()
+
+    uri = "detector/api/1.8.0/config/photon_energy"
+    first = asyncio.ensure_future(connection.get(uri))
+    await asyncio.sleep(0)
+    assert uri in connection._pending_gets
+
+    # A PUT lands while the first GET is in flight
+    assert await connection.put(uri, 9000) == ["photon_energy"]
+    second = asyncio.ensure_future(connection.get(uri))
+
+    await asyncio.gather(first, second)
+    assert requests.count(f"/{uri}") == 2
+    assert connection._pending_gets == {}
+
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_get_many_limits_requests_in_flight(server, mocker):
+    settings, requests = server
+    connection = HTTPConnection(settings, ConnectionPoolSettings(bulk_window=2))
+    connection.open()
+
+    in_flight = 0
+    max_in_flight = 0
+    get = connection._get
+
+    async def counting_get(uri: str):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            return await get(uri)
+        finally:
+            in_flight -= 1
+
+    mocker.patch.object(connection, "_get", side_effect=counting_get)
+
+    uris = [f"detector/api/1.8.0/status/{key}" for key in "abcdef"]
+    responses = await connection.get_many(uris)
+    assert responses == [{"value": f"/{uri}"} for uri in uris]
+    assert max_in_flight == 2
+
+    await connection.get_many(uris[:2], window=1)
+    assert max_in_flight == 2
+
+    stats = connection.bulk_stats
+    assert stats.requests == 8
+    assert stats.throughput > 0
+    assert stats.max_latency >= stats.mean_latency > 0
+
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_download_streams_to_file(tmp_path):
+    content = bytes(range(256)) * 100
+
+    async def handle_data(request: web.Request):
+        if request.match_info["filename"] == "missing.h5":
+            raise web.HTTPNotFound()
+        return web.Response(body=content)
+
+    app = web.Application()
+    app.router.add_get("/data/{filename}", handle_data)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    connection = HTTPConnection(
+        IPConnectionSettings("127.0.0.1", runner.addresses[0][1])
+    )
+    connection.open()
+
+    progress: list[tuple[int, int | None]] = []
+    path = tmp_path / "series_1_data_000001.h5"
+    written = await connection.download(
+        "data/series_1_data_000001.h5",
+        path,
+        chunk_size=4096,
+        on_progress=lambda *args: progress.append(args),
+    )
+
+    assert written == len(content)
+    assert path.read_bytes() == content
+    assert len(progress) > 1
+    assert progress[-1] == (len(content), len(content))
+
+    with pytest.raises(HTTPRequestError):
+        await connection.download("data/missing.h5", tmp_path / "missing.h5")
+    assert [path.name for path in tmp_path.iterdir()] == [path.name]
+
+    await connection.close()
+    await runner.cleanup()
@@ -1,7 +1,11 @@
+import numpy as np
 import pytest
+from fastcs.attributes import AttrRW
 from pytest_mock import MockerFixture
 
-from fastcs_eiger.io import EigerAttributeIO
+from fastcs_eiger.eiger_parameter import EigerParameterRef, EigerParameterResponse
+from fastcs_eiger.image import decode_tiff, encode_tiff
+from fastcs_eiger.io import TIFF_CONTENT_TYPE, EigerAttributeIO
 
 
 @pytest.mark.asyncio
@@ -9,6 +13,8 @@ async def test_update(mocker: MockerFixture):
     connection_mock = mocker.AsyncMock()
     io = EigerAttributeIO(connection_mock, mocker.MagicMock(), mocker.MagicMock())
     attr = mocker.AsyncMock()
+    attr.io_ref.is_array = False
+    attr.io_ref.index = None
 
     connection_mock.get.return_value = {"value": 1}
     await io.update(attr)
@@ -19,3 +25,52 @@ async def test_update(mocker: MockerFixture):
     await io.update(attr)
 
     attr.update.assert_called_with(attr.datatype.initial_value)
+
+
+@pytest.mark.asyncio
+async def test_array_parameters_transferred_as_tiff(mocker: MockerFixture):
+    connection_mock = mocker.AsyncMock()
+    queue_update = mocker.AsyncMock()
+    io = EigerAttributeIO(connection_mock, mocker.AsyncMock(), queue_update)
+    ref = EigerParameterRef(
+        key="pixel_mask",
+        subsystem="detector",
+        mode="config",
+        response=EigerParameterResponse(value=None, value_type="uint"),
+        shape=(4, 6),
+    )
+    attr = AttrRW(ref.fastcs_datatype, io_ref=ref)
+    mask = np.zeros((4, 6), dtype=np.uint32)
+    mask[1, 2] = 1
+
+    connection_mock.get_bytes.return_value = (
+        mocker.MagicMock(status=200),
+        bytes(encode_tiff(mask)),
+    )
+    await io.update(attr)
+    assert attr.datatype.shape == (24,)
+    np.testing.assert_array_equal(attr.get(), mask.reshape(-1))
+    connection_mock.get_bytes.assert_awaited_once_with(ref.uri, TIFF_CONTENT_TYPE)
+    connection_mock.get.assert_not_awaited()
+    assert not io.array_stale(attr)
+
+    # The detector already has this mask
+    await io.send(attr, mask.reshape(-1).copy())
+    connection_mock.put_bytes.assert_not_awaited()
+    assert io.skipped_array_uploads == 1
+
+    new_mask = mask.copy()
+    new_mask[3, 5] = 1
+    connection_mock.put_bytes.return_value = ["pixel_mask", "pixel_mask_applied"]
+    await io.send(attr, new_mask.reshape(-1))
+    uri, data, content_type = connection_mock.put_bytes.await_args.args
+    assert (uri, content_type) == (ref.uri, TIFF_CONTENT_TYPE)
+    np.testing.assert_array_equal(decode_tiff(bytes(data)), new_mask)
+    # The mask is not read back, but other changed parameters are
+    np.testing.assert_array_equal(attr.get(), new_mask.reshape(-1))
+    queue_update.assert_awaited_once_with(["pixel_mask_applied"])
+
+    io.invalidate_array(attr)
+    assert io.array_stale(attr)
+    await io.send(attr, new_mask.reshape(-1))
+    assert connection_mock.put_bytes.await_count == 2
@@ -0,0 +1,135 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastcs.transports.epics.ca import ioc
+from pytest_mock import MockerFixture
+
+from fastcs_eiger.controllers.eiger_detector_controller import EigerDetectorController
+from fastcs_eiger.eiger_parameter import EigerParameterRef, EigerParameterResponse
+from fastcs_eiger.image import decode_tiff, encode_tiff
+from fastcs_eiger.pixel_mask import merge_pixel_mask
+
+
+def test_merge_pixel_mask_sets_and_clears_flags():
+    mask = np.zeros((4, 6), dtype=np.uint32)
+    mask.flat[[3, 7]] = [1, 2]  # masked and another flag, e.g. a dead pixel
+    mask.setflags(write=False)
+
+    merged = merge_pixel_mask(mask, add=[3, 10, 10], remove=np.array([7, 4]))
+    assert merged is not None
+    merged_mask, changed = merged
+    assert changed == 1
+    assert merged_mask.flat[10] == 1 and merged_mask.flat[7] == 2
+    assert mask.flat[10] == 0
+
+    merged_mask, changed = merge_pixel_mask(mask, remove=[7], flags=2) or (None, 0)
+    assert changed == 1 and merged_mask is not None and merged_mask.flat[7] == 0
+
+    # Already masked, or not masked
+    assert merge_pixel_mask(mask, add=[3], remove=[7, 0]) is None
+
+    with pytest.raises(IndexError):
+        merge_pixel_mask(mask, add=[24])
+    with pytest.raises(ValueError):
+        merge_pixel_mask(mask, add=[1], remove=[1])
+
+
+@pytest.mark.asyncio
+async def test_update_pixel_mask_puts_only_changes():
+    connection = mock.AsyncMock()
+    mask = np.zeros((4, 6), dtype=np.uint32)
+    connection.get_bytes.return_value = (
+        mock.MagicMock(status=200),
+        bytes(encode_tiff(mask)),
+    )
+    connection.put_bytes.return_value = ["pixel_mask"]
+    controller = EigerDetectorController(connection, mock.AsyncMock(), "1.8.0")
+    await controller.initialise(
+        [
+            EigerParameterRef(
+                key="pixel_mask",
+                subsystem="detector",
+                mode="config",
+                response=EigerParameterResponse(value=None, value_type="uint"),
+                shape=(4, 6),
+            )
+        ]
+    )
+
+    assert await controller.update_pixel_mask(add=[1, 2]) == 2
+    assert await controller.update_pixel_mask(add=[2], remove=[1]) == 1
+    # The mask is read once and the cached copy is used after that
+    connection.get_bytes.assert_awaited_once()
+    assert connection.put_bytes.await_count == 2
+    np.testing.assert_array_equal(
+        decode_tiff(bytes(connection.put_bytes.await_args.args[1])).flat[:3], [0, 0, 1]
+    )
+
+    assert await controller.update_pixel_mask(add=[2]) == 0
+    assert connection.put_bytes.await_count == 2
+    assert controller.mask_puts.get() == 2
+    assert controller.mask_puts_skipped.get() == 1
+    assert controller.mask_pixels_changed.get() == 0
+    assert controller.mask_update_duration.get() >= 0
+
+    with pytest.raises(ValueError):
+        await controller.update_pixel_mask(add=[1], key="threshold/1/pixel_mask")
+
+
+@pytest.mark.asyncio
+async def test_apply_pixel_mask_changes_from_attributes(mocker: MockerFixture):
+    connection = mock.AsyncMock()
+    connection.get_bytes.return_value = (
+        mock.MagicMock(status=200),
+        bytes(encode_tiff(np.zeros((4, 6), dtype=np.uint32))),
+    )
+    connection.put_bytes.return_value = ["pixel_mask"]
+    controller = EigerDetectorController(connection, mock.AsyncMock(), "1.8.0")
+    await controller.initialise(
+        [
+            EigerParameterRef(
+                key="pixel_mask",
+                subsystem="detector",
+                mode="config",
+                response=EigerParameterResponse(value=None, value_type="uint"),
+                shape=(4, 6),
+            )
+        ]
+    )
+
+    # Nothing to change until pixels are written to the lists
+    await controller.apply_pixel_mask_changes()
+    connection.put_bytes.assert_not_awaited()
+
+    await controller.mask_pixels_to_add.put(np.array([5, 23], dtype=np.int32))
+    await controller.apply_pixel_mask_changes()
+    mask = decode_tiff(bytes(connection.put_bytes.await_args.args[1]))
+    assert list(np.flatnonzero(mask)) == [5, 23]
+    assert controller.mask_pixels_to_add.get().size == 0
+
+    await controller.mask_pixels_to_add.put(np.array([1], dtype=np.int32))
+    await controller.mask_pixels_to_remove.put(np.array([5], dtype=np.int32))
+    await controller.apply_pixel_mask_changes()
+    mask = decode_tiff(bytes(connection.put_bytes.await_args.args[1]))
+    assert list(np.flatnonzero(mask)) == [1, 23]
+    assert controller.mask_pixels_changed.get() == 2
+
+    # Invalid changes are kept to be corrected
+    await controller.mask_pixels_to_add.put(np.array([24], dtype=np.int32))
+    with pytest.raises(IndexError):
+        await controller.apply_pixel_mask_changes()
+    assert list(controller.mask_pixels_to_add.get()) == [24]
+
+    read_pv = mocker.patch.object(ioc, "_create_and_link_read_pv")
+    mocker.patch.object(ioc, "_create_and_link_write_pv")
+    command_pv = mocker.patch.object(ioc, "_create_and_link_command_pv")
+    api = controller._build_api([])
+    ioc._create_and_link_attribute_pvs("EIGER", api)
+    ioc._create_and_link_command_pvs("EIGER", api)
+    assert {"MaskPixelsToAdd_RBV", "MaskPixelsToRemove_RBV", "PixelMask_RBV"} <= {
+        call.args[1] for call in read_pv.call_args_list
+    }
+    assert "ApplyPixelMaskChanges" in {
+        call.args[1] for call in command_pv.call_args_list
+    }
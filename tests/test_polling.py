@@ -0,0 +1,242 @@
+import asyncio
+
+import pytest
+from fastcs.attributes import AttrR
+from fastcs.connections import IPConnectionSettings
+from pytest_mock import MockerFixture
+
+from fastcs_eiger.eiger_parameter import EigerParameterRef, EigerParameterResponse
+from fastcs_eiger.http_connection import HTTPConnection
+from fastcs_eiger.io import EigerAttributeIO
+from fastcs_eiger.polling import STATUS_POLL_PERIOD, PollThrottle, StatusPoller
+
+
+@pytest.fixture
+def connection(mocker: MockerFixture) -> HTTPConnection:
+    connection = HTTPConnection(IPConnectionSettings("127.0.0.1", 8081))
+    mocker.patch.object(connection, "get")
+    return connection
+
+
+def _status_attribute(key: str) -> AttrR:
+    ref = EigerParameterRef(
+        key=key,
+        subsystem="detector",
+        mode="status",
+        response=EigerParameterResponse(value=0.0, value_type="float"),
+        update_period=None,
+    )
+    return AttrR(ref.fastcs_datatype, io_ref=ref)
+
+
+@pytest.mark.asyncio
+async def test_poll_limits_concurrency_and_updates_together(
+    connection, mocker: MockerFixture
+):
+    in_flight = 0
+    max_in_flight = 0
+
+    async def get(uri: str):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return {"value": 1.5}
+
+    connection.get.side_effect = get
+    io = EigerAttributeIO(connection, mocker.AsyncMock(), mocker.AsyncMock())
+    poller = StatusPoller(io)
+
+    attributes = [_status_attribute(f"temperature_{i}") for i in range(10)]
+    for attr in attributes:
+        poller.add_attribute(attr)
+
+    await poller.poll(max_concurrency=3)
+
+    assert max_in_flight == 3
+    assert connection.get.await_count == 10
+    assert all(attr.get() == 1.5 for attr in attributes)
+    assert poller.last_count == 10
+    assert poller.max_duration >= poller.last_duration > 0
+
+
+@pytest.mark.asyncio
+async def test_poll_keeps_value_of_parameter_that_fails(
+    connection, mocker: MockerFixture
+):
+    humidity = _status_attribute("humidity")
+    temperature = _status_attribute("temperature")
+
+    async def get(uri: str):
+        if uri == humidity.io_ref.uri:
+            raise TimeoutError()
+        return {"value": 20.0}
+
+    connection.get.side_effect = get
+    io = EigerAttributeIO(connection, mocker.AsyncMock(), mocker.AsyncMock())
+    poller = StatusPoller(io)
+    poller.add_attribute(humidity)
+    poller.add_attribute(temperature)
+    await humidity.update(50.0)
+
+    time_mock = mocker.patch("fastcs_eiger.polling.time").monotonic
+    time_mock.return_value = 0
+    await poller.poll(2)
+
+    assert humidity.get() == 50.0
+    assert temperature.get() == 20.0
+
+    # Polled again on the next sweep
+    connection.get.side_effect = None
+    connection.get.return_value = {"value": 45.0}
+    time_mock.return_value = 0.2
+    await poller.poll(2)
+    assert poller.last_count == 2
+    assert humidity.get() == 45.0
+
+
+@pytest.mark.asyncio
+async def test_adaptive_poll_backs_off_and_resets(connection, mocker: MockerFixture):
+    connection.get.return_value = {"value": 20.0}
+    io = EigerAttributeIO(connection, mocker.AsyncMock(), mocker.AsyncMock())
+    poller = StatusPoller(io)
+    attr = _status_attribute("temperature")
+    poller.add_attribute(attr)
+
+    time_mock = mocker.patch("fastcs_eiger.polling.time").monotonic
+
+    # First poll changes the value from its initial value
+    time_mock.return_value = 0
+    await poller.poll(1, adaptive=True, max_period=1)
+    assert poller.period("temperature") == STATUS_POLL_PERIOD
+
+    # Unchanged value backs off until the maximum period
+    periods = []
+    for now in [0.2, 0.7, 1.6, 2.7, 3.8]:
+        time_mock.return_value = now
+        await poller.poll(1, adaptive=True, max_period=1)
+        periods.append(poller.period("temperature"))
+    assert periods == [0.4, 0.8, 1, 1, 1]
+    assert connection.get.await_count == 6
+
+    # Not due until the backed off period has passed
+    time_mock.return_value = 4.5
+    await poller.poll(1, adaptive=True, max_period=1)
+    assert poller.last_count == 0
+
+    # A changed value goes straight back to the fastest rate
+    connection.get.return_value = {"value": 25.0}
+    time_mock.return_value = 4.9
+    await poller.poll(1, adaptive=True, max_period=1)
+    assert poller.period("temperature") == STATUS_POLL_PERIOD
+
+    connection.get.return_value = {"value": 25.0}
+    time_mock.return_value = 5.2
+    await poller.poll(1, adaptive=True, max_period=1)
+    assert poller.period("temperature") == 0.4
+
+    poller.reset()
+    assert poller.period("temperature") == STATUS_POLL_PERIOD
+    time_mock.return_value = 5.3
+    await poller.poll(1, adaptive=True, max_period=1)
+    assert poller.last_count == 1
+
+
+@pytest.mark.asyncio
+async def test_adaptive_poll_schedules_split_parameters_separately(
+    connection, mocker: MockerFixture
+):
+    io = EigerAttributeIO(connection, mocker.AsyncMock(), mocker.AsyncMock())
+    poller = StatusPoller(io)
+    for index in range(2):
+        ref = EigerParameterRef(
+            key="buffer_fill_level",
+            subsystem="stream",
+            mode="status",
+            response=EigerParameterResponse(value=[0, 100], value_type="int"),
+            update_period=None,
+            index=index,
+        )
+        poller.add_attribute(AttrR(ref.fastcs_datatype, io_ref=ref))
+
+    time_mock = mocker.patch("fastcs_eiger.polling.time").monotonic
+    # Only the fill level changes, the maximum stays the same
+    for now, level in [(0, 10), (0.2, 20), (0.4, 30)]:
+        connection.get.return_value = {"value": [level, 100]}
+        time_mock.return_value = now
+        await poller.poll(1, adaptive=True, max_period=5)
+
+    assert poller.period("buffer_fill_level") == STATUS_POLL_PERIOD
+    assert poller.period("buffer_fill_level_max") == 0.4
+    assert [attr.get() for attr in poller.attributes] == [30, 100]
+
+
+@pytest.mark.asyncio
+async def test_throttled_poll_skips_parameters_not_kept(
+    connection, mocker: MockerFixture
+):
+    connection.get.return_value = {"value": 1.0}
+    io = EigerAttributeIO(connection, mocker.AsyncMock(), mocker.AsyncMock())
+    poller = StatusPoller(io)
+    state, humidity = _status_attribute("state"), _status_attribute("humidity")
+    poller.add_attribute(state)
+    poller.add_attribute(humidity)
+
+    time_mock = mocker.patch("fastcs_eiger.polling.time").monotonic
+    time_mock.return_value = 0
+
+    poller.throttle = PollThrottle(None, frozenset({"state"}))
+    await poller.poll(1)
+    assert poller.last_count == 1
+    assert poller.saved_requests == 1
+    connection.get.assert_awaited_once_with(state.io_ref.uri)
+
+    poller.throttle = PollThrottle(1.0, frozenset({"state"}))
+    time_mock.return_value = 0.5
+    await poller.poll(1)
+    # humidity has never been polled, so is due
+    assert poller.last_count == 2
+    time_mock.return_value = 1.0
+    await poller.poll(1)
+    assert poller.last_count == 1
+    assert poller.saved_requests == 2
+
+    # The skipped poll is only counted once, until humidity is due again
+    for now in [1.2, 1.4]:
+        time_mock.return_value = now
+        await poller.poll(1)
+        assert poller.saved_requests == 2
+    time_mock.return_value = 1.5
+    await poller.poll(1)
+    connection.get.assert_awaited_with(humidity.io_ref.uri)
+    assert poller.saved_requests == 2
+
+
+@pytest.mark.asyncio
+async def test_adaptive_poll_does_not_back_off_state_or_kept_parameters(
+    connection, mocker: MockerFixture
+):
+    connection.get.return_value = {"value": 1.0}
+    io = EigerAttributeIO(connection, mocker.AsyncMock(), mocker.AsyncMock())
+    poller = StatusPoller(io)
+    for key in ("state", "error", "humidity"):
+        poller.add_attribute(_status_attribute(key))
+
+    time_mock = mocker.patch("fastcs_eiger.polling.time").monotonic
+    poller.throttle = PollThrottle(1.0, frozenset({"state", "error"}))
+    for now in [0, 0.2, 0.4, 0.6, 1.0]:
+        time_mock.return_value = now
+        await poller.poll(1, adaptive=True, max_period=5)
+
+    # A steady state is still polled every sweep, so the end of an acquisition is
+    # seen straight away
+    assert poller.period("state") == STATUS_POLL_PERIOD
+    assert poller.period("error") == STATUS_POLL_PERIOD
+    assert poller.period("humidity") > STATUS_POLL_PERIOD
+
+    poller.throttle = None
+    time_mock.return_value = 1.2
+    await poller.poll(1, adaptive=True, max_period=5)
+    assert poller.period("state") == STATUS_POLL_PERIOD
+    assert poller.period("error") == 0.4
@@ -0,0 +1,75 @@
+from fastcs_eiger.eiger_parameter import EigerParameterRef, EigerParameterResponse
+from fastcs_eiger.schema_cache import SchemaCache, schema_diff, serialise_parameters
+
+
+def test_serialise_parameters_excludes_value():
+    ref = EigerParameterRef(
+        key="photon_energy",
+        subsystem="detector",
+        mode="config",
+        response=EigerParameterResponse(
+            access_mode="rw", min=0.01, value=8000.0, value_type="float"
+        ),
+    )
+
+    assert serialise_parameters([ref]) == [
+        {
+            "mode": "config",
+            "key": "photon_energy",
+            "response": {"access_mode": "rw", "min": 0.01, "value_type": "float"},
+        }
+    ]
+
+
+def test_schema_cache_round_trip(tmp_path):
+    cache = SchemaCache(tmp_path / "cache", "127.0.0.1:8081", "1.8.0", "1.8.0 (rc1)")
+    assert cache.path.name == "127.0.0.1_8081_1.8.0_1.8.0__rc1_.json"
+    assert cache.load() is None
+
+    schema = {
+        "detector": [
+            {"mode": "status", "key": "state", "response": {"value_type": "string"}}
+        ]
+    }
+    cache.save(schema)
+    assert cache.load() == schema
+
+    cache.path.write_text("not json")
+    assert cache.load() is None
+
+
+def test_schema_diff():
+    state = {"mode": "status", "key": "state", "response": {"value_type": "string"}}
+    humidity = {
+        "mode": "status",
+        "key": "humidity",
+        "response": {"value_type": "float"},
+    }
+
+    assert schema_diff({"detector": [state]}, {"detector": [state]}) == []
+    assert schema_diff({"detector": [state]}, {"detector": [state, humidity]}) == [
+        "detector/status/humidity"
+    ]
+    assert schema_diff(
+        {"detector": [state]},
+        {"detector": [{**state, "response": {"value_type": "State"}}]},
+    ) == ["detector/status/state"]
+
+
+def test_serialise_split_list_parameters():
+    refs = [
+        EigerParameterRef(
+            key="buffer_fill_level",
+            subsystem="stream",
+            mode="status",
+            response=EigerParameterResponse(value=[1, 10], value_type="uint"),
+            index=index,
+        )
+        for index in range(2)
+    ]
+
+    schema = serialise_parameters(refs)
+    assert [parameter["index"] for parameter in schema] == [0, 1]
+    assert schema_diff({"stream": schema}, {"stream": schema[:1]}) == [
+        "stream/status/buffer_fill_level/1"
+    ]
@@ -0,0 +1,454 @@
+import asyncio
+import json
+import struct
+import threading
+import uuid
+from unittest import mock
+
+import h5py
+import numpy as np
+import pytest
+from pytest_mock import MockerFixture
+
+from fastcs_eiger.controllers.eiger_stream_controller import EigerStreamController
+from fastcs_eiger.frame_ring import FrameRing, FrameRingReader
+from fastcs_eiger.stream import (
+    CborDecoder,
+    CompressedArray,
+    StreamConsumer,
+    StreamMessage,
+    StreamReceiver,
+    StreamStatistics,
+    decode_images,
+)
+from fastcs_eiger.stream_worker import StreamWorker, _Counter
+
+zmq = pytest.importorskip("zmq")
+cbor2 = pytest.importorskip("cbor2")
+
+
+@pytest.fixture
+def publisher():
+    """Stand-in for the stream interface of a detector."""
+    socket = zmq.Context.instance().socket(zmq.PUSH)
+    port = socket.bind_to_random_port("tcp://127.0.0.1")
+    yield socket, f"tcp://127.0.0.1:{port}"
+    socket.close(linger=0)
+
+
+def legacy_messages(series: int, frames: list[int]) -> list[list[bytes]]:
+    return (
+        [[json.dumps({"htype": "dheader-1.0", "series": series}).encode()]]
+        + [
+            [
+                json.dumps(
+                    {"htype": "dimage-1.0", "series": series, "frame": frame}
+                ).encode(),
+                json.dumps({"htype": "dimage_d-1.0", "shape": [4, 2]}).encode(),
+                bytes(32),
+                json.dumps({"htype": "dconfig-1.0"}).encode(),
+            ]
+            for frame in frames
+        ]
+        + [[json.dumps({"htype": "dseries_end-1.0", "series": series}).encode()]]
+    )
+
+
+def cbor_messages(
+    series: int, frames: list[int], data: object = None
+) -> list[list[bytes]]:
+    return (
+        [[cbor2.dumps({"type": "start", "series_id": series})]]
+        + [
+            [
+                cbor2.dumps(
+                    {
+                        "type": "image",
+                        "series_id": series,
+                        "image_id": frame,
+                        "data": {} if data is None else {"threshold_1": data},
+                    }
+                )
+            ]
+            for frame in frames
+        ]
+        + [[cbor2.dumps({"type": "end", "series_id": series})]]
+    )
+
+
+def image_message(data: object) -> list[memoryview]:
+    return [
+        memoryview(
+            cbor2.dumps(
+                {
+                    "type": "image",
+                    "series_id": 1,
+                    "image_id": 0,
+                    "data": {"threshold_1": data},
+                }
+            )
+        )
+    ]
+
+
+def multi_dimensional_array(shape: tuple[int, ...], contents: object):
+    return cbor2.CBORTag(40, [list(shape), contents])
+
+
+IMAGE = np.arange(24, dtype=np.uint16).reshape(4, 6)
+
+
+def test_cbor_decoder_typed_array():
+    message = CborDecoder().decode(
+        image_message(
+            multi_dimensional_array((4, 6), cbor2.CBORTag(69, IMAGE.tobytes()))
+        )
+    )
+
+    assert message is not None
+    image = message.data["threshold_1"]
+    assert isinstance(image, np.ndarray) and image.dtype == np.dtype("<u2")
+    assert not image.flags.owndata
+    np.testing.assert_array_equal(image, IMAGE)
+
+
+def test_cbor_decoder_uses_bit_depth_for_untyped_data():
+    decoder = CborDecoder()
+    decoder.decode(
+        [
+            memoryview(
+                cbor2.dumps({"type": "start", "series_id": 1, "bit_depth_image": 16})
+            )
+        ]
+    )
+
+    message = decoder.decode(
+        image_message(multi_dimensional_array((4, 6), IMAGE.tobytes()))
+    )
+
+    assert message is not None
+    np.testing.assert_array_equal(message.data["threshold_1"], IMAGE)
+
+
+def bslz4(array: np.ndarray, block_size: int = 8) -> bytes:
+    bitshuffle = pytest.importorskip("bitshuffle")
+    return (
+        struct.pack(">QI", array.nbytes, block_size * array.itemsize)
+        + bitshuffle.compress_lz4(array, block_size).tobytes()
+    )
+
+
+def lz4(array: np.ndarray, block_size: int = 16) -> bytes:
+    lz4_block = pytest.importorskip("lz4.block")
+    data = array.tobytes()
+    blocks = [
+        lz4_block.compress(data[i : i + block_size], store_size=False)
+        for i in range(0, len(data), block_size)
+    ]
+    return struct.pack(">QI", len(data), block_size) + b"".join(
+        struct.pack(">I", len(block)) + block for block in blocks
+    )
+
+
+@pytest.mark.parametrize("algorithm, compress", [("bslz4", bslz4), ("lz4", lz4)])
+def test_cbor_decoder_compressed(algorithm, compress):
+    compressed = cbor2.CBORTag(56500, [algorithm, 2, compress(IMAGE)])
+    message = CborDecoder().decode(
+        image_message(multi_dimensional_array((4, 6), cbor2.CBORTag(69, compressed)))
+    )
+
+    assert message is not None
+    array = message.data["threshold_1"]
+    assert isinstance(array, CompressedArray)
+    assert array.algorithm == algorithm and array.dtype == np.dtype("<u2")
+
+    np.testing.assert_array_equal(decode_images(message.data)["threshold_1"], IMAGE)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "stream_format, messages",
+    [("legacy", legacy_messages), ("cbor", cbor_messages)],
+)
+async def test_receiver_parses_messages(publisher, stream_format, messages):
+    socket, endpoint = publisher
+    receiver = StreamReceiver(endpoint, stream_format)
+    for message in messages(3, [0, 1]):
+        socket.send_multipart(message)
+
+    received = [await asyncio.wait_for(receiver.receive(), timeout=5) for _ in range(4)]
+    receiver.close()
+
+    assert [(m.type, m.series_id, m.image_id) for m in received] == [
+        ("start", 3, None),
+        ("image", 3, 0),
+        ("image", 3, 1),
+        ("end", 3, None),
+    ]
+    assert all(message.size > 0 for message in received)
+
+
+def test_statistics_count_missing_frames():
+    statistics = StreamStatistics()
+    for message in [
+        StreamMessage("start", 1),
+        StreamMessage("image", 1, 0, 10),
+        StreamMessage("image", 1, 3, 10),
+        StreamMessage("image", 1, 4, 10),
+        StreamMessage("end", 1),
+        # Start of the next series missed
+        StreamMessage("image", 2, 1, 10),
+    ]:
+        statistics.add(message)
+
+    assert statistics.frames_received == 4
+    assert statistics.bytes_received == 40
+    assert statistics.missing_frames == 3
+    assert statistics.series_id == 2
+    assert not statistics.series_ended
+
+
+@pytest.mark.asyncio
+async def test_stream_controller_consumes_stream(publisher, mocker: MockerFixture):
+    socket, endpoint = publisher
+    connection = mocker.MagicMock()
+
+    async def get(uri: str):
+        if uri.endswith("/keys"):
+            return []
+        return {"value": "cbor"}
+
+    connection.get = mock.AsyncMock(side_effect=get)
+    connection.get_many = mock.AsyncMock(return_value=[])
+    connection.ip = "127.0.0.1"
+    controller = EigerStreamController(connection, mock.AsyncMock(), "1.8.0")
+    await controller.initialise()
+    assert controller.frame_ring_name.get() == "fastcs_eiger_127.0.0.1_stream"
+
+    await controller.stream_endpoint.put(endpoint)
+    await controller.consume.put(True)
+    for message in cbor_messages(7, [0, 1, 2, 5]):
+        socket.send_multipart(message)
+    for _ in range(50):
+        if controller._consumer.statistics.series_ended:
+            break
+        await asyncio.sleep(0.1)
+
+    await controller.update_stream_statistics()
+    assert controller.frames_received.get() == 4
+    assert controller.missing_frames.get() == 2
+    assert controller.series_id.get() == 7
+    assert controller.series_ended.get()
+    assert controller.frames_per_second.get() > 0
+
+    await controller.consume.put(False)
+    assert controller._consumer_task is None
+
+
+@pytest.mark.asyncio
+async def test_stream_controller_disables_consume_when_consumer_fails(
+    mocker: MockerFixture,
+):
+    connection = mocker.MagicMock()
+    connection.get = mock.AsyncMock(return_value={"value": "cbor"})
+    controller = EigerStreamController(connection, mock.AsyncMock(), "1.8.0")
+    controller.consume.add_on_update_callback(controller._update_consumer)
+    mocker.patch(
+        "fastcs_eiger.controllers.eiger_stream_controller.StreamReceiver",
+        autospec=True,
+    )
+    run = mocker.patch.object(
+        StreamConsumer, "run", mock.AsyncMock(side_effect=RuntimeError("failed"))
+    )
+
+    await controller.consume.put(True)
+    for _ in range(50):
+        if not controller.consume.get():
+            break
+        await asyncio.sleep(0.01)
+
+    assert not controller.consume.get()
+    assert controller._consumer_task is None
+
+    # A consumer that has exited is replaced when consume is enabled again
+    await controller.consume.put(True)
+    await asyncio.sleep(0.01)
+    assert run.await_count == 2
+    await controller.consume.put(False)
+
+
+@pytest.mark.asyncio
+async def test_stream_controller_decimates_decoding(publisher, mocker: MockerFixture):
+    socket, endpoint = publisher
+    connection = mocker.MagicMock()
+    connection.get = mock.AsyncMock(return_value={"value": "cbor"})
+    connection.get_many = mock.AsyncMock(return_value=[])
+    controller = EigerStreamController(connection, mock.AsyncMock(), "1.8.0")
+    await controller.stream_endpoint.put(endpoint)
+    await controller.decimation.put(2)
+    controller.consume.add_on_update_callback(controller._update_consumer)
+    controller.decimation.add_on_update_callback(controller._update_decimation)
+
+    await controller.frame_ring_name.put(f"test_stream_{uuid.uuid4().hex[:8]}")
+    controller.frame_ring.add_on_update_callback(controller._update_frame_ring)
+    await controller.frame_ring.put(True)
+    reader = FrameRingReader(controller.frame_ring_name.get(), track=True)
+
+    await controller.consume.put(True)
+    data = multi_dimensional_array((4, 6), cbor2.CBORTag(69, IMAGE.tobytes()))
+    for message in cbor_messages(1, [0, 1, 2, 3, 4], data):
+        socket.send_multipart(message)
+    for _ in range(50):
+        consumer = controller._consumer
+        if consumer.statistics.series_ended and not consumer.decoding:
+            break
+        await asyncio.sleep(0.1)
+
+    await controller.update_stream_statistics()
+    assert controller.frames_received.get() == 5
+    assert controller.decoded_frames.get() + controller.skipped_decodes.get() == 3
+    assert controller.total_counts.get() == IMAGE.sum()
+    np.testing.assert_array_equal(controller.latest_images["threshold_1"], IMAGE)
+    entries = reader.read_new()
+    assert len(entries) == controller.decoded_frames.get()
+    assert all(entry.frame_number % 2 == 0 for entry in entries)
+    np.testing.assert_array_equal(entries[-1].frame, IMAGE)
+
+    await controller.consume.put(False)
+    reader.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_controller_worker_process(publisher, mocker: MockerFixture):
+    socket, endpoint = publisher
+    connection = mocker.MagicMock()
+    connection.get = mock.AsyncMock(return_value={"value": "cbor"})
+    controller = EigerStreamController(connection, mock.AsyncMock(), "1.8.0")
+    controller.consume.add_on_update_callback(controller._update_consumer)
+    await controller.stream_endpoint.put(endpoint)
+    await controller.worker_process.put(True)
+
+    await controller.consume.put(True)
+    assert isinstance(controller._consumer, StreamWorker)
+    data = multi_dimensional_array((4, 6), cbor2.CBORTag(69, IMAGE.tobytes()))
+    for message in cbor_messages(2, [0, 1, 2], data):
+        socket.send_multipart(message)
+    for _ in range(100):
+        await controller.update_stream_statistics()
+        decodes = controller.decoded_frames.get() + controller.skipped_decodes.get()
+        if controller.series_ended.get() and decodes == 3:
+            break
+        await asyncio.sleep(0.1)
+
+    assert controller.frames_received.get() == 3
+    assert controller.series_id.get() == 2
+    assert controller.total_counts.get() == IMAGE.sum()
+
+    await controller.consume.put(False)
+    assert not controller._consumer._process.is_alive()
+
+
+@pytest.mark.asyncio
+async def test_stream_controller_writes_files(
+    publisher, mocker: MockerFixture, tmp_path
+):
+    socket, endpoint = publisher
+    connection = mocker.MagicMock()
+    connection.get = mock.AsyncMock(return_value={"value": "cbor"})
+    controller = EigerStreamController(connection, mock.AsyncMock(), "1.8.0")
+    controller.consume.add_on_update_callback(controller._update_consumer)
+    await controller.stream_endpoint.put(endpoint)
+    await controller.write_files.put(True)
+    await controller.file_directory.put(str(tmp_path))
+    await controller.frames_per_file.put(2)
+
+    await controller.consume.put(True)
+    data = multi_dimensional_array((4, 6), cbor2.CBORTag(69, IMAGE.tobytes()))
+    for message in cbor_messages(8, [0, 1, 2], data):
+        socket.send_multipart(message)
+    for _ in range(50):
+        await controller.update_stream_statistics()
+        if controller.frames_written.get() == 3 and not controller.write_queue.get():
+            break
+        await asyncio.sleep(0.1)
+
+    await controller.consume.put(False)
+    assert controller.files_written.get() == 2
+    with h5py.File(tmp_path / "series_8_master.h5") as master:
+        np.testing.assert_array_equal(master["entry/data/data_000002"], [IMAGE])
+
+
+@pytest.mark.asyncio
+async def test_receiver_parses_cbor_off_the_event_loop(
+    publisher, mocker: MockerFixture
+):
+    socket, endpoint = publisher
+    receiver = StreamReceiver(endpoint, "cbor")
+    decode = receiver._cbor_decoder.decode
+    threads = []
+
+    def _decode(parts):
+        threads.append(threading.get_ident())
+        return decode(parts)
+
+    mocker.patch.object(receiver._cbor_decoder, "decode", side_effect=_decode)
+    socket.send_multipart(cbor_messages(3, [0])[1])
+
+    message = await asyncio.wait_for(receiver.receive(), timeout=5)
+    receiver.close()
+
+    assert message is not None and message.image_id == 0
+    assert threads != [threading.get_ident()]
+    assert len(threads) == 1
+
+
+def test_stream_worker_result_waits_for_ring(mocker: MockerFixture):
+    attach = mocker.spy(FrameRing, "attach")
+    ring_name = f"test_worker_{uuid.uuid4().hex[:8]}"
+    worker = StreamWorker("tcp://127.0.0.1:1", "cbor", ring_name)
+    worker._counters[_Counter.RING_GENERATION] = 1
+
+    # The worker process has not created the ring yet
+    assert worker.last_result is None
+
+    ring = FrameRing.create(ring_name, slot_capacity=48, slots=2)
+    ring.write(np.ones((3, 4), dtype=np.uint32), 0, 1, total_counts=12, max_count=1)
+    result = worker.last_result
+    assert result is not None and result.total_counts == 12
+    attach.assert_called_with(ring_name, track=False)
+
+    worker._close_ring()
+    ring.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_controller_stop_writes_queued_messages(
+    publisher, mocker: MockerFixture, tmp_path
+):
+    _, endpoint = publisher
+    connection = mocker.MagicMock()
+    connection.get = mock.AsyncMock(return_value={"value": "cbor"})
+    controller = EigerStreamController(connection, mock.AsyncMock(), "1.8.0")
+    controller.consume.add_on_update_callback(controller._update_consumer)
+    await controller.stream_endpoint.put(endpoint)
+    await controller.write_files.put(True)
+    await controller.file_directory.put(str(tmp_path))
+
+    await controller.consume.put(True)
+    writer = controller._writer
+    assert writer is not None
+    for message in [
+        StreamMessage("start", 8),
+        *[
+            StreamMessage("image", 8, image_id, data={"threshold_1": IMAGE})
+            for image_id in range(3)
+        ],
+        StreamMessage("end", 8),
+    ]:
+        await writer.put(message)
+
+    await controller.consume.put(False)
+    assert writer.queued == 0
+    assert writer.frames_written == 3
+    with h5py.File(tmp_path / "series_8_master.h5") as master:
+        np.testing.assert_array_equal(master["entry/data/data_000001"], [IMAGE] * 3)
@@ -0,0 +1,91 @@
+from collections import defaultdict
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+
+from fastcs_eiger.vds import VdsMapping, create_interleaved_vds, frame_distribution
+
+
+def test_frame_distribution_maps_each_file_in_bulk():
+    # 7 blocks of 3 frames, with the last block partial, to 2 writers of 2 blocks
+    # per file, so writer 0 writes blocks 0, 2 | 4, 6 and writer 1 blocks 1, 3 | 5
+    assert frame_distribution(20, 3, 2, 2) == {
+        0: [VdsMapping(source_start=0, vds_start=0, stride=6, count=2, block=3)],
+        2: [
+            VdsMapping(source_start=0, vds_start=12, stride=6, count=1, block=3),
+            VdsMapping(source_start=3, vds_start=18, stride=2, count=1, block=2),
+        ],
+        1: [VdsMapping(source_start=0, vds_start=3, stride=6, count=2, block=3)],
+        3: [VdsMapping(source_start=0, vds_start=15, stride=6, count=1, block=3)],
+    }
+
+
+def write_files(
+    directory: Path,
+    frames: int,
+    frames_per_block: int,
+    blocks_per_file: int,
+    file_writers: int,
+):
+    """Write files as the file writers would, with the index of each frame in the
+    acquisition as its value."""
+    files: dict[int, list[int]] = defaultdict(list)
+    for block, start in enumerate(range(0, frames, frames_per_block)):
+        # Blocks go to each writer in turn, which writes files of blocks_per_file
+        writer, writer_block = block % file_writers, block // file_writers
+        file_number = writer_block // blocks_per_file if blocks_per_file else 0
+        files[file_number * file_writers + writer].extend(
+            range(start, min(start + frames_per_block, frames))
+        )
+
+    for file_index, frame_ids in files.items():
+        with h5py.File(directory / f"test_{file_index + 1:06d}.h5", "w") as file:
+            file["data"] = np.repeat(np.array(frame_ids, dtype=np.uint16), 6).reshape(
+                -1, 2, 3
+            )
+
+
+def test_create_interleaved_vds_slices(tmp_path: Path):
+    create_interleaved_vds(
+        tmp_path / "test_vds.h5", "test", 20, (2, 3), np.dtype("uint16"), 3, 2, 2
+    )
+
+    with h5py.File(tmp_path / "test_vds.h5") as vds_file:
+        # (file, (start, stride, count, block) of the VDS, first frame of the file)
+        assert [
+            (
+                source.file_name,
+                source.vspace.get_regular_hyperslab(),
+                source.src_space.get_select_bounds()[0][0],
+            )
+            for source in vds_file["data"].virtual_sources()
+        ] == [
+            ("test_000001.h5", ((0, 0, 0), (6, 1, 1), (2, 1, 1), (3, 2, 3)), 0),
+            ("test_000003.h5", ((12, 0, 0), (1, 1, 1), (1, 1, 1), (3, 2, 3)), 0),
+            ("test_000003.h5", ((18, 0, 0), (1, 1, 1), (1, 1, 1), (2, 2, 3)), 3),
+            ("test_000002.h5", ((3, 0, 0), (6, 1, 1), (2, 1, 1), (3, 2, 3)), 0),
+            ("test_000004.h5", ((15, 0, 0), (1, 1, 1), (1, 1, 1), (3, 2, 3)), 0),
+        ]
+
+
+@pytest.mark.parametrize("blocks_per_file", [0, 1, 2, 5])
+@pytest.mark.parametrize("file_writers", [1, 3, 4])
+def test_create_interleaved_vds(tmp_path: Path, blocks_per_file, file_writers):
+    frames, frames_per_block = 23, 3
+    write_files(tmp_path, frames, frames_per_block, blocks_per_file, file_writers)
+
+    create_interleaved_vds(
+        tmp_path / "test_vds.h5",
+        "test",
+        frames,
+        (2, 3),
+        np.dtype("uint16"),
+        frames_per_block,
+        blocks_per_file,
+        file_writers,
+    )
+
+    with h5py.File(tmp_path / "test_vds.h5") as vds_file:
+        np.testing.assert_array_equal(vds_file["data"][:, 1, 2], np.arange(frames))